@@ -16,6 +16,14 @@ CREATE TABLE `app_config` (
    `race_id` int NOT NULL,
    `last_used` datetime,
    `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP DEFAULT_GENERATED,
+   `calls_ok` int NOT NULL DEFAULT 0,
+   `calls_failed` int NOT NULL DEFAULT 0,
+   `fail_count` int NOT NULL DEFAULT 0,
+   `breaker_trips` int NOT NULL DEFAULT 0,
+   `breaker_open_until` datetime DEFAULT NULL,
+   `last_status` smallint DEFAULT NULL,
+   `last_error` varchar(255) DEFAULT NULL,
+   `last_error_at` datetime DEFAULT NULL,
    PRIMARY KEY (`id`)
  ) ENGI...
 CREATE TABLE `competitor_laps` (
@@ -36,18 +44,61 @@ CREATE TABLE `competitors` (
    `last_name` varchar(100),
    `nationality` varchar(100),
    `additional_data` varchar(100)...
+CREATE TABLE `kart_race_stats` (
+   `race_id` int NOT NULL,
+   `racer_id` int NOT NULL,
+   `number` varchar(20) DEFAULT NULL,
+   `driver` varchar(201) DEFAULT NULL,
+   `laps` int NOT NULL DEFAULT 0,
+   `clean_laps` int NOT NULL DEFAULT 0,
+   `clean_sum_ms` bigint NOT NULL DEFAULT 0,
+   `clean_sumsq_ms` double NOT NULL DEFAULT 0,
+   `best_ms` int DEFAULT NULL,
+   `pits` int NOT NULL DEFAULT 0,
+   `stint_delta_sum_ms` bigint NOT NULL DEFAULT 0,
+   `stint_deltas` int NOT NULL DEFAULT 0,
+   `last_lap` int NOT NULL DEFAULT 0,
+   `stint_open_laps` int NOT NULL DEFAULT 0,
+   `stint_open_sum_ms` bigint NOT NULL DEFAULT 0,
+   `stint_prev_mean_ms` double DEFAULT NULL,
+   `stint_closed_delta_sum_ms` double NOT NULL DEFAULT 0,
+   `stint_closed_deltas` int NOT NULL DEFAULT 0,
+   `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+   PRIMARY KEY (`race_id`, `racer_id`),
+   KEY `idx_number` (`number`),
+   KEY `idx_driver` (`driver`)
+ ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ;
+CREATE TABLE `kart_race_lap_hist` (
+   `race_id` int NOT NULL,
+   `racer_id` int NOT NULL,
+   `bucket_ms` int NOT NULL,
+   `laps` int NOT NULL,
+   PRIMARY KEY (`race_id`, `racer_id`, `bucket_ms`)
+ ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ;
 CREATE TABLE `update_group_2min` (
+   `race_id` int NOT NULL,
    `racer_id` int NOT NULL,
    `last_update` datetime,
-   PRIMARY KEY (`racer_id`)
+   `claimed_by` varchar(64) DEFAULT NULL,
+   `claimed_until` datetime DEFAULT NULL,
+   PRIMARY KEY (`race_id`, `racer_id`),
+   KEY `idx_race_last_update` (`race_id`, `last_update`)
  ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ;
 CREATE TABLE `update_group_4min` (
+   `race_id` int NOT NULL,
    `racer_id` int NOT NULL,
    `last_update` datetime,
-   PRIMARY KEY (`racer_id`)
+   `claimed_by` varchar(64) DEFAULT NULL,
+   `claimed_until` datetime DEFAULT NULL,
+   PRIMARY KEY (`race_id`, `racer_id`),
+   KEY `idx_race_last_update` (`race_id`, `last_update`)
  ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ;
 CREATE TABLE `update_group_rest` (
+   `race_id` int NOT NULL,
    `racer_id` int NOT NULL,
    `last_update` datetime,
-   PRIMARY KEY (`racer_id`)
+   `claimed_by` varchar(64) DEFAULT NULL,
+   `claimed_until` datetime DEFAULT NULL,
+   PRIMARY KEY (`race_id`, `racer_id`),
+   KEY `idx_race_last_update` (`race_id`, `last_update`)
  ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ;
\ No newline at end of file
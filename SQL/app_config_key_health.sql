@@ -0,0 +1,18 @@
+-- ==============================
+-- SAÚDE DAS CHAVES DE API (circuit breaker por chave)
+-- ==============================
+-- fail_count: falhas seguidas da chave; breaker_open_until: enquanto > NOW() a chave sai do rodízio.
+-- calls_ok / calls_failed / breaker_trips: métricas exibidas em /config/app_config.
+
+ALTER TABLE app_config
+  ADD COLUMN calls_ok INT NOT NULL DEFAULT 0,
+  ADD COLUMN calls_failed INT NOT NULL DEFAULT 0,
+  ADD COLUMN fail_count INT NOT NULL DEFAULT 0,
+  ADD COLUMN breaker_trips INT NOT NULL DEFAULT 0,
+  ADD COLUMN breaker_open_until DATETIME NULL DEFAULT NULL,
+  ADD COLUMN last_status SMALLINT NULL DEFAULT NULL,
+  ADD COLUMN last_error VARCHAR(255) NULL DEFAULT NULL,
+  ADD COLUMN last_error_at DATETIME NULL DEFAULT NULL;
+
+-- Seleção da chave menos usada por corrida, ignorando as com breaker aberto
+ALTER TABLE app_config ADD INDEX idx_race_breaker_last_used (race_id, breaker_open_until, last_used);
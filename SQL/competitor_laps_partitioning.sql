@@ -0,0 +1,29 @@
+-- ==============================
+-- PARTICIONAMENTO DE competitor_laps POR race_id
+-- ==============================
+-- Uma partição LIST por corrida (p_<race_id>). Consultas com race_id = constante
+-- leem só a partição da corrida, e arquivar uma corrida vira um DROP PARTITION.
+--
+-- A lista inicial de partições depende das corridas existentes; gere e aplique com:
+--   python3 race_archive.py partition-init --dry-run   (mostra o SQL)
+--   python3 race_archive.py partition-init
+--
+-- Equivalente manual (exemplo com duas corridas):
+
+-- 1) Toda chave única precisa conter a coluna de partição
+ALTER TABLE competitor_laps DROP PRIMARY KEY, ADD PRIMARY KEY (id, race_id);
+
+-- 2) Particiona
+ALTER TABLE competitor_laps PARTITION BY LIST (race_id) (
+  PARTITION p_37820 VALUES IN (37820),
+  PARTITION p_37821 VALUES IN (37821)
+);
+
+-- Nova corrida. Quem grava voltas cria a partição antes do INSERT (race_archive.prepare_race_partitions,
+-- fora da transação: INSERT IGNORE sem partição descartaria as voltas só com um warning). Manualmente:
+--   python3 race_archive.py ensure --race-id 37822
+ALTER TABLE competitor_laps ADD PARTITION (PARTITION p_37822 VALUES IN (37822));
+
+-- Arquivar corrida encerrada (exporta para .mkc e remove a partição):
+--   python3 race_archive.py archive --race-id 37820
+--   python3 race_archive.py query --race-id 37820 --racer-id 12 > voltas.csv
@@ -0,0 +1,40 @@
+-- ==============================
+-- AGREGADOS POR KART/PILOTO ENTRE CORRIDAS
+-- ==============================
+-- Uma linha por (race_id, racer_id) com contagens/somas das voltas limpas, box e delta entre stints,
+-- mais o histograma das voltas limpas (buckets de MYKART_KART_HIST_BUCKET_MS) para os percentis.
+-- Mantidas por kart_aggregates.refresh_touched após cada flush: as voltas gravadas entram como delta
+-- (last_lap e stint_* guardam o estado do stint aberto entre um flush e outro).
+-- Carga inicial: python3 kart_aggregates.py rebuild  (e --from-archive para corridas já arquivadas).
+
+CREATE TABLE `kart_race_stats` (
+   `race_id` int NOT NULL,
+   `racer_id` int NOT NULL,
+   `number` varchar(20) DEFAULT NULL,
+   `driver` varchar(201) DEFAULT NULL,
+   `laps` int NOT NULL DEFAULT 0,
+   `clean_laps` int NOT NULL DEFAULT 0,
+   `clean_sum_ms` bigint NOT NULL DEFAULT 0,
+   `clean_sumsq_ms` double NOT NULL DEFAULT 0,
+   `best_ms` int DEFAULT NULL,
+   `pits` int NOT NULL DEFAULT 0,
+   `stint_delta_sum_ms` bigint NOT NULL DEFAULT 0,
+   `stint_deltas` int NOT NULL DEFAULT 0,
+   `last_lap` int NOT NULL DEFAULT 0,
+   `stint_open_laps` int NOT NULL DEFAULT 0,
+   `stint_open_sum_ms` bigint NOT NULL DEFAULT 0,
+   `stint_prev_mean_ms` double DEFAULT NULL,
+   `stint_closed_delta_sum_ms` double NOT NULL DEFAULT 0,
+   `stint_closed_deltas` int NOT NULL DEFAULT 0,
+   `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+   PRIMARY KEY (`race_id`, `racer_id`),
+   KEY `idx_number` (`number`),
+   KEY `idx_driver` (`driver`)
+ ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ;
+CREATE TABLE `kart_race_lap_hist` (
+   `race_id` int NOT NULL,
+   `racer_id` int NOT NULL,
+   `bucket_ms` int NOT NULL,
+   `laps` int NOT NULL,
+   PRIMARY KEY (`race_id`, `racer_id`, `bucket_ms`)
+ ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ;
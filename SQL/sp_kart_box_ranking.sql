@@ -19,6 +19,7 @@ BEGIN
   DECLARE v_now_sec INT DEFAULT 0;
   DECLARE v_min_self_laps INT DEFAULT 1;
   DECLARE v_min_field_laps INT DEFAULT 1;
+  DECLARE v_race_id INT DEFAULT NULL;
 
   IF p_min_self_laps IS NOT NULL AND p_min_self_laps >= 1 THEN
     SET v_min_self_laps = p_min_self_laps;
@@ -35,6 +36,13 @@ BEGIN
     SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Faixa de PIT 2 inválida: ambos limites devem existir e min <= max, ou ambos NULL.';
   END IF;
 
+  -- race_id NULL = corrida ativa (app_config id=1). Filtrar por uma constante
+  -- permite partition pruning em competitor_laps (só a partição da corrida é lida).
+  SET v_race_id = p_race_id;
+  IF v_race_id IS NULL THEN
+    SELECT race_id INTO v_race_id FROM my_karting_app.app_config WHERE id = 1;
+  END IF;
+
   -- Harden: aceita apenas HH:MM ou HH:MM:SS
   IF p_override_now_hhmm IS NOT NULL AND p_override_now_hhmm <> '' THEN
     IF p_override_now_hhmm REGEXP '^[0-9]{1,2}:[0-9]{2}(:[0-9]{2})?$' THEN
@@ -55,7 +63,7 @@ BEGIN
          TIME_TO_SEC(lap_time) AS lt_sec,
          TIME_TO_SEC(total_time) AS tt_sec
   FROM my_karting_app.competitor_laps
-  WHERE (p_race_id IS NULL OR race_id = p_race_id);
+  WHERE race_id = v_race_id;
 
   SELECT COALESCE(MAX(tt_sec), 0) INTO v_max_sec FROM tmp_base;
   IF v_override_sec IS NOT NULL THEN
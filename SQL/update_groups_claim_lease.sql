@@ -0,0 +1,19 @@
+-- ==============================
+-- LEASE DE RACERS NOS GRUPOS (vários workers do scheduler)
+-- ==============================
+-- Cada worker reivindica o racer com SELECT ... FOR UPDATE SKIP LOCKED e grava
+-- claimed_by/claimed_until; enquanto claimed_until > NOW() nenhum outro worker o pega.
+-- Se o worker morrer, o lease expira e o racer volta a ficar disponível.
+-- Requer MySQL 8.0+ (SKIP LOCKED).
+
+ALTER TABLE update_group_2min
+  ADD COLUMN claimed_by VARCHAR(64) NULL DEFAULT NULL,
+  ADD COLUMN claimed_until DATETIME NULL DEFAULT NULL;
+
+ALTER TABLE update_group_4min
+  ADD COLUMN claimed_by VARCHAR(64) NULL DEFAULT NULL,
+  ADD COLUMN claimed_until DATETIME NULL DEFAULT NULL;
+
+ALTER TABLE update_group_rest
+  ADD COLUMN claimed_by VARCHAR(64) NULL DEFAULT NULL,
+  ADD COLUMN claimed_until DATETIME NULL DEFAULT NULL;
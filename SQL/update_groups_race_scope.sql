@@ -0,0 +1,31 @@
+-- ==============================
+-- GRUPOS DE ATUALIZAÇÃO POR CORRIDA (multi-race)
+-- ==============================
+-- Os grupos passam a ter race_id na chave: a mesma instalação acompanha várias corridas
+-- ao mesmo tempo (uma ou mais chaves em app_config por race_id).
+-- Linhas já existentes são atribuídas à corrida de app_config id=1.
+
+SET @current_race_id = (SELECT race_id FROM app_config WHERE id = 1);
+
+ALTER TABLE update_group_2min
+  ADD COLUMN race_id INT NOT NULL DEFAULT 0 FIRST,
+  DROP PRIMARY KEY, ADD PRIMARY KEY (race_id, racer_id);
+UPDATE update_group_2min SET race_id = @current_race_id WHERE race_id = 0;
+ALTER TABLE update_group_2min ALTER COLUMN race_id DROP DEFAULT;
+
+ALTER TABLE update_group_4min
+  ADD COLUMN race_id INT NOT NULL DEFAULT 0 FIRST,
+  DROP PRIMARY KEY, ADD PRIMARY KEY (race_id, racer_id);
+UPDATE update_group_4min SET race_id = @current_race_id WHERE race_id = 0;
+ALTER TABLE update_group_4min ALTER COLUMN race_id DROP DEFAULT;
+
+ALTER TABLE update_group_rest
+  ADD COLUMN race_id INT NOT NULL DEFAULT 0 FIRST,
+  DROP PRIMARY KEY, ADD PRIMARY KEY (race_id, racer_id);
+UPDATE update_group_rest SET race_id = @current_race_id WHERE race_id = 0;
+ALTER TABLE update_group_rest ALTER COLUMN race_id DROP DEFAULT;
+
+-- Índice para o scheduler (candidato mais antigo da corrida)
+ALTER TABLE update_group_2min ADD INDEX idx_race_last_update (race_id, last_update);
+ALTER TABLE update_group_4min ADD INDEX idx_race_last_update (race_id, last_update);
+ALTER TABLE update_group_rest ADD INDEX idx_race_last_update (race_id, last_update);
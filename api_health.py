@@ -0,0 +1,133 @@
+
+import os
+import random
+import time
+
+# ====================== CONFIG ======================
+# Circuit breaker por chave (estado em app_config, compartilhado entre os processos do cron):
+#   BREAKER_THRESHOLD falhas seguidas → chave sai do rodízio até breaker_open_until;
+#   depois disso a próxima chamada com ela é o "probe": sucesso fecha, falha reabre por mais tempo.
+BREAKER_THRESHOLD = int(os.environ.get("MYKART_BREAKER_THRESHOLD", 3))
+BREAKER_BASE_S = float(os.environ.get("MYKART_BREAKER_BASE_S", 30))
+BREAKER_MAX_S = float(os.environ.get("MYKART_BREAKER_MAX_S", 900))
+BREAKER_AUTH_S = float(os.environ.get("MYKART_BREAKER_AUTH_S", 3600))  # chave inválida/revogada
+API_MAX_ATTEMPTS = int(os.environ.get("MYKART_API_MAX_ATTEMPTS", 3))   # tentativas por chamada (rodando a chave)
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 8.0
+
+# Filtro SQL das chaves disponíveis (breaker fechado ou já expirado = probe)
+KEY_AVAILABLE_SQL = "(breaker_open_until IS NULL OR breaker_open_until <= NOW())"
+
+# Classes de falha
+OK = "ok"
+THROTTLED = "throttled"   # 429 / mensagem de limite: abre o breaker já na 1ª vez
+AUTH = "auth"             # 401/403 / token inválido: abre por BREAKER_AUTH_S
+SERVER = "server"         # 5xx
+TRANSPORT = "transport"   # timeout, conexão recusada, resposta truncada
+BAD_PAYLOAD = "bad_payload"
+API_ERROR = "api_error"   # Successful=false por motivo que não é da chave (ex.: racer inexistente)
+
+RETRYABLE = {THROTTLED, SERVER, TRANSPORT, BAD_PAYLOAD}
+KEY_FAULTS = {THROTTLED, AUTH, SERVER, TRANSPORT, BAD_PAYLOAD}
+
+_THROTTLE_WORDS = ("limit", "too many", "exceed", "throttl")
+_AUTH_WORDS = ("token", "unauthor", "forbidden", "not authorized", "invalid key")
+
+def classify(status=None, error=None, payload=None):
+    """Classifica o resultado de uma chamada à API em uma das classes acima."""
+    if error is not None:
+        return TRANSPORT
+    if status == 429:
+        return THROTTLED
+    if status in (401, 403):
+        return AUTH
+    if status is not None and status >= 500:
+        return SERVER
+    if payload is None:
+        return BAD_PAYLOAD
+    if isinstance(payload, dict) and payload.get("Successful") is False:
+        message = str(payload.get("Message") or "").lower()
+        if any(w in message for w in _THROTTLE_WORDS):
+            return THROTTLED
+        if any(w in message for w in _AUTH_WORDS):
+            return AUTH
+        return API_ERROR
+    return OK
+
+def retry_after_seconds(headers):
+    """Lê Retry-After (segundos) da resposta, se houver."""
+    try:
+        value = headers.get("Retry-After") if headers is not None else None
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=BACKOFF_BASE_S, cap=BACKOFF_MAX_S):
+    """Exponencial com jitter completo: uniforme em [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def sleep_backoff(attempt):
+    time.sleep(backoff_delay(attempt))
+
+def _open_seconds(kind, fail_count, retry_after=None):
+    if kind == AUTH:
+        return BREAKER_AUTH_S
+    exp = max(0, fail_count - BREAKER_THRESHOLD)
+    seconds = min(BREAKER_MAX_S, BREAKER_BASE_S * (2 ** exp))
+    if retry_after:
+        seconds = max(seconds, retry_after)
+    return seconds * random.uniform(0.8, 1.2)  # jitter: processos não reabrem todos juntos
+
+def record_result(conn, api_id, kind, status=None, detail=None, retry_after=None):
+    """
+    Atualiza as métricas e o breaker da chave conforme a classe do resultado.
+    Retorna os segundos de breaker aberto (0 se a chave continua no rodízio).
+    """
+    cur = conn.cursor()
+    try:
+        if kind not in KEY_FAULTS:
+            cur.execute("""
+                UPDATE app_config
+                SET fail_count = 0, breaker_open_until = NULL, calls_ok = calls_ok + 1, last_status = %s
+                WHERE id = %s
+            """, (status, api_id))
+            conn.commit()
+            return 0
+
+        cur.execute("""
+            UPDATE app_config
+            SET fail_count = fail_count + 1, calls_failed = calls_failed + 1,
+                last_status = %s, last_error = %s, last_error_at = NOW()
+            WHERE id = %s
+        """, (status, f"{kind}: {detail or ''}"[:255], api_id))
+        cur.execute("SELECT fail_count FROM app_config WHERE id = %s", (api_id,))
+        row = cur.fetchone()
+        fail_count = int(row[0]) if row else 0
+
+        seconds = 0
+        if kind in (THROTTLED, AUTH) or fail_count >= BREAKER_THRESHOLD:
+            seconds = _open_seconds(kind, fail_count, retry_after)
+            cur.execute("""
+                UPDATE app_config
+                SET breaker_open_until = NOW() + INTERVAL %s SECOND, breaker_trips = breaker_trips + 1
+                WHERE id = %s
+            """, (int(round(seconds)), api_id))
+        conn.commit()
+        return seconds
+    finally:
+        cur.close()
+
+def key_metrics(conn):
+    """Métricas por chave para o webapp: erros, estado do breaker e último erro."""
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(f"""
+            SELECT id, race_id, last_used, calls_ok, calls_failed, fail_count, breaker_trips,
+                   breaker_open_until, NOT {KEY_AVAILABLE_SQL} AS breaker_open,
+                   last_status, last_error, last_error_at
+            FROM app_config
+            ORDER BY id
+        """)
+        return cur.fetchall()
+    finally:
+        cur.close()
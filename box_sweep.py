@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+from lap_stats import load_race_laps
+
+# ====================== CONFIG ======================
+# Mesma lógica de sp_kart_box_ranking / sp_kart_box_summary, vetorizada em numpy: as voltas da
+# corrida são lidas UMA vez e cada faixa de box candidata custa só algumas buscas binárias.
+WINDOWS_MIN = (5, 10, 15, 20, 25)  # tmp_janelas das procedures
+SWEEP_WINDOW_MIN = 25              # janela usada no heatmap da varredura
+SWEEP_MAX_RANGES = 200
+MIN_SELF_LAPS = 1                  # BASE_PARAMS: p_min_self_laps / p_min_field_laps
+MIN_FIELD_LAPS = 1
+
+def nivel(prob_fast):
+    """Mesma escala de 1 a 5 de sp_kart_box_summary."""
+    for level, threshold in ((5, 0.80), (4, 0.60), (3, 0.40), (2, 0.20)):
+        if prob_fast >= threshold:
+            return level
+    return 1
+
+# ====================== ENTRADA ======================
+class BoxLaps:
+    """Voltas válidas da corrida em segundos (como TIME_TO_SEC nas procedures), ordenadas por (racer_id, tt)."""
+
+    def __init__(self, racer_id, lt_sec, tt_sec):
+        racer_id = np.asarray(racer_id, dtype=np.int64)
+        lt_sec = np.asarray(lt_sec, dtype=np.float64)
+        tt_sec = np.asarray(tt_sec, dtype=np.float64)
+        ok = ~np.isnan(lt_sec) & ~np.isnan(tt_sec)
+        racer_id, lt_sec, tt_sec = racer_id[ok], lt_sec[ok], tt_sec[ok]
+        order = np.lexsort((tt_sec, racer_id))
+        self.racer_id = racer_id[order]
+        self.lt = lt_sec[order]
+        self.tt = tt_sec[order]
+        self.racer_ids, self.group = np.unique(self.racer_id, return_inverse=True)
+        self.now = float(self.tt.max()) if len(self.tt) else 0.0
+        # Chave (kart, tempo) em um float: busca binária nas voltas de um kart num intervalo de tempo
+        self._span = self.now + 1.0
+        self.key = self.group * self._span + self.tt
+
+    def __len__(self):
+        return len(self.racer_id)
+
+    def own_key(self, group, t):
+        return group * self._span + t
+
+def load_box_laps(conn, race_id):
+    """Carrega todas as voltas da corrida em uma query (reaproveita lap_stats.load_race_laps)."""
+    laps = load_race_laps(conn, race_id, last_n=None)
+    return BoxLaps(laps.racer_id, laps.lap_ms / 1000.0, laps.total_ms / 1000.0)
+
+# ====================== AVALIAÇÃO ======================
+def _range_sums(key, values, lo, hi, lo_side, hi_side):
+    """(soma, contagem) de values com key entre lo e hi; key ordenada, values já acumulados (cumsum com 0 à frente)."""
+    a = np.searchsorted(key, lo, side=lo_side)
+    b = np.searchsorted(key, hi, side=hi_side)
+    return values[b] - values[a], (b - a).astype(np.float64)
+
+def evaluate(laps, ranges, windows=WINDOWS_MIN, min_self_laps=MIN_SELF_LAPS, min_field_laps=MIN_FIELD_LAPS):
+    """
+    Avalia uma faixa de box (ranges = [(min_s, max_s)] com 1 ou 2 intervalos, como p_pit_min/max 1 e 2).
+    Retorna (ranking, pits_detected):
+      ranking = [(win_min, racer_id, self_avg_sec, field_avg_sec, delta_sec)] por janela, delta desc
+      pits_detected = voltas de box detectadas na corrida inteira com essa faixa
+    """
+    if not len(laps):
+        return [], 0
+    is_pit = np.zeros(len(laps), dtype=bool)
+    for mn, mx in ranges:
+        is_pit |= (laps.lt >= mn) & (laps.lt <= mx)
+    clean = ~is_pit
+
+    # Voltas limpas: acumulados por (kart, tempo) e, para o "campo", por tempo em todos os karts
+    own_key = laps.key[clean]
+    own_sum = np.concatenate(([0.0], np.cumsum(laps.lt[clean])))
+    t_order = np.argsort(laps.tt[clean], kind="stable")
+    all_tt = laps.tt[clean][t_order]
+    all_sum = np.concatenate(([0.0], np.cumsum(laps.lt[clean][t_order])))
+
+    # Paradas com a anterior do mesmo kart (LAG) ou 0
+    pit_idx = np.flatnonzero(is_pit)
+    pit_group = laps.group[pit_idx]
+    pit_tt = laps.tt[pit_idx]
+    prev_tt = np.zeros(len(pit_idx))
+    same = pit_group[1:] == pit_group[:-1]
+    prev_tt[1:][same] = pit_tt[:-1][same]
+
+    # Stint do próprio kart: prev < tt < pit (estrito); campo: prev <= tt <= pit, demais karts
+    self_sum, self_n = _range_sums(own_key, own_sum, laps.own_key(pit_group, prev_tt),
+                                   laps.own_key(pit_group, pit_tt), "right", "left")
+    all_s, all_n = _range_sums(all_tt, all_sum, prev_tt, pit_tt, "left", "right")
+    mine_s, mine_n = _range_sums(own_key, own_sum, laps.own_key(pit_group, prev_tt),
+                                 laps.own_key(pit_group, pit_tt), "left", "right")
+    field_sum, field_n = all_s - mine_s, all_n - mine_n
+
+    age = laps.now - pit_tt
+    ranking = []
+    for win in windows:
+        recent = (age >= 0) & (age <= win * 60)
+        if not recent.any():
+            continue
+        # Campo agregado por kart em todas as paradas recentes dele (GROUP BY win_min, racer_id)
+        n_groups = len(laps.racer_ids)
+        f_sum = np.bincount(pit_group[recent], weights=field_sum[recent], minlength=n_groups)
+        f_n = np.bincount(pit_group[recent], weights=field_n[recent], minlength=n_groups)
+        ok = recent & (self_n >= min_self_laps) & (f_n[pit_group] >= max(min_field_laps, 1))
+        rows = []
+        for i in np.flatnonzero(ok):
+            g = pit_group[i]
+            self_avg = float(self_sum[i] / self_n[i])
+            field_avg = float(f_sum[g] / f_n[g])
+            rows.append((win, int(laps.racer_ids[g]), round(self_avg, 3), round(field_avg, 3),
+                         round(field_avg - self_avg, 3)))
+        rows.sort(key=lambda r: -r[4])
+        ranking.extend(rows)
+    return ranking, int(len(pit_idx))
+
+def summarize(ranking, windows=WINDOWS_MIN):
+    """Resumo por janela como sp_kart_box_summary: (janela_minutos, pits_count, prob_fast, avg_delta_sec, nivel)."""
+    out = []
+    for win in windows:
+        deltas = [r[4] for r in ranking if r[0] == win]
+        if deltas:
+            prob = sum(1 for d in deltas if d > 0) / len(deltas)
+            out.append((win, len(deltas), round(prob, 3), round(sum(deltas) / len(deltas), 3), nivel(prob)))
+        else:
+            out.append((win, 0, 0, 0, 1))
+    return out
+
+RANKING_COLUMNS = ["win_min", "racer_id", "self_avg_sec", "field_avg_sec", "delta_sec"]
+SUMMARY_COLUMNS = ["janela_minutos", "pits_count", "prob_fast", "avg_delta_sec", "nivel"]
+
+# ====================== VARREDURA ======================
+def build_grid(min_from, min_to, max_from, max_to, step=5):
+    """Todas as faixas (pit_min, pit_max) com pit_min < pit_max nos intervalos dados, em passos de step segundos."""
+    if step <= 0:
+        raise ValueError("Passo deve ser > 0.")
+    grid = [(mn, mx)
+            for mn in range(int(min_from), int(min_to) + 1, int(step))
+            for mx in range(int(max_from), int(max_to) + 1, int(step))
+            if mn < mx]
+    if not grid:
+        raise ValueError("Grade vazia: confira os limites (pit_min precisa ser < pit_max).")
+    if len(grid) > SWEEP_MAX_RANGES:
+        raise ValueError(f"Grade com {len(grid)} faixas; máximo {SWEEP_MAX_RANGES} (aumente o passo).")
+    return grid
+
+def sweep(laps, grid, win_min=SWEEP_WINDOW_MIN):
+    """
+    Avalia cada faixa da grade sobre as mesmas voltas.
+    Retorna dict com racer_ids (colunas do heatmap) e, por faixa: label, pits (box detectados),
+    deltas {racer_id: delta médio na janela win_min} e summary (linha do resumo dessa janela).
+    """
+    rows, seen = [], set()
+    for mn, mx in grid:
+        ranking, pits = evaluate(laps, [(mn, mx)], windows=(win_min,))
+        per_kart = {}
+        for _, rid, _, _, delta in ranking:
+            per_kart.setdefault(rid, []).append(delta)
+        deltas = {rid: round(sum(v) / len(v), 3) for rid, v in per_kart.items()}
+        seen.update(deltas)
+        summary = summarize(ranking, windows=(win_min,))[0]
+        rows.append({"label": f"{mn}-{mx}", "pit_min": mn, "pit_max": mx, "pits": pits,
+                     "deltas": deltas, "summary": dict(zip(SUMMARY_COLUMNS, summary))})
+    return {"win_min": win_min, "racer_ids": sorted(seen), "ranges": rows}
+
+# ====================== CLI (heatmap CSV) ======================
+def main():
+    parser = argparse.ArgumentParser(description="Varredura de faixas de box: delta por kart e box detectados (CSV).")
+    parser.add_argument("--race-id", type=int, required=True)
+    parser.add_argument("--min-from", type=int, default=220)
+    parser.add_argument("--min-to", type=int, default=260)
+    parser.add_argument("--max-from", type=int, default=240)
+    parser.add_argument("--max-to", type=int, default=280)
+    parser.add_argument("--step", type=int, default=10)
+    parser.add_argument("--window", type=int, default=SWEEP_WINDOW_MIN, help="Janela (min) antes do fim dos dados.")
+    args = parser.parse_args()
+
+    from db_config import get_mysql_conn
+    conn = get_mysql_conn()
+    try:
+        laps = load_box_laps(conn, args.race_id)
+    finally:
+        conn.close()
+
+    result = sweep(laps, build_grid(args.min_from, args.min_to, args.max_from, args.max_to, args.step), args.window)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["faixa", "pits", "prob_fast", "avg_delta_sec"] + result["racer_ids"])
+    for row in result["ranges"]:
+        writer.writerow([row["label"], row["pits"], row["summary"]["prob_fast"], row["summary"]["avg_delta_sec"]]
+                        + [row["deltas"].get(rid, "") for rid in result["racer_ids"]])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+
+import csv
+import os
+import tempfile
+
+from kart_aggregates import refresh_touched
+from race_archive import prepare_race_partitions
+from write_behind import COMPETITOR_COLUMNS
+
+# ====================== CONFIG ======================
+# Carga em massa para backfills históricos: as linhas vão para CSVs temporários, entram em
+# tabelas de staging com LOAD DATA LOCAL INFILE e são mescladas com SQL set-based.
+# Requer local_infile=ON no servidor MySQL (SET GLOBAL local_infile = 1).
+BULK_MAX_LAP_ROWS = int(os.environ.get("MYKART_BULK_MAX_LAP_ROWS", 2_000_000))  # flush intermediário
+BULK_TMP_DIR = os.environ.get("MYKART_BULK_TMP_DIR") or None
+
+LAP_COLUMNS = ("race_id", "racer_id", "lap_number", "position", "lap_time", "flag_status", "total_time")
+
+STAGE_COMPETITORS_DDL = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS stg_competitors (
+        racer_id INT NOT NULL, race_id INT NOT NULL,
+        number VARCHAR(20), transponder VARCHAR(50), first_name VARCHAR(100), last_name VARCHAR(100),
+        nationality VARCHAR(100), additional_data VARCHAR(255), class_id INT, position INT,
+        laps_completed INT, total_time VARCHAR(20), best_position INT, best_lap INT,
+        best_lap_time VARCHAR(20), last_lap_time VARCHAR(20),
+        PRIMARY KEY (race_id, racer_id)
+    ) ENGINE=InnoDB
+"""
+
+STAGE_LAPS_DDL = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS stg_competitor_laps (
+        race_id INT NOT NULL, racer_id INT NOT NULL, lap_number INT NOT NULL,
+        position INT, lap_time VARCHAR(20), flag_status VARCHAR(50), total_time VARCHAR(20)
+    ) ENGINE=InnoDB
+"""
+
+LOAD_SQL = """
+    LOAD DATA LOCAL INFILE %s
+    INTO TABLE {table}
+    CHARACTER SET utf8mb4
+    FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+    LINES TERMINATED BY '\\n'
+    ({columns})
+"""
+
+MERGE_COMPETITORS_SQL = f"""
+    INSERT INTO competitors ({", ".join(COMPETITOR_COLUMNS)}, updated_at)
+    SELECT {", ".join(COMPETITOR_COLUMNS)}, NOW() FROM stg_competitors
+    ON DUPLICATE KEY UPDATE
+        position=VALUES(position), laps_completed=VALUES(laps_completed),
+        total_time=VALUES(total_time), best_position=VALUES(best_position),
+        best_lap=VALUES(best_lap), best_lap_time=VALUES(best_lap_time),
+        last_lap_time=VALUES(last_lap_time), updated_at=NOW()
+"""
+
+MERGE_LAPS_SQL = f"""
+    INSERT IGNORE INTO competitor_laps ({", ".join(LAP_COLUMNS)})
+    SELECT {", ".join(LAP_COLUMNS)} FROM stg_competitor_laps
+"""
+
+class BulkLoader:
+    """
+    Mesma interface do WriteBehindBuffer (add_competitor/add_laps/after_flush/flush/close),
+    mas cada flush é: CSV → LOAD DATA LOCAL INFILE → INSERT ... SELECT (um commit).
+    A conexão precisa ser aberta com allow_local_infile=True.
+    Competidor repetido: vale a última linha recebida.
+    """
+
+    def __init__(self, conn, max_lap_rows=BULK_MAX_LAP_ROWS, tmp_dir=BULK_TMP_DIR):
+        self.conn = conn
+        self.max_lap_rows = max_lap_rows
+        self.tmp_dir = tmp_dir
+        self._competitors = {}
+        self._race_ids = set()
+        self._callbacks = []
+        self._laps_file = None
+        self._laps_writer = None
+        self._lap_rows = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.laps_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.rollback()
+            self._discard_laps_file()
+        return False
+
+    def _open_laps_file(self):
+        self._laps_file = tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".csv",
+                                                      prefix="mykart_laps_", dir=self.tmp_dir, delete=False)
+        self._laps_writer = csv.writer(self._laps_file, lineterminator="\n")
+
+    def _discard_laps_file(self):
+        if self._laps_file is not None:
+            self._laps_file.close()
+            os.unlink(self._laps_file.name)
+            self._laps_file = self._laps_writer = None
+            self._lap_rows = 0
+
+    def add_competitor(self, values, lap_rows=()):
+        """values na ordem de COMPETITOR_COLUMNS; lap_rows na ordem de LAP_COLUMNS. Retorna None (gravação adiada)."""
+        self._competitors[(values[1], values[0])] = tuple(values)
+        self._race_ids.add(values[1])
+        return self.add_laps(values[1], lap_rows)
+
+    def add_laps(self, race_id, rows):
+        if not rows:
+            return None
+        if self._laps_writer is None:
+            self._open_laps_file()
+        self._laps_writer.writerows(rows)
+        self._lap_rows += len(rows)
+        self._race_ids.add(race_id)
+        if self._lap_rows >= self.max_lap_rows:
+            return self.flush()
+        return None
+
+    def after_flush(self, callback):
+        if not self._competitors and not self._lap_rows:
+            callback()
+            return
+        self._callbacks.append(callback)
+
+    def _load(self, cur, path, table, columns):
+        cur.execute(LOAD_SQL.format(table=table, columns=", ".join(columns)), (path,))
+
+    def _staged_laps(self, race_id):
+        """
+        Voltas deste flush ainda na staging (tabela temporária da sessão), para o delta dos agregados.
+        Inclui as que o INSERT IGNORE descartou; apply_flushed_laps filtra pelo last_lap de cada racer.
+        """
+        cur = self.conn.cursor()
+        try:
+            cur.execute(f"SELECT {', '.join(LAP_COLUMNS)} FROM stg_competitor_laps WHERE race_id = %s", (race_id,))
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def flush(self):
+        """Carrega e mescla tudo que foi acumulado. Retorna as voltas novas gravadas."""
+        if not self._competitors and not self._lap_rows:
+            return 0
+
+        # ALTER TABLE ... ADD PARTITION faz commit implícito: cria as partições antes da transação
+        prepare_race_partitions(self.conn, self._race_ids)
+
+        comp_path = None
+        cur = self.conn.cursor()
+        written = 0
+        try:
+            cur.execute(STAGE_COMPETITORS_DDL)
+            cur.execute(STAGE_LAPS_DDL)
+            cur.execute("TRUNCATE TABLE stg_competitors")
+            cur.execute("TRUNCATE TABLE stg_competitor_laps")
+
+            if self._competitors:
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".csv",
+                                                 prefix="mykart_comp_", dir=self.tmp_dir, delete=False) as f:
+                    csv.writer(f, lineterminator="\n").writerows(self._competitors.values())
+                    comp_path = f.name
+                self._load(cur, comp_path, "stg_competitors", COMPETITOR_COLUMNS)
+                cur.execute(MERGE_COMPETITORS_SQL)
+
+            if self._lap_rows:
+                self._laps_file.close()
+                self._load(cur, self._laps_file.name, "stg_competitor_laps", LAP_COLUMNS)
+                cur.execute(MERGE_LAPS_SQL)
+                written = max(cur.rowcount, 0)
+
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+            if comp_path:
+                os.unlink(comp_path)
+
+        self.flushes += 1
+        self.rows_flushed += len(self._competitors) + self._lap_rows
+        self.laps_written += written
+        self._discard_laps_file()
+        if written:
+            for race_id in sorted(self._race_ids):  # uma corrida por vez: só as voltas deste flush em memória
+                refresh_touched(self.conn, {race_id: self._staged_laps(race_id)})
+        callbacks = self._callbacks
+        self._competitors, self._race_ids, self._callbacks = {}, set(), []
+        for callback in callbacks:
+            callback()
+        return written
+
+    def close(self):
+        self.flush()
@@ -2,8 +2,13 @@
 #!/usr/bin/env python3
 import argparse
 import sys
+import time
 
 from db_config import get_mysql_conn
+from payload_hash import forget_hashes
+
+PURGE_BATCH_SIZE = 1000
+PURGE_SLEEP_MS = 100
 
 def run_sql(conn, sql, params=None):
     cur = conn.cursor()
@@ -11,15 +16,114 @@ def run_sql(conn, sql, params=None):
     conn.commit()
     cur.close()
 
+# ====================== PURGE (online, em lotes) ======================
+def races_older_than(conn, days):
+    """race_ids cujo último updated_at em competitors é anterior a NOW() - days."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT race_id FROM competitors
+        GROUP BY race_id
+        HAVING MAX(updated_at) < NOW() - INTERVAL %s DAY
+        ORDER BY race_id
+    """, (int(days),))
+    ids = [r[0] for r in cur.fetchall()]
+    cur.close()
+    return ids
+
+def count_race_rows(conn, table, race_id):
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM {table} WHERE race_id = %s", (race_id,))
+    total = cur.fetchone()[0]
+    cur.close()
+    return total
+
+def _purge_laps_batch(conn, race_id, last_id, batch_size):
+    """Apaga o próximo lote de voltas da corrida em ordem de PK. Retorna (apagadas, último id)."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id FROM competitor_laps
+        WHERE race_id = %s AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (race_id, last_id, batch_size))
+    ids = [r[0] for r in cur.fetchall()]
+    if not ids:
+        cur.close()
+        return 0, last_id
+    # Lista explícita de ids: trava só as linhas da corrida, não o intervalo inteiro da PK
+    placeholders = ",".join(["%s"] * len(ids))
+    cur.execute(f"DELETE FROM competitor_laps WHERE race_id = %s AND id IN ({placeholders})", [race_id] + ids)
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return deleted, ids[-1]
+
+def _purge_competitors_batch(conn, race_id, batch_size):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM competitors WHERE race_id = %s ORDER BY racer_id LIMIT %s", (race_id, batch_size))
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return deleted, None
+
+def purge_race(conn, race_id, tables=("competitor_laps", "competitors"),
+               batch_size=PURGE_BATCH_SIZE, sleep_ms=PURGE_SLEEP_MS, progress=print):
+    """
+    Remove os dados de uma corrida em lotes pequenos (um commit por lote, pausa entre lotes),
+    para não segurar locks nem inflar o undo log enquanto o scheduler grava.
+    Retorna {tabela: linhas apagadas}.
+    """
+    result = {}
+    for table in tables:
+        total = count_race_rows(conn, table, race_id)
+        done, last_id = 0, 0
+        while done < total or total == 0:
+            if table == "competitor_laps":
+                deleted, last_id = _purge_laps_batch(conn, race_id, last_id, batch_size)
+            else:
+                deleted, _ = _purge_competitors_batch(conn, race_id, batch_size)
+            if not deleted:
+                break
+            done += deleted
+            pct = (100.0 * done / total) if total else 100.0
+            progress(f"→ {table} race_id={race_id}: {done}/{total} ({pct:.0f}%)")
+            if sleep_ms:
+                time.sleep(sleep_ms / 1000.0)
+        result[table] = done
+    return result
+
 def main():
     parser = argparse.ArgumentParser(
         description="Limpa as tabelas competitors e competitor_laps sem confirmação."
     )
     parser.add_argument(
         "--method",
-        choices=["truncate", "delete"],
+        choices=["truncate", "delete", "purge"],
         default="truncate",
-        help="Método de limpeza: TRUNCATE (mais rápido, zera AUTO_INCREMENT) ou DELETE (mantém AUTO_INCREMENT)."
+        help="Método de limpeza: TRUNCATE (mais rápido, zera AUTO_INCREMENT), DELETE (mantém AUTO_INCREMENT) "
+             "ou PURGE (por corrida, em lotes, seguro com o scheduler rodando)."
+    )
+    parser.add_argument(
+        "--race-id",
+        type=int,
+        help="PURGE: corrida a remover."
+    )
+    parser.add_argument(
+        "--older-than-days",
+        type=int,
+        help="PURGE: remove corridas sem atualização em competitors há mais de N dias."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=PURGE_BATCH_SIZE,
+        help=f"PURGE: linhas por lote (padrão {PURGE_BATCH_SIZE})."
+    )
+    parser.add_argument(
+        "--sleep-ms",
+        type=int,
+        default=PURGE_SLEEP_MS,
+        help=f"PURGE: pausa entre lotes em ms (padrão {PURGE_SLEEP_MS})."
     )
     parser.add_argument(
         "--only-competitors",
@@ -50,6 +154,10 @@ def main():
         "competitors + competitor_laps"
     )
 
+    if args.method == "purge":
+        run_purge(args)
+        return
+
     print("⚠️ Executando limpeza direta (sem confirmação).")
     print(f"→ Método: {args.method.upper()}")
     print(f"→ Tabelas a limpar: {alvo}")
@@ -91,6 +199,7 @@ def main():
     try:
         for q in queries:
             run_sql(conn, q)
+        _forget_hashes()
         print("✅ Limpeza concluída com sucesso.")
     except Exception as e:
         conn.rollback()
@@ -99,5 +208,59 @@ def main():
     finally:
         conn.close()
 
+def _forget_hashes(race_id=None):
+    """Dados apagados: o scheduler não pode pular o próximo payload por ser igual ao último gravado."""
+    try:
+        forget_hashes(race_id)
+    except Exception as e:
+        print(f"⚠️ Hashes de payload não apagados ({e}); expiram sozinhos.")
+
+def run_purge(args):
+    if args.race_id is None and args.older_than_days is None:
+        print("Erro: PURGE exige --race-id e/ou --older-than-days.")
+        sys.exit(1)
+    if args.batch_size <= 0:
+        print("Erro: --batch-size deve ser > 0.")
+        sys.exit(1)
+
+    tables = (
+        ("competitors",) if args.only_competitors else
+        ("competitor_laps",) if args.only_laps else
+        ("competitor_laps", "competitors")
+    )
+
+    conn = get_mysql_conn()
+    try:
+        if args.older_than_days is not None:
+            race_ids = races_older_than(conn, args.older_than_days)
+            if args.race_id is not None:
+                race_ids = [r for r in race_ids if r == args.race_id]
+        else:
+            race_ids = [args.race_id]
+
+        print("🧹 PURGE em lotes (online).")
+        print(f"→ Corridas: {race_ids or 'nenhuma'}")
+        print(f"→ Tabelas: {', '.join(tables)} | lote={args.batch_size} pausa={args.sleep_ms}ms")
+
+        if args.dry_run:
+            print("🔍 Modo DRY-RUN: linhas que seriam removidas:")
+            for race_id in race_ids:
+                for table in tables:
+                    print(f"→ {table} race_id={race_id}: {count_race_rows(conn, table, race_id)}")
+            return
+
+        for race_id in race_ids:
+            result = purge_race(conn, race_id, tables, args.batch_size, args.sleep_ms,
+                                progress=lambda msg: print(msg, flush=True))
+            print(f"✅ race_id={race_id}: " + ", ".join(f"{t}={n}" for t, n in result.items()))
+            _forget_hashes(race_id)
+        print("✅ Purge concluído com sucesso.")
+    except Exception as e:
+        conn.rollback()
+        print("❌ Erro no purge:", e)
+        sys.exit(1)
+    finally:
+        conn.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+
+# ====================== FORMATO ======================
+# Arquivo colunar simples, tipado e comprimido (somente stdlib):
+#   MAGIC
+#   <I tamanho> + JSON do cabeçalho {"version", "byteorder", "schema": [[nome, tipo], ...], "meta": {...}}
+#   N grupos de linhas: <I tamanho> + JSON {"rows": n, "lengths": [...]} + blocos zlib (um por coluna)
+# Tipos: 'i' (int32), 'q' (int64), 'd' (float64) e 'str' (lista JSON).
+# NULL numérico é gravado como sentinela (mínimo do tipo) ou NaN em 'd'.
+
+MAGIC = b"MKCOL1\n"
+FILE_EXT = ".mkc"
+BATCH_ROWS = 50_000
+NULL_SENTINEL = {"i": -(2 ** 31), "q": -(2 ** 63)}
+
+_LEN = struct.Struct("<I")
+
+def _encode_block(col_type, values):
+    if col_type == "str":
+        raw = json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    elif col_type == "d":
+        raw = array("d", (math.nan if v is None else float(v) for v in values)).tobytes()
+    else:
+        null = NULL_SENTINEL[col_type]
+        raw = array(col_type, (null if v is None else int(v) for v in values)).tobytes()
+    return zlib.compress(raw, 6)
+
+def _decode_block(col_type, blob, swap):
+    raw = zlib.decompress(blob)
+    if col_type == "str":
+        return json.loads(raw.decode("utf-8"))
+    arr = array(col_type)
+    arr.frombytes(raw)
+    if swap:
+        arr.byteswap()
+    if col_type == "d":
+        return [None if math.isnan(v) else v for v in arr]
+    null = NULL_SENTINEL[col_type]
+    return [None if v == null else v for v in arr]
+
+class ColumnarWriter:
+    """
+    Escreve linhas (tuplas na ordem do schema) em grupos de BATCH_ROWS.
+    `out` é qualquer objeto binário com .write(): arquivo, BytesIO ou buffer de resposta HTTP.
+    """
+
+    def __init__(self, out, schema, meta=None, batch_rows=BATCH_ROWS):
+        self.out = out
+        self.schema = [(name, col_type) for name, col_type in schema]
+        self.batch_rows = batch_rows
+        self.rows_written = 0
+        self._pending = []
+        header = json.dumps({
+            "version": 1,
+            "byteorder": sys.byteorder,
+            "schema": self.schema,
+            "meta": meta or {},
+        }).encode("utf-8")
+        out.write(MAGIC + _LEN.pack(len(header)) + header)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_rows:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        cols = list(zip(*self._pending))
+        blocks = [_encode_block(col_type, list(cols[i])) for i, (_, col_type) in enumerate(self.schema)]
+        group = json.dumps({"rows": len(self._pending), "lengths": [len(b) for b in blocks]}).encode("utf-8")
+        self.out.write(_LEN.pack(len(group)) + group + b"".join(blocks))
+        self.rows_written += len(self._pending)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise ValueError("Arquivo colunar truncado.")
+    return data
+
+def read_header(f):
+    """Lê MAGIC + cabeçalho; retorna dict com schema/meta."""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Arquivo não está no formato colunar MKCOL1.")
+    (size,) = _LEN.unpack(_read_exact(f, _LEN.size))
+    return json.loads(_read_exact(f, size).decode("utf-8"))
+
+def iter_batches(path, columns=None):
+    """
+    Gera (header, {coluna: lista}) por grupo de linhas, lendo apenas as colunas pedidas
+    (as demais são puladas com seek, sem descomprimir).
+    """
+    with open(path, "rb") as f:
+        header = read_header(f)
+        schema = header["schema"]
+        wanted = set(columns) if columns else {name for name, _ in schema}
+        unknown = wanted - {name for name, _ in schema}
+        if unknown:
+            raise ValueError(f"Colunas inexistentes no arquivo: {sorted(unknown)}")
+        swap = header.get("byteorder", sys.byteorder) != sys.byteorder
+        while True:
+            head = f.read(_LEN.size)
+            if not head:
+                break
+            (size,) = _LEN.unpack(head)
+            group = json.loads(_read_exact(f, size).decode("utf-8"))
+            batch = {}
+            for (name, col_type), length in zip(schema, group["lengths"]):
+                if name in wanted:
+                    batch[name] = _decode_block(col_type, _read_exact(f, length), swap)
+                else:
+                    f.seek(length, 1)
+            yield header, batch
+
+def read_columns(path, columns=None):
+    """Lê o arquivo inteiro: retorna (header, {coluna: lista})."""
+    header = None
+    out = {}
+    for header, batch in iter_batches(path, columns):
+        for name, values in batch.items():
+            out.setdefault(name, []).extend(values)
+    if header is None:
+        with open(path, "rb") as f:
+            header = read_header(f)
+    return header, out
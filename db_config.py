@@ -1,31 +1,148 @@
 
+import os
+import threading
+import time
 import mysql.connector
 
+from db_instrument import InstrumentedConnection
+from api_health import KEY_AVAILABLE_SQL
+
+DEFAULT_DATABASE = "my_karting_app"
+
+# MYKART_DB_NAME aponta o app (scripts e webapp) para outro banco, ex.: o banco descartável do loadtest
 DB_CONFIG = {
     "host": "localhost",
     "user": "admin",
     "password": "filomena",
-    "database": "my_karting_app",
+    "database": os.environ.get("MYKART_DB_NAME", DEFAULT_DATABASE),
     "ssl_disabled": True
 }
 
-def get_mysql_conn():
-    """Retorna uma conexão MySQL usando a configuração padrão."""
-    return mysql.connector.connect(**DB_CONFIG)
+# Cache do app_config: só relê a tabela quando a versão (COUNT(*) + checksum das colunas cacheadas) muda,
+# verificando no máximo a cada CONFIG_CHECK_S segundos
+CONFIG_CHECK_S = float(os.environ.get("MYKART_CONFIG_CHECK_S", 5))
+
+# Cada statement é cronometrado; acima de MYKART_SLOW_QUERY_MS vai para slow_query.log com EXPLAIN
+DB_INSTRUMENT = os.environ.get("MYKART_DB_INSTRUMENT", "1") != "0"
+
+def _raw_conn(**overrides):
+    return mysql.connector.connect(**{**DB_CONFIG, **overrides})
+
+def get_mysql_conn(**overrides):
+    """
+    Retorna uma conexão MySQL usando a configuração padrão (overrides: ex. allow_local_infile=True).
+    Com DB_INSTRUMENT, os cursores registram queries lentas (ver db_instrument).
+    """
+    conn = mysql.connector.connect(**{**DB_CONFIG, **overrides})
+    if DB_INSTRUMENT:
+        return InstrumentedConnection(conn, lambda: _raw_conn(**overrides))
+    return conn
+
+VERSION_SQL = """
+    SELECT COUNT(*), BIT_XOR(CRC32(CONCAT_WS('|', id, api_token, race_id)))
+    FROM app_config
+"""
+
+class AppConfigCache:
+    """
+    Cópia em memória de app_config (id, api_token, race_id), compartilhada por scripts e webapp.
+
+    A cada acesso, se passou CONFIG_CHECK_S desde a última verificação, roda uma query barata
+    (COUNT(*) e checksum de id/api_token/race_id) e só relê as linhas se a versão mudou. O checksum pega
+    duas edições no mesmo segundo (updated_at tem resolução de segundo) e ignora colunas de runtime. Quem altera app_config
+    neste processo chama invalidate() (as rotas /config/app_config/*); outros processos percebem
+    pela versão em até CONFIG_CHECK_S. Estado de runtime das chaves (last_used, breaker) não é
+    cacheado: a escolha da chave continua no banco.
+    """
+
+    def __init__(self, check_s=CONFIG_CHECK_S):
+        self.check_s = check_s
+        self._lock = threading.Lock()
+        self._rows = None
+        self._version = None
+        self._checked_at = 0.0
+        self.checks = 0
+        self.reloads = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self._version = None
+            self._checked_at = 0.0
+
+    def _refresh(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(VERSION_SQL)
+            version = tuple(cur.fetchone() or (None, 0))
+            self.checks += 1
+            if self._rows is None or version != self._version:
+                cur.execute("SELECT id, api_token, race_id FROM app_config ORDER BY id")
+                self._rows = [{"id": int(r[0]), "api_token": r[1], "race_id": int(r[2]) if r[2] is not None else None}
+                              for r in cur.fetchall()]
+                self._version = version
+                self.reloads += 1
+        finally:
+            cur.close()
+        self._checked_at = time.monotonic()
 
-def get_app_config():
+    def rows(self, conn=None):
+        """Linhas de app_config (dicts id/api_token/race_id). conn: reaproveita uma conexão aberta."""
+        with self._lock:
+            if self._rows is None or time.monotonic() - self._checked_at >= self.check_s:
+                own = conn is None
+                if own:
+                    conn = get_mysql_conn()
+                try:
+                    self._refresh(conn)
+                finally:
+                    if own:
+                        conn.close()
+            return self._rows
+
+    def current_race_id(self, conn=None):
+        """race_id do registro id=1 (corrida atual) ou None."""
+        for row in self.rows(conn):
+            if row["id"] == 1:
+                return row["race_id"] or None
+        return None
+
+    def active_race_ids(self, conn=None):
+        return sorted({r["race_id"] for r in self.rows(conn) if r["race_id"] and r["race_id"] > 0})
+
+app_config_cache = AppConfigCache()
+
+def get_app_config(race_id=None):
     """
-    Lê api_token e race_id da tabela app_config (id=1).
+    Lê api_token e race_id da tabela app_config (id=1, via cache).
+    Com race_id, usa a chave menos utilizada dessa corrida (consulta o banco: depende de last_used/breaker).
     Retorna dict: {"api_token": str, "race_id": int}
     """
-    conn = get_mysql_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT api_token, race_id FROM app_config WHERE id = 1")
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    if race_id is None:
+        row = next(((r["api_token"], r["race_id"]) for r in app_config_cache.rows() if r["id"] == 1), None)
+    else:
+        if race_id not in app_config_cache.active_race_ids():
+            row = None
+        else:
+            conn = get_mysql_conn()
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT api_token, race_id FROM app_config
+                WHERE race_id = %s AND {KEY_AVAILABLE_SQL}
+                ORDER BY COALESCE(last_used, '1970-01-01 00:00:00') ASC
+                LIMIT 1
+            """, (race_id,))
+            row = cur.fetchone()
+            cur.close()
+            conn.close()
 
     if not row:
+        if race_id is not None:
+            raise RuntimeError(f"Configuração ausente: nenhuma chave disponível em app_config para race_id={race_id}.")
         raise RuntimeError("Configuração ausente: insira um registro em app_config com id=1.")
     api_token, race_id = row
     return {"api_token": api_token, "race_id": int(race_id)}
+
+def get_active_race_ids():
+    """Corridas acompanhadas: race_ids com pelo menos uma chave em app_config (via cache)."""
+    return app_config_cache.active_race_ids()
@@ -0,0 +1,209 @@
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# ====================== CONFIG ======================
+SLOW_QUERY_MS = float(os.environ.get("MYKART_SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG = "slow_query.log"  # em event_log.LOG_DIR
+EXPLAIN_EVERY_S = 60               # EXPLAIN no máximo 1x por minuto para a mesma query
+PARAMS_MAX_CHARS = 500
+SQL_MAX_CHARS = 4000
+
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE|INSERT\s.+\sSELECT\s|REPLACE\s.+\sSELECT\s)", re.I | re.S)
+_WS = re.compile(r"\s+")
+
+_tag = threading.local()
+_counter = threading.local()  # queries/tempo da thread (o webapp zera a cada request)
+_last_explain = {}
+_logger = None
+
+@contextmanager
+def query_tag(name):
+    """Rotula as queries executadas no bloco (em vez do nome derivado de módulo.função)."""
+    prev = getattr(_tag, "name", None)
+    _tag.name = name
+    try:
+        yield
+    finally:
+        _tag.name = prev
+
+def reset_query_counter():
+    _counter.queries = 0
+    _counter.ms = 0.0
+
+def query_counter():
+    """(queries, ms no banco) executadas nesta thread desde o último reset_query_counter()."""
+    return getattr(_counter, "queries", 0), getattr(_counter, "ms", 0.0)
+
+def _caller_name():
+    name = getattr(_tag, "name", None)
+    if name:
+        return name
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get("__name__") == __name__:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+def _log():
+    global _logger
+    if _logger is None:
+        from event_log import get_event_logger
+        _logger = get_event_logger("slow_query", SLOW_QUERY_LOG)
+    return _logger
+
+def _short(value, limit):
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= limit else text[:limit] + "…"
+
+def _explain(conn_factory, sql, params, name):
+    """EXPLAIN numa conexão separada (a original pode ter resultados pendentes). Limitado por EXPLAIN_EVERY_S."""
+    if conn_factory is None or not _EXPLAINABLE.match(sql):
+        return None, None
+    now = time.monotonic()
+    if now - _last_explain.get(name, -EXPLAIN_EVERY_S) < EXPLAIN_EVERY_S:
+        return None, "omitido (EXPLAIN recente para esta query)"
+    _last_explain[name] = now
+    conn = None
+    try:
+        conn = conn_factory()
+        cur = conn.cursor(dictionary=True)
+        cur.execute("EXPLAIN " + sql, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows, None
+    except Exception as e:
+        return None, repr(e)
+    finally:
+        if conn is not None:
+            try:
+                conn.rollback()
+                conn.close()
+            except Exception:
+                pass
+
+def record_query(kind, name, sql, params, elapsed_ms, rows, conn_factory=None):
+    """Grava a query no slow-query log se passou de SLOW_QUERY_MS."""
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+    from event_log import log_event
+    explain, explain_error = (None, None)
+    if kind == "execute":
+        explain, explain_error = _explain(conn_factory, sql, params, name)
+    log_event(_log(), "slow_query", logging.WARNING, name=name, kind=kind,
+              elapsed_ms=elapsed_ms, rows=rows,
+              sql=_short(_WS.sub(" ", sql).strip(), SQL_MAX_CHARS),
+              params=_short(params, PARAMS_MAX_CHARS) if params is not None else None,
+              explain=explain, explain_error=explain_error)
+
+# ====================== WRAPPERS ======================
+class InstrumentedCursor:
+    """
+    Cursor que cronometra execute/executemany/callproc. Para SELECT, o tempo inclui a leitura
+    dos resultados (fetch) até o próximo execute, close ou fim do fetchall/iteração.
+    Demais atributos são repassados ao cursor original.
+    """
+
+    def __init__(self, cursor, conn_factory=None):
+        self._cur = cursor
+        self._conn_factory = conn_factory
+        self._pending = None  # [kind, name, sql, params, elapsed_s, rows]
+
+    def __getattr__(self, attr):
+        return getattr(self._cur, attr)
+
+    def _finish(self):
+        p = self._pending
+        if p is None:
+            return
+        self._pending = None
+        kind, name, sql, params, elapsed, rows = p
+        _counter.ms = getattr(_counter, "ms", 0.0) + elapsed * 1000.0
+        try:
+            record_query(kind, name, sql, params, elapsed * 1000.0, rows, self._conn_factory)
+        except Exception:
+            pass  # instrumentação nunca derruba a query
+
+    def _timed(self, kind, sql, params, call):
+        self._finish()
+        name = _caller_name()
+        _counter.queries = getattr(_counter, "queries", 0) + 1
+        start = time.perf_counter()
+        try:
+            return call()
+        finally:
+            elapsed = time.perf_counter() - start
+            self._pending = [kind, name, sql, params, elapsed, getattr(self._cur, "rowcount", None)]
+            if not getattr(self._cur, "with_rows", False):
+                self._finish()
+
+    def _fetch(self, call, *args):
+        start = time.perf_counter()
+        result = call(*args)
+        if self._pending is not None:
+            self._pending[4] += time.perf_counter() - start
+            self._pending[5] = getattr(self._cur, "rowcount", None)
+        return result
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        return self._timed("execute", operation, params, lambda: self._cur.execute(operation, params, *args, **kwargs))
+
+    def executemany(self, operation, seq_params):
+        seq_params = list(seq_params)
+        summary = {"rows": len(seq_params), "first": seq_params[0] if seq_params else None}
+        return self._timed("executemany", operation, summary, lambda: self._cur.executemany(operation, seq_params))
+
+    def callproc(self, procname, args=()):
+        result = self._timed("callproc", f"CALL {procname}", args, lambda: self._cur.callproc(procname, args))
+        self._finish()  # procedures: resultados já vêm em stored_results (buffered)
+        return result
+
+    def fetchone(self):
+        row = self._fetch(self._cur.fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._fetch(self._cur.fetchmany, size)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cur.fetchall)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self._finish()
+        return self._cur.close()
+
+class InstrumentedConnection:
+    """Conexão cujo cursor() devolve InstrumentedCursor; o resto é repassado à conexão original."""
+
+    def __init__(self, conn, conn_factory=None):
+        self._conn = conn
+        self._conn_factory = conn_factory
+
+    def __getattr__(self, attr):
+        return getattr(self._conn, attr)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._conn_factory)
+
+    def close(self):
+        return self._conn.close()
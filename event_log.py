@@ -0,0 +1,97 @@
+
+import atexit
+import json
+import logging
+import os
+import queue
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+# ====================== CONFIG ======================
+# Vários processos escrevem no mesmo arquivo (schedulers do cron sobrepostos, workers do webapp):
+# nenhum deles rotaciona. A rotação é do logrotate (copytruncate não é preciso): WatchedFileHandler
+# percebe que o arquivo foi movido e reabre o caminho antes da próxima linha.
+LOG_DIR = os.environ.get("MYKART_LOG_DIR", "/home/ubuntu/mykartapp")
+
+# Campos tipados conhecidos (demais campos são gravados como vierem)
+FIELD_TYPES = {
+    "racer_id": int,
+    "race_id": int,
+    "api_id": int,
+    "session_id": int,
+    "competitor_id": int,
+    "status": int,
+    "position": int,
+    "laps_received": int,
+    "laps_written": int,
+    "elapsed_ms": lambda v: round(float(v), 1),
+}
+
+class JsonLineFormatter(logging.Formatter):
+    """Uma linha JSON por evento: ts, level, logger, event, campos tipados e msg opcional."""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None) or "message",
+        }
+        payload.update(getattr(record, "fields", None) or {})
+        msg = record.getMessage()
+        if msg and msg != payload["event"]:
+            payload["msg"] = msg
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+_listeners = {}
+
+def _file_handler(path):
+    handler = WatchedFileHandler(path, encoding="utf-8")
+    handler.setFormatter(JsonLineFormatter())
+    return handler
+
+def get_event_logger(name, filename):
+    """
+    Logger estruturado (JSON lines), escrito por uma thread dedicada:
+    o chamador só enfileira o registro (QueueHandler), então o log nunca bloqueia o tick.
+    Idempotente: chamadas repetidas retornam o mesmo logger.
+    """
+    logger = logging.getLogger(name)
+    if name in _listeners:
+        return logger
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    q = queue.SimpleQueue()
+    listener = QueueListener(q, _file_handler(os.path.join(LOG_DIR, filename)), respect_handler_level=True)
+    listener.start()
+    _listeners[name] = listener
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(QueueHandler(q))
+    logger.propagate = False
+    return logger
+
+def log_event(logger, event, level=logging.INFO, msg="", **fields):
+    """Registra um evento com campos tipados (ver FIELD_TYPES)."""
+    typed = {}
+    for key, value in fields.items():
+        conv = FIELD_TYPES.get(key)
+        if conv is not None and value is not None:
+            try:
+                value = conv(value)
+            except (ValueError, TypeError):
+                pass
+        typed[key] = value
+    logger.log(level, msg or event, extra={"event": event, "fields": typed})
+
+@atexit.register
+def _flush_listeners():
+    """Drena as filas antes de o processo terminar (scripts de cron são curtos)."""
+    for listener in _listeners.values():
+        try:
+            listener.stop()
+        except Exception:
+            pass
+    _listeners.clear()
@@ -0,0 +1,87 @@
+
+import json
+
+# ====================== BACKEND ======================
+# Decodificador mais rápido disponível (orjson > ujson > json da stdlib).
+# Todos aceitam bytes, então o corpo HTTP não precisa ser decodificado para str antes.
+try:
+    import orjson as _fast_json
+    BACKEND = "orjson"
+except ImportError:
+    try:
+        import ujson as _fast_json
+        BACKEND = "ujson"
+    except ImportError:
+        _fast_json = None
+        BACKEND = "json"
+
+# Parser incremental opcional: sem ijson, o modo streaming cai para decodificação completa.
+try:
+    import ijson
+    HAVE_STREAMING = True
+except ImportError:
+    ijson = None
+    HAVE_STREAMING = False
+
+# Erros de decodificação de todos os backends (json/orjson/ujson levantam subclasses de ValueError)
+JSONDecodeError = (ValueError, ijson.JSONError) if HAVE_STREAMING else ValueError
+
+def loads(data):
+    """json.loads com o backend mais rápido instalado (aceita str ou bytes)."""
+    if _fast_json is not None:
+        return _fast_json.loads(data)
+    return json.loads(data)
+
+# ====================== STREAMING ======================
+def _walk(doc, dotted):
+    """Navega 'A.B.C' em dicts; retorna None se algum nível não existe."""
+    for key in dotted.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+def stream_array(fp, array_path):
+    """
+    Lê o JSON de `fp` (objeto binário com .read()) gerando um elemento de `array_path`
+    (ex.: 'Competitor.LapTimes') por vez, sem montar o array inteiro em memória.
+
+    Gera tuplas:
+      ('item', elemento, doc_parcial) para cada elemento do array;
+      ('done', doc, doc) no fim, com o documento completo sem os elementos do array (array vazio).
+
+    doc_parcial é o documento montado até aquele ponto (campos que vêm antes do array),
+    útil para ler RaceID/ID antes de gravar o primeiro lote.
+    Sem ijson, decodifica tudo de uma vez e gera a mesma sequência.
+    """
+    if not HAVE_STREAMING:
+        doc = loads(fp.read())
+        items = _walk(doc, array_path)
+        if isinstance(items, list):
+            parent = _walk(doc, array_path.rsplit(".", 1)[0]) if "." in array_path else doc
+            parent[array_path.rsplit(".", 1)[-1]] = []
+            for item in items:
+                yield "item", item, doc
+        yield "done", doc, doc
+        return
+
+    item_prefix = array_path + ".item"
+    root = ijson.ObjectBuilder()
+    item = None
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if item is not None:
+            item.event(event, value)
+            if prefix == item_prefix and event in ("end_map", "end_array"):
+                yield "item", item.value, root.value
+                item = None
+            continue
+        if prefix == item_prefix:
+            if event in ("start_map", "start_array"):
+                item = ijson.ObjectBuilder()
+                item.event(event, value)
+            else:
+                yield "item", value, root.value
+            continue
+        root.event(event, value)
+    doc = getattr(root, "value", None)
+    yield "done", doc, doc
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import os
+
+import numpy as np
+
+from lap_stats import PIT_LAP_MIN_MS, laps_from_rows
+
+# ====================== CONFIG ======================
+# Agregados por kart (número) e piloto entre corridas. Cada (race_id, racer_id) tem uma linha em
+# kart_race_stats e um histograma de voltas limpas em kart_race_lap_hist; a consulta histórica só
+# soma essas linhas (nunca varre competitor_laps). Atualização incremental: após cada flush, as voltas
+# recém-gravadas entram como delta (contagem, somas e histograma são aditivos; o stint aberto fica salvo
+# na linha). Volta com lap_number <= last_lap da linha é ignorada (reenvio); volta atrasada fora de
+# ordem só entra no `rebuild`, que recalcula do zero.
+KART_AGG_ENABLED = os.environ.get("MYKART_KART_AGG", "1") != "0"
+HIST_BUCKET_MS = int(os.environ.get("MYKART_KART_HIST_BUCKET_MS", 100))  # resolução dos percentis
+STINT_MIN_LAPS = 3       # stint com menos voltas limpas não entra no delta entre stints
+PERCENTILES = (10, 50, 90)
+KINDS = ("number", "driver")
+
+# Estado acumulado de um racer (colunas de kart_race_stats além de number/driver)
+STATE_COLUMNS = ("last_lap", "laps", "clean_laps", "clean_sum_ms", "clean_sumsq_ms", "best_ms", "pits",
+                 "stint_delta_sum_ms", "stint_deltas", "stint_open_laps", "stint_open_sum_ms",
+                 "stint_prev_mean_ms", "stint_closed_delta_sum_ms", "stint_closed_deltas")
+
+UPSERT_STATS_SQL = f"""
+    INSERT INTO kart_race_stats
+        (race_id, racer_id, number, driver, {", ".join(STATE_COLUMNS)}, updated_at)
+    VALUES (%s, %s, %s, %s, {", ".join(["%s"] * len(STATE_COLUMNS))}, NOW())
+    ON DUPLICATE KEY UPDATE
+        number=VALUES(number), driver=VALUES(driver),
+        {", ".join(f"{c}=VALUES({c})" for c in STATE_COLUMNS)},
+        updated_at=NOW()
+"""
+
+INSERT_HIST_SQL = "INSERT INTO kart_race_lap_hist (race_id, racer_id, bucket_ms, laps) VALUES (%s, %s, %s, %s)"
+
+ADD_HIST_SQL = INSERT_HIST_SQL + " ON DUPLICATE KEY UPDATE laps = laps + VALUES(laps)"
+
+_logger = None
+
+def _log():
+    global _logger
+    if _logger is None:
+        from event_log import get_event_logger
+        _logger = get_event_logger("kart_aggregates", "kart_aggregates.log")
+    return _logger
+
+# ====================== CÁLCULO ======================
+def new_state():
+    return {"last_lap": 0, "laps": 0, "clean_laps": 0, "clean_sum_ms": 0, "clean_sumsq_ms": 0.0, "best_ms": None,
+            "pits": 0, "stint_delta_sum_ms": 0, "stint_deltas": 0, "stint_open_laps": 0, "stint_open_sum_ms": 0,
+            "stint_prev_mean_ms": None, "stint_closed_delta_sum_ms": 0.0, "stint_closed_deltas": 0}
+
+def _close_stint(state):
+    n = state["stint_open_laps"]
+    if n >= STINT_MIN_LAPS:
+        mean = state["stint_open_sum_ms"] / n
+        if state["stint_prev_mean_ms"] is not None:
+            state["stint_closed_delta_sum_ms"] += mean - state["stint_prev_mean_ms"]
+            state["stint_closed_deltas"] += 1
+        state["stint_prev_mean_ms"] = mean
+    state["stint_open_laps"] = state["stint_open_sum_ms"] = 0
+
+def _stint_totals(state):
+    """Delta entre stints contando o stint aberto (se já tem STINT_MIN_LAPS voltas limpas)."""
+    total, n = state["stint_closed_delta_sum_ms"], state["stint_closed_deltas"]
+    if state["stint_open_laps"] >= STINT_MIN_LAPS and state["stint_prev_mean_ms"] is not None:
+        total += state["stint_open_sum_ms"] / state["stint_open_laps"] - state["stint_prev_mean_ms"]
+        n += 1
+    state["stint_delta_sum_ms"] = int(round(total))
+    state["stint_deltas"] = n
+
+def apply_laps(state, lap_numbers, lap_ms):
+    """
+    Soma ao estado as voltas depois de state['last_lap'] (em ordem de lap_number; NaN = inválida).
+    Volta >= PIT_LAP_MIN_MS é box e fecha o stint; delta entre stints = média do stint seguinte − média do
+    anterior. Retorna o histograma das voltas limpas aplicadas {bucket_ms: voltas}.
+    """
+    hist = {}
+    for lap_number, ms in zip(lap_numbers, lap_ms):
+        lap_number = int(lap_number)
+        if lap_number <= state["last_lap"]:
+            continue
+        state["last_lap"] = lap_number
+        state["laps"] += 1
+        if ms != ms:  # NaN
+            continue
+        if ms >= PIT_LAP_MIN_MS:
+            state["pits"] += 1
+            _close_stint(state)
+            continue
+        ms = int(ms)
+        state["clean_laps"] += 1
+        state["clean_sum_ms"] += ms
+        state["clean_sumsq_ms"] += float(ms) * ms
+        state["best_ms"] = ms if state["best_ms"] is None else min(state["best_ms"], ms)
+        state["stint_open_laps"] += 1
+        state["stint_open_sum_ms"] += ms
+        bucket = ms // HIST_BUCKET_MS * HIST_BUCKET_MS
+        hist[bucket] = hist.get(bucket, 0) + 1
+    _stint_totals(state)
+    return hist
+
+def racer_aggregates(lap_numbers, lap_ms):
+    """Agregados de um racer numa corrida inteira (estado + 'hist' [(bucket_ms, voltas)] ordenado)."""
+    state = new_state()
+    state["hist"] = sorted(apply_laps(state, lap_numbers, lap_ms).items())
+    return state
+
+def _racer_chunks(lap_rows):
+    """lap_rows: (racer_id, lap_number, lap_time, total_time) → [(racer_id, lap_numbers, lap_ms)] ordenados."""
+    laps = laps_from_rows(lap_rows)
+    if not len(laps):
+        return []
+    order = np.lexsort((laps.lap_number, laps.racer_id))
+    rid = laps.racer_id[order]
+    racer_ids, starts = np.unique(rid, return_index=True)
+    return list(zip(racer_ids.tolist(), np.split(laps.lap_number[order], starts[1:]),
+                    np.split(laps.lap_ms[order], starts[1:])))
+
+def aggregates_from_rows(lap_rows):
+    """lap_rows: (racer_id, lap_number, lap_time, total_time) → {racer_id: agregados}."""
+    return {racer_id: racer_aggregates(numbers, ms) for racer_id, numbers, ms in _racer_chunks(lap_rows)}
+
+def percentile_from_hist(hist, q):
+    """Percentil q (0–100) de um histograma [(bucket_ms, laps)] ordenado: meio do bucket que cruza q."""
+    total = sum(n for _, n in hist)
+    if not total:
+        return None
+    target = total * q / 100.0
+    acc = 0
+    for bucket, n in hist:
+        acc += n
+        if acc >= target:
+            return int(bucket + HIST_BUCKET_MS // 2)
+    return int(hist[-1][0] + HIST_BUCKET_MS // 2)
+
+# ====================== GRAVAÇÃO ======================
+def _driver(first_name, last_name):
+    return " ".join(p for p in ((first_name or "").strip(), (last_name or "").strip()) if p) or None
+
+def _stats_row(race_id, racer_id, identity, state):
+    number, driver = identity
+    return (race_id, racer_id, number, driver, *(state[c] for c in STATE_COLUMNS))
+
+def _identities(cur, race_id, racer_ids):
+    where = f"race_id = %s AND racer_id IN ({','.join(['%s'] * len(racer_ids))})"
+    cur.execute(f"SELECT racer_id, number, first_name, last_name FROM competitors WHERE {where}", (race_id, *racer_ids))
+    return {r[0]: (r[1] or None, _driver(r[2], r[3])) for r in cur.fetchall()}
+
+def store_aggregates(conn, race_id, aggregates, identities):
+    """Substitui as linhas dos racers em kart_race_stats/kart_race_lap_hist (uma transação)."""
+    if not aggregates:
+        return 0
+    racer_ids = list(aggregates)
+    placeholders = ",".join(["%s"] * len(racer_ids))
+    cur = conn.cursor()
+    try:
+        cur.execute(f"DELETE FROM kart_race_lap_hist WHERE race_id = %s AND racer_id IN ({placeholders})",
+                    (race_id, *racer_ids))
+        stats, hist = [], []
+        for racer_id, a in aggregates.items():
+            stats.append(_stats_row(race_id, racer_id, identities.get(racer_id, (None, None)), a))
+            hist.extend((race_id, racer_id, bucket, n) for bucket, n in a["hist"])
+        cur.executemany(UPSERT_STATS_SQL, stats)
+        if hist:
+            cur.executemany(INSERT_HIST_SQL, hist)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(stats)
+
+def refresh_racers(conn, race_id, racer_ids=None):
+    """
+    Recalcula do zero os agregados de (race_id, racer_ids) a partir de competitor_laps desta corrida
+    (racer_ids=None = corrida inteira). Usado pelo `rebuild` e na primeira vez que um racer aparece.
+    """
+    where, params = "race_id = %s", [race_id]
+    if racer_ids is not None:
+        racer_ids = sorted(set(racer_ids))
+        if not racer_ids:
+            return 0
+        where += f" AND racer_id IN ({','.join(['%s'] * len(racer_ids))})"
+        params.extend(racer_ids)
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT racer_id, lap_number, lap_time, total_time FROM competitor_laps WHERE {where}", params)
+        aggregates = aggregates_from_rows(cur.fetchall())
+        cur.execute(f"SELECT racer_id, number, first_name, last_name FROM competitors WHERE {where}", params)
+        identities = {r[0]: (r[1] or None, _driver(r[2], r[3])) for r in cur.fetchall()}
+    finally:
+        cur.close()
+    return store_aggregates(conn, race_id, aggregates, identities)
+
+def apply_flushed_laps(conn, race_id, flushed_rows):
+    """
+    Delta sobre o estado salvo em kart_race_stats a partir das linhas enviadas num flush (race_id, racer_id,
+    lap_number, position, lap_time, flag_status, total_time). O INSERT IGNORE não diz quais linhas entraram:
+    flushed_rows traz também as descartadas como reenvio, e elas são filtradas aqui (lap_number <= last_lap
+    do racer). Custo proporcional ao lote. Racer ainda sem linha é recalculado do zero uma vez (refresh_racers).
+    """
+    chunks = _racer_chunks((r[1], r[2], r[4], r[6]) for r in flushed_rows)
+    if not chunks:
+        return 0
+    racer_ids = [racer_id for racer_id, _, _ in chunks]
+    cur = conn.cursor()
+    fresh = []
+    try:
+        cur.execute(f"""
+            SELECT racer_id, {", ".join(STATE_COLUMNS)} FROM kart_race_stats
+            WHERE race_id = %s AND racer_id IN ({','.join(['%s'] * len(racer_ids))})
+            FOR UPDATE
+        """, (race_id, *racer_ids))
+        states = {r[0]: dict(zip(STATE_COLUMNS, r[1:])) for r in cur.fetchall()}
+        stats, hist = [], []
+        for racer_id, numbers, ms in chunks:
+            state = states.get(racer_id)
+            if state is None:
+                fresh.append(racer_id)
+                continue
+            laps_before = state["laps"]
+            state["clean_sumsq_ms"] = float(state["clean_sumsq_ms"])
+            state["stint_closed_delta_sum_ms"] = float(state["stint_closed_delta_sum_ms"])
+            delta = apply_laps(state, numbers, ms)
+            if state["laps"] == laps_before:
+                continue  # só reenvio
+            stats.append((racer_id, state))
+            hist.extend((race_id, racer_id, bucket, n) for bucket, n in delta.items())
+        if stats:
+            identities = _identities(cur, race_id, [racer_id for racer_id, _ in stats])
+            cur.executemany(UPSERT_STATS_SQL, [_stats_row(race_id, racer_id, identities.get(racer_id, (None, None)), state)
+                                               for racer_id, state in stats])
+            if hist:
+                cur.executemany(ADD_HIST_SQL, hist)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(stats) + (refresh_racers(conn, race_id, fresh) if fresh else 0)
+
+def refresh_touched(conn, touched):
+    """
+    Gancho pós-flush (WriteBehindBuffer/BulkLoader): touched = {race_id: linhas enviadas no flush}, com as
+    duplicadas que o INSERT IGNORE descartou (apply_flushed_laps as ignora).
+    Falha aqui não invalida a gravação das voltas (é só registrada; `rebuild` corrige depois).
+    """
+    if not KART_AGG_ENABLED:
+        return
+    for race_id, flushed_rows in touched.items():
+        try:
+            apply_flushed_laps(conn, race_id, flushed_rows)
+        except Exception as e:
+            from event_log import log_event
+            log_event(_log(), "kart_agg_failed", logging.WARNING, race_id=race_id, error=repr(e))
+
+def rebuild(conn, race_ids=None, from_archive=False):
+    """Recalcula corridas inteiras: do MySQL ou, com from_archive, dos arquivos de race_archive."""
+    if from_archive:
+        from race_archive import list_archives, query_archive, TABLE_COMPETITORS
+        done = 0
+        for race_id, _ in list_archives():
+            if race_ids and race_id not in race_ids:
+                continue
+            rows = [(r["racer_id"], r["lap_number"], r["lap_time"], r["total_time"])
+                    for r in query_archive(race_id, columns=["racer_id", "lap_number", "lap_time", "total_time"])]
+            identities = {r["racer_id"]: (r["number"] or None, _driver(r["first_name"], r["last_name"]))
+                          for r in query_archive(race_id, columns=["racer_id", "number", "first_name", "last_name"],
+                                                 table=TABLE_COMPETITORS)}
+            done += store_aggregates(conn, race_id, aggregates_from_rows(rows), identities)
+            print(f"✅ race_id={race_id} (arquivo): agregados recalculados")
+        return done
+
+    if not race_ids:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT race_id FROM competitors ORDER BY race_id")
+        race_ids = [r[0] for r in cur.fetchall()]
+        cur.close()
+    done = 0
+    for race_id in race_ids:
+        n = refresh_racers(conn, race_id)
+        done += n
+        print(f"✅ race_id={race_id}: {n} racer(s) recalculados")
+    return done
+
+# ====================== CONSULTA ======================
+def _column(kind):
+    if kind not in KINDS:
+        raise ValueError(f"Tipo inválido: {kind} (use {', '.join(KINDS)})")
+    return kind
+
+def kart_history(conn, kind, key):
+    """
+    Histórico entre corridas de um número de kart (kind='number') ou piloto (kind='driver').
+    Retorna dict com o total (média, desvio, melhor, percentis, box, delta médio entre stints)
+    e as linhas por corrida; None se não há dados.
+    """
+    col = _column(kind)
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(f"""
+            SELECT race_id, racer_id, number, driver, laps, clean_laps, clean_sum_ms, clean_sumsq_ms, best_ms,
+                   pits, stint_delta_sum_ms, stint_deltas, updated_at
+            FROM kart_race_stats WHERE {col} = %s
+            ORDER BY race_id DESC
+        """, (key,))
+        races = cur.fetchall()
+        if not races:
+            return None
+        cur.execute(f"""
+            SELECT h.bucket_ms, SUM(h.laps) AS laps
+            FROM kart_race_stats s
+            JOIN kart_race_lap_hist h ON h.race_id = s.race_id AND h.racer_id = s.racer_id
+            WHERE s.{col} = %s
+            GROUP BY h.bucket_ms
+            ORDER BY h.bucket_ms
+        """, (key,))
+        hist = [(int(r["bucket_ms"]), int(r["laps"])) for r in cur.fetchall()]
+    finally:
+        cur.close()
+
+    for r in races:
+        n = r["clean_laps"] or 0
+        r["mean_ms"] = int(r["clean_sum_ms"] / n) if n else None
+        r["stint_delta_ms"] = int(r["stint_delta_sum_ms"] / r["stint_deltas"]) if r["stint_deltas"] else None
+
+    n = sum(r["clean_laps"] or 0 for r in races)
+    s = sum(int(r["clean_sum_ms"] or 0) for r in races)
+    ss = sum(float(r["clean_sumsq_ms"] or 0) for r in races)
+    n_deltas = sum(r["stint_deltas"] or 0 for r in races)
+    mean = s / n if n else None
+    total = {
+        "kind": kind, "key": key,
+        "races": len(races),
+        "laps": sum(r["laps"] or 0 for r in races),
+        "clean_laps": n,
+        "mean_ms": int(mean) if mean is not None else None,
+        "stddev_ms": int(max(ss / n - mean * mean, 0.0) ** 0.5) if n else None,
+        "best_ms": min((r["best_ms"] for r in races if r["best_ms"] is not None), default=None),
+        "pits": sum(r["pits"] or 0 for r in races),
+        "stint_delta_ms": int(sum(int(r["stint_delta_sum_ms"] or 0) for r in races) / n_deltas) if n_deltas else None,
+        "stint_deltas": n_deltas,
+    }
+    for q in PERCENTILES:
+        total[f"p{q}_ms"] = percentile_from_hist(hist, q)
+    return {"total": total, "per_race": races}
+
+def kart_ranking(conn, kind="number", min_laps=50, limit=100):
+    """Números (ou pilotos) com média de volta limpa entre corridas, do mais rápido ao mais lento."""
+    col = _column(kind)
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(f"""
+            SELECT {col} AS `key`, COUNT(*) AS races, SUM(clean_laps) AS clean_laps,
+                   ROUND(SUM(clean_sum_ms) / SUM(clean_laps)) AS mean_ms, MIN(best_ms) AS best_ms,
+                   SUM(pits) AS pits,
+                   ROUND(SUM(stint_delta_sum_ms) / NULLIF(SUM(stint_deltas), 0)) AS stint_delta_ms
+            FROM kart_race_stats
+            WHERE {col} IS NOT NULL AND {col} <> ''
+            GROUP BY {col}
+            HAVING SUM(clean_laps) >= %s
+            ORDER BY mean_ms ASC
+            LIMIT %s
+        """, (int(min_laps), int(limit)))
+        return cur.fetchall()
+    finally:
+        cur.close()
+
+# ====================== CLI ======================
+def main():
+    parser = argparse.ArgumentParser(description="Agregados de desempenho por kart/piloto entre corridas.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_reb = sub.add_parser("rebuild", help="Recalcula os agregados de corridas inteiras.")
+    p_reb.add_argument("--race-id", type=int, action="append", help="Corrida (repetível); padrão: todas no MySQL.")
+    p_reb.add_argument("--from-archive", action="store_true", help="Lê as corridas arquivadas (race_archive).")
+    p_show = sub.add_parser("show", help="Histórico de um número de kart ou piloto.")
+    p_show.add_argument("--kind", choices=KINDS, default="number")
+    p_show.add_argument("key")
+    args = parser.parse_args()
+
+    from db_config import get_mysql_conn
+    conn = get_mysql_conn()
+    try:
+        if args.cmd == "rebuild":
+            n = rebuild(conn, args.race_id, from_archive=args.from_archive)
+            print(f"Total: {n} linha(s) de agregados")
+        else:
+            hist = kart_history(conn, args.kind, args.key)
+            if hist is None:
+                print(f"❌ Sem agregados para {args.kind}={args.key}")
+                return
+            for k, v in hist["total"].items():
+                print(f"{k}: {v}")
+            print("race_id  racer_id  voltas  limpas  média_ms  melhor_ms  box  Δstint_ms")
+            for r in hist["per_race"]:
+                print(f"{r['race_id']:>7}  {r['racer_id']:>8}  {r['laps']:>6}  {r['clean_laps']:>6}  "
+                      f"{r['mean_ms'] or '—':>8}  {r['best_ms'] or '—':>9}  {r['pits']:>3}  {r['stint_delta_ms'] or '—':>9}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import io
+import os
+import sys
+
+from columnar_file import ColumnarWriter, FILE_EXT, iter_batches
+from lap_stats import parse_ms
+from race_archive import LAPS_SCHEMA, TABLE_LAPS, archive_paths
+
+# ====================== CONFIG ======================
+# Exportação de voltas em streaming: cursor não bufferizado (linhas lidas do socket em blocos de
+# EXPORT_FETCH_ROWS) e saída em pedaços, então a memória fica constante para qualquer tamanho de corrida.
+# Corrida já arquivada (sem linhas no MySQL) é lida do arquivo colunar de race_archive.
+EXPORT_FETCH_ROWS = int(os.environ.get("MYKART_EXPORT_FETCH_ROWS", 5_000))
+EXPORT_GROUP_ROWS = 20_000  # linhas por grupo no formato colunar
+FORMATS = {"csv": ("text/csv; charset=utf-8", ".csv"), "mkc": ("application/octet-stream", FILE_EXT)}
+
+# Colunas de competitor_laps + tempos já convertidos para ms (tipados no formato colunar)
+EXPORT_SCHEMA = LAPS_SCHEMA + [("lap_ms", "i"), ("total_ms", "q")]
+_COLUMNS = [name for name, _ in LAPS_SCHEMA]
+_LAP_TIME = _COLUMNS.index("lap_time")
+_TOTAL_TIME = _COLUMNS.index("total_time")
+_STR_COLS = [i for i, (_, t) in enumerate(LAPS_SCHEMA) if t == "str"]
+
+def export_filename(race_id, racer_id=None, fmt="csv"):
+    suffix = f"_racer_{racer_id}" if racer_id is not None else ""
+    return f"race_{race_id}{suffix}_laps{FORMATS[fmt][1]}"
+
+def _typed(row):
+    row = list(row)
+    for i in _STR_COLS:
+        if row[i] is not None:
+            row[i] = str(row[i])
+    row.append(parse_ms(row[_LAP_TIME]))
+    row.append(parse_ms(row[_TOTAL_TIME]))
+    return tuple(row)
+
+# ====================== LEITURA ======================
+def iter_db_chunks(conn, race_id, racer_id=None, fetch_rows=EXPORT_FETCH_ROWS):
+    """Blocos de linhas (ordem de LAPS_SCHEMA) lidos com cursor não bufferizado."""
+    sql = f"SELECT {', '.join(_COLUMNS)} FROM {TABLE_LAPS} WHERE race_id = %s"
+    params = [race_id]
+    if racer_id is not None:
+        sql += " AND racer_id = %s"
+        params.append(racer_id)
+    sql += " ORDER BY racer_id, lap_number"
+    cur = conn.cursor(buffered=False)
+    try:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(fetch_rows)
+            if not rows:
+                break
+            yield rows
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass  # exportação interrompida: o resultado pendente vai embora com a conexão
+
+def iter_archive_chunks(race_id, racer_id=None):
+    """Mesmos blocos, lidos do arquivo colunar da corrida arquivada (um grupo por vez)."""
+    laps_path, _ = archive_paths(race_id)
+    for _, batch in iter_batches(laps_path, _COLUMNS):
+        rows = list(zip(*(batch[name] for name in _COLUMNS)))
+        if racer_id is not None:
+            rows = [r for r in rows if r[2] == racer_id]
+        if rows:
+            yield rows
+
+def iter_lap_chunks(conn, race_id, racer_id=None):
+    """MySQL primeiro; se a corrida não tem voltas lá e existe arquivo, lê do arquivo."""
+    empty = True
+    for rows in iter_db_chunks(conn, race_id, racer_id):
+        empty = False
+        yield rows
+    if empty and os.path.exists(archive_paths(race_id)[0]):
+        yield from iter_archive_chunks(race_id, racer_id)
+
+# ====================== ESCRITA ======================
+class _ChunkSink:
+    """Destino de escrita que acumula bytes até o próximo drain() (um pedaço da resposta)."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+def stream_export(conn, race_id, racer_id=None, fmt="csv"):
+    """
+    Gera a exportação em pedaços de bytes (um por bloco lido do banco), pronta para uma resposta
+    HTTP chunked ou para escrever num arquivo. A conexão é do chamador: o gerador pode nunca ser
+    iterado (cliente desconectou, HEAD), então fechá-la aqui não é garantido.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato inválido: {fmt} (use {', '.join(FORMATS)})")
+    if fmt == "csv":
+        text = io.StringIO()
+        writer = csv.writer(text, lineterminator="\n")
+        writer.writerow([name for name, _ in EXPORT_SCHEMA])
+        for rows in iter_lap_chunks(conn, race_id, racer_id):
+            writer.writerows(_typed(r) for r in rows)
+            yield text.getvalue().encode("utf-8")
+            text.seek(0)
+            text.truncate()
+        if text.tell():
+            yield text.getvalue().encode("utf-8")  # só o cabeçalho (corrida sem voltas)
+    else:
+        sink = _ChunkSink()
+        writer = ColumnarWriter(sink, EXPORT_SCHEMA, {"race_id": race_id, "racer_id": racer_id, "table": TABLE_LAPS},
+                                batch_rows=EXPORT_GROUP_ROWS)
+        yield sink.drain()
+        for rows in iter_lap_chunks(conn, race_id, racer_id):
+            writer.write_rows(_typed(r) for r in rows)
+            data = sink.drain()
+            if data:
+                yield data
+        writer.close()
+        yield sink.drain()
+
+# ====================== CLI ======================
+def main():
+    parser = argparse.ArgumentParser(description="Exporta as voltas de uma corrida (ou racer) em CSV ou colunar (.mkc).")
+    parser.add_argument("--race-id", type=int, required=True)
+    parser.add_argument("--racer-id", type=int)
+    parser.add_argument("--format", choices=list(FORMATS), default="csv")
+    parser.add_argument("--out", help="Arquivo de saída ('-' = stdout; padrão: race_<id>[_racer_<id>]_laps.<ext>).")
+    args = parser.parse_args()
+
+    from db_config import get_mysql_conn
+    out_path = args.out or export_filename(args.race_id, args.racer_id, args.format)
+    out = sys.stdout.buffer if out_path == "-" else open(out_path + ".tmp", "wb")
+    total = 0
+    conn = get_mysql_conn()
+    try:
+        for data in stream_export(conn, args.race_id, args.racer_id, args.format):
+            out.write(data)
+            total += len(data)
+    except Exception:
+        if out_path != "-":
+            out.close()
+            os.unlink(out_path + ".tmp")
+        raise
+    finally:
+        conn.close()
+    if out_path != "-":
+        out.close()
+        os.replace(out_path + ".tmp", out_path)
+        print(f"✅ {out_path} ({total / 1e6:.1f} MB)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+# ====================== CONFIG ======================
+STATS_WINDOW_LAPS = int(os.environ.get("STATS_WINDOW_LAPS", 60))  # voltas mais recentes por kart
+PIT_LAP_MIN_MS = int(os.environ.get("PIT_LAP_MIN_MS", 120000))    # volta >= 2:00 conta como box
+TREND_LAPS = 10
+LAST_LAPS_SHOWN = 5
+
+# Colunas em ms (convertidas para int na saída); as demais saem como float
+MS_COLUMNS = {"last_lap_ms", "avg5_ms", "avg10_ms", "stddev10_ms", "best_lap_ms", "best_stint_ms"}
+COUNT_COLUMNS = {"max_lap", "stint_laps", "shown_laps"}
+# Colunas de KartStats.columns (todas presentes, mesmo sem voltas)
+METRIC_COLUMNS = ("max_lap", "last_lap_ms", "avg5_ms", "avg10_ms", "stddev10_ms", "trend_ms_per_lap",
+                  "best_lap_ms", "best_stint_ms", "stint_laps", "shown_laps")
+
+def parse_ms(s: str):
+    if not s: return None
+    s = s.strip()
+    try:
+        if s.count(':') == 2:
+            h, m, rest = s.split(':')
+            sec, ms = rest.split('.') if '.' in rest else (rest, '0')
+            return int(h)*3600000 + int(m)*60000 + int(sec)*1000 + int(ms.ljust(3,'0')[:3])
+        elif s.count(':') == 1:
+            m, rest = s.split(':')
+            sec, ms = rest.split('.') if '.' in rest else (rest, '0')
+            return int(m)*60000 + int(sec)*1000 + int(ms.ljust(3,'0')[:3])
+        else:
+            return None
+    except Exception:
+        return None
+
+# ====================== ENTRADA ======================
+class RaceLaps:
+    """Voltas de uma corrida como arrays paralelos (lap_ms/total_ms = NaN quando inválidos)."""
+
+    def __init__(self, racer_id, lap_number, lap_ms, total_ms):
+        self.racer_id = np.asarray(racer_id, dtype=np.int64)
+        self.lap_number = np.asarray(lap_number, dtype=np.int64)
+        self.lap_ms = np.asarray(lap_ms, dtype=np.float64)
+        self.total_ms = np.asarray(total_ms, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.racer_id)
+
+def laps_from_rows(rows):
+    """rows: (racer_id, lap_number, lap_time, total_time) com tempos em texto."""
+    nan = float("nan")
+    racer_ids, lap_numbers, lap_ms, total_ms = [], [], [], []
+    for racer_id, lap_number, lap_time, total_time in rows:
+        racer_ids.append(racer_id)
+        lap_numbers.append(lap_number)
+        v = parse_ms(lap_time)
+        lap_ms.append(nan if v is None else v)
+        v = parse_ms(total_time)
+        total_ms.append(nan if v is None else v)
+    return RaceLaps(racer_ids, lap_numbers, lap_ms, total_ms)
+
+def load_race_laps(conn, race_id, last_n=STATS_WINDOW_LAPS):
+    """Carrega as voltas da corrida em uma única query (apenas as last_n mais recentes por kart, se informado)."""
+    cur = conn.cursor()
+    try:
+        if last_n:
+            cur.execute("""
+                SELECT racer_id, lap_number, lap_time, total_time
+                FROM (
+                    SELECT racer_id, lap_number, lap_time, total_time,
+                           ROW_NUMBER() OVER (PARTITION BY racer_id ORDER BY lap_number DESC) AS rn
+                    FROM competitor_laps
+                    WHERE race_id = %s
+                ) t
+                WHERE rn <= %s
+            """, (race_id, int(last_n)))
+        else:
+            cur.execute("""
+                SELECT racer_id, lap_number, lap_time, total_time
+                FROM competitor_laps
+                WHERE race_id = %s
+            """, (race_id,))
+        return laps_from_rows(cur.fetchall())
+    finally:
+        cur.close()
+
+# ====================== MÉTRICAS ======================
+class KartStats:
+    """Métricas por kart: racer_ids[i] ↔ columns[nome][i]; last_laps[i] = últimas voltas (NaN = sem volta)."""
+
+    def __init__(self, racer_ids, columns, last_laps):
+        self.racer_ids = racer_ids
+        self.columns = columns
+        self.last_laps = last_laps
+        self._pos = {int(r): i for i, r in enumerate(racer_ids)}
+
+    def __len__(self):
+        return len(self.racer_ids)
+
+    def __contains__(self, racer_id):
+        return racer_id in self._pos
+
+    def _value(self, name, i):
+        v = self.columns[name][i]
+        if np.isnan(v):
+            return None
+        return int(v) if name in MS_COLUMNS or name in COUNT_COLUMNS else round(float(v), 1)
+
+    def get(self, racer_id):
+        """Métricas do kart como dict (None se o kart não tem voltas)."""
+        i = self._pos.get(racer_id)
+        if i is None:
+            return None
+        row = {"racer_id": int(self.racer_ids[i])}
+        for name in self.columns:
+            row[name] = self._value(name, i)
+        row["last_laps"] = [None if np.isnan(v) else int(v) for v in self.last_laps[i][:int(self.columns["shown_laps"][i])]]
+        return row
+
+    def rows(self):
+        return [self.get(int(r)) for r in self.racer_ids]
+
+    def mean_last_lap(self, max_ms=120000):
+        """Média da última volta de todos os karts, ignorando voltas > max_ms."""
+        last = self.columns["last_lap_ms"]
+        vals = last[~np.isnan(last) & (last <= max_ms)]
+        return int(vals.mean()) if len(vals) else None
+
+    def fastest_last_laps(self, top=5):
+        """[(racer_id, last_lap_ms)] das últimas voltas mais rápidas."""
+        last = self.columns["last_lap_ms"]
+        idx = np.flatnonzero(~np.isnan(last))
+        idx = idx[np.argsort(last[idx], kind="stable")][:top]
+        return [(int(self.racer_ids[i]), int(last[i])) for i in idx]
+
+    def slowest_last_laps(self, top=5, max_ms=90000):
+        """[(racer_id, last_lap_ms)] das últimas voltas mais lentas, ignorando voltas > max_ms."""
+        last = self.columns["last_lap_ms"]
+        idx = np.flatnonzero(~np.isnan(last) & (last <= max_ms))
+        idx = idx[np.argsort(-last[idx], kind="stable")][:top]
+        return [(int(self.racer_ids[i]), int(last[i])) for i in idx]
+
+def compute_kart_metrics(laps, pit_min_ms=PIT_LAP_MIN_MS, trend_laps=TREND_LAPS, shown=LAST_LAPS_SHOWN):
+    """
+    Calcula todas as métricas por kart em uma passada vetorizada sobre as voltas da corrida.
+    Para adicionar uma métrica: derive um array por kart a partir de (group, rank, ms, máscaras)
+    e inclua em `columns` e em METRIC_COLUMNS.
+
+    Corrida sem voltas: colunas vazias (os agregados devolvem None/[] em vez de KeyError).
+
+    >>> stats = compute_kart_metrics(RaceLaps([], [], [], []))
+    >>> stats.mean_last_lap(), stats.fastest_last_laps(), stats.slowest_last_laps(), stats.rows(), stats.get(1)
+    (None, [], [], [], None)
+    """
+    if len(laps) == 0:
+        return KartStats(np.empty(0, dtype=np.int64), {name: np.empty(0) for name in METRIC_COLUMNS},
+                         np.empty((0, shown)))
+
+    order = np.lexsort((laps.lap_number, laps.racer_id))
+    rid = laps.racer_id[order]
+    lap_no = laps.lap_number[order]
+    ms = laps.lap_ms[order]
+
+    racer_ids, starts, counts = np.unique(rid, return_index=True, return_counts=True)
+    n_karts = len(racer_ids)
+    group = np.repeat(np.arange(n_karts), counts)
+    ends = starts + counts - 1
+    idx = np.arange(len(rid))
+    rank = ends[group] - idx  # 0 = volta mais recente do kart
+
+    valid = ~np.isnan(ms)
+    is_pit = valid & (ms >= pit_min_ms)
+    clean = valid & ~is_pit
+    ms0 = np.where(valid, ms, 0.0)
+
+    def gsum(weights):
+        return np.bincount(group, weights=weights, minlength=n_karts)
+
+    def mean_last(n):
+        sel = valid & (rank < n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return gsum(np.where(sel, ms0, 0.0)) / gsum(sel.astype(np.float64))
+
+    # Consistência e tendência nas últimas `trend_laps` voltas limpas (sem box)
+    sel = clean & (rank < trend_laps)
+    n = gsum(sel.astype(np.float64))
+    y = np.where(sel, ms0, 0.0)
+    x = np.where(sel, -rank.astype(np.float64), 0.0)
+    sy, syy = gsum(y), gsum(y * y)
+    sx, sxx, sxy = gsum(x), gsum(x * x), gsum(x * y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_y = sy / n
+        stddev = np.sqrt(np.maximum(syy / n - mean_y * mean_y, 0.0))
+        denom = n * sxx - sx * sx
+        slope = np.where((n >= 2) & (denom > 0), (n * sxy - sx * sy) / denom, np.nan)
+    stddev[n < 2] = np.nan
+
+    # Stint atual = voltas após a última volta de box do kart
+    last_pit = np.maximum.reduceat(np.where(is_pit, idx, -1), starts)
+    stint = clean & (idx > last_pit[group])
+    best_stint = np.minimum.reduceat(np.where(stint, ms, np.inf), starts)
+    best_lap = np.minimum.reduceat(np.where(clean, ms, np.inf), starts)
+
+    columns = {
+        "max_lap": lap_no[ends].astype(np.float64),
+        "last_lap_ms": ms[ends],
+        "avg5_ms": mean_last(5),
+        "avg10_ms": mean_last(10),
+        "stddev10_ms": stddev,
+        "trend_ms_per_lap": slope,
+        "best_lap_ms": np.where(np.isinf(best_lap), np.nan, best_lap),
+        "best_stint_ms": np.where(np.isinf(best_stint), np.nan, best_stint),
+        "stint_laps": gsum(stint.astype(np.float64)),
+        "shown_laps": np.minimum(counts, shown).astype(np.float64),
+    }
+
+    # Últimas `shown` voltas em matriz (da mais antiga para a mais recente, alinhada à esquerda)
+    take = rank < shown
+    col = (np.minimum(counts, shown)[group] - 1 - rank)[take]
+    last_laps = np.full((n_karts, shown), np.nan)
+    last_laps[group[take], col] = ms[take]
+
+    return KartStats(racer_ids, columns, last_laps)
+
+def race_kart_stats(conn, race_id, last_n=STATS_WINDOW_LAPS):
+    """Atalho: carrega as voltas da corrida e calcula as métricas de todos os karts."""
+    return compute_kart_metrics(load_race_laps(conn, race_id, last_n))
+
+# ====================== CLI (relatório CSV) ======================
+def main():
+    parser = argparse.ArgumentParser(description="Exporta métricas por kart de uma corrida (CSV).")
+    parser.add_argument("--race-id", type=int, required=True)
+    parser.add_argument("--window", type=int, default=0, help="Voltas mais recentes por kart (0 = corrida inteira).")
+    args = parser.parse_args()
+
+    from db_config import get_mysql_conn
+    conn = get_mysql_conn()
+    try:
+        stats = race_kart_stats(conn, args.race_id, args.window or None)
+    finally:
+        conn.close()
+
+    writer = None
+    for row in stats.rows():
+        row = dict(row, last_laps=" ".join("" if v is None else str(v) for v in row["last_laps"]))
+        if writer is None:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+
+if __name__ == "__main__":
+    main()
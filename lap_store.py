@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+from lap_stats import RaceLaps, parse_ms
+
+# ====================== CONFIG ======================
+# Voltas em memória por (race_id, racer_id), em arrays tipados contíguos (~17 bytes por volta em vez de
+# tuplas/dicts). O processo hidrata a corrida do MySQL no primeiro acesso e depois só busca as voltas
+# novas de cada racer (lap_number > última volta em memória), no máximo a cada LAP_STORE_REFRESH_S.
+LAP_STORE_REFRESH_S = float(os.environ.get("MYKART_LAP_STORE_REFRESH_S", 1.0))
+LAP_STORE_IDLE_S = float(os.environ.get("MYKART_LAP_STORE_IDLE_S", 3600))  # corrida sem leitura sai da memória
+LAP_STORE_FETCH_ROWS = 10_000
+# O id não serve de marca d'água (INSERT IGNORE consome auto-increment e transações concorrentes confirmam
+# fora de ordem). A reconciliação é por (racer_id, lap_number): cada atualização relê as últimas
+# LAP_STORE_LAP_OVERLAP voltas de cada racer, cobrindo volta anterior confirmada depois da seguinte
+# (duplicadas são descartadas pelo lap_number). Racer que ainda não está em memória vem inteiro.
+LAP_STORE_LAP_OVERLAP = 3
+
+NULL_MS = -1  # volta sem tempo válido
+
+# flag_status em texto → código de 1 byte (tabela compartilhada pelo processo)
+_flag_codes = {"": 0}
+_flag_names = [""]
+_flag_lock = threading.Lock()
+
+def flag_code(name):
+    name = name or ""
+    code = _flag_codes.get(name)
+    if code is None:
+        with _flag_lock:
+            code = _flag_codes.get(name)
+            if code is None:
+                if len(_flag_names) >= 255:
+                    return 0
+                code = _flag_codes[name] = len(_flag_names)
+                _flag_names.append(name)
+    return code
+
+def flag_name(code):
+    return _flag_names[code] if code < len(_flag_names) else ""
+
+# ====================== ARMAZENAMENTO ======================
+class RacerLaps:
+    """Voltas de um racer ordenadas por lap_number: arrays paralelos lap_number/lap_ms/total_ms/flag."""
+
+    __slots__ = ("lap_number", "lap_ms", "total_ms", "flag")
+
+    def __init__(self):
+        self.lap_number = array("i")
+        self.lap_ms = array("i")
+        self.total_ms = array("q")
+        self.flag = array("B")
+
+    def __len__(self):
+        return len(self.lap_number)
+
+    def add(self, lap_number, lap_ms, total_ms, flag=0):
+        """Volta nova no fim: O(1) amortizado. Volta repetida é ignorada; fora de ordem é inserida na posição."""
+        lap_ms = NULL_MS if lap_ms is None else lap_ms
+        total_ms = NULL_MS if total_ms is None else total_ms
+        n = len(self.lap_number)
+        if not n or lap_number > self.lap_number[n - 1]:
+            self.lap_number.append(lap_number)
+            self.lap_ms.append(lap_ms)
+            self.total_ms.append(total_ms)
+            self.flag.append(flag)
+            return True
+        i = bisect_left(self.lap_number, lap_number)
+        if self.lap_number[i] == lap_number:
+            return False
+        self.lap_number.insert(i, lap_number)
+        self.lap_ms.insert(i, lap_ms)
+        self.total_ms.insert(i, total_ms)
+        self.flag.insert(i, flag)
+        return True
+
+    def last_lap(self):
+        return self.lap_number[-1] if self.lap_number else 0
+
+    def last(self, n=None):
+        """(lap_number, lap_ms, total_ms, flag) das últimas n voltas (todas se n=None), como fatias dos arrays."""
+        start = 0 if not n else max(0, len(self.lap_number) - n)
+        return self.lap_number[start:], self.lap_ms[start:], self.total_ms[start:], self.flag[start:]
+
+    def nbytes(self):
+        return sum(a.itemsize * a.buffer_info()[1] for a in (self.lap_number, self.lap_ms, self.total_ms, self.flag))
+
+class LapStore:
+    """
+    Voltas ao vivo de várias corridas em memória, chaveadas por (race_id, racer_id).
+    refresh(conn, race_id) hidrata a corrida na primeira vez e depois traz só as voltas novas;
+    race_laps() monta o RaceLaps (numpy) que lap_stats.compute_kart_metrics consome.
+    """
+
+    def __init__(self, refresh_s=LAP_STORE_REFRESH_S, idle_s=LAP_STORE_IDLE_S):
+        self.refresh_s = refresh_s
+        self.idle_s = idle_s
+        self._lock = threading.RLock()
+        self._races = {}      # race_id -> {racer_id: RacerLaps}
+        self._checked = {}    # race_id -> monotonic da última atualização
+        self._read = {}       # race_id -> monotonic da última leitura
+
+    def add(self, race_id, racer_id, lap_number, lap_ms, total_ms, flag=""):
+        with self._lock:
+            racers = self._races.setdefault(race_id, {})
+            racer = racers.get(racer_id)
+            if racer is None:
+                racer = racers[racer_id] = RacerLaps()
+            return racer.add(lap_number, lap_ms, total_ms, flag_code(flag))
+
+    def _since_filter(self, race_id):
+        """
+        WHERE das voltas que faltam: por racer em memória, lap_number > última volta - LAP_STORE_LAP_OVERLAP;
+        racers ainda desconhecidos vêm inteiros. Vazio na hidratação (corrida inteira).
+        """
+        racers = self._races.get(race_id)
+        if not racers:
+            return "", ()
+        clauses, params = [], []
+        for racer_id, laps in racers.items():
+            clauses.append("(racer_id = %s AND lap_number > %s)")
+            params += [racer_id, laps.last_lap() - LAP_STORE_LAP_OVERLAP]
+        ids = list(racers)
+        clauses.append(f"racer_id NOT IN ({', '.join(['%s'] * len(ids))})")
+        params += ids
+        return f" AND ({' OR '.join(clauses)})", tuple(params)
+
+    def _load(self, conn, race_id):
+        where, params = self._since_filter(race_id)
+        cur = conn.cursor(buffered=False)
+        added = 0
+        try:
+            cur.execute(f"""
+                SELECT racer_id, lap_number, lap_time, total_time, flag_status
+                FROM competitor_laps
+                WHERE race_id = %s{where}
+            """, (race_id,) + params)
+            while True:
+                rows = cur.fetchmany(LAP_STORE_FETCH_ROWS)
+                if not rows:
+                    break
+                for racer_id, lap_number, lap_time, total_time, flag in rows:
+                    added += self.add(race_id, racer_id, lap_number, parse_ms(lap_time), parse_ms(total_time), flag)
+        finally:
+            cur.close()
+        return added
+
+    def hydrate(self, conn, race_id):
+        """Carrega a corrida inteira do MySQL (substitui o que houver em memória). Retorna as voltas carregadas."""
+        with self._lock:
+            self._races[race_id] = {}
+            added = self._load(conn, race_id)
+            self._checked[race_id] = self._read[race_id] = time.monotonic()
+            return added
+
+    def refresh(self, conn, race_id, force=False):
+        """Traz as voltas novas da corrida (hidrata se ainda não está em memória). Retorna as voltas adicionadas."""
+        with self._lock:
+            now = time.monotonic()
+            self._read[race_id] = now
+            if race_id not in self._races:
+                added = self.hydrate(conn, race_id)
+            elif not force and now - self._checked.get(race_id, 0) < self.refresh_s:
+                return 0
+            else:
+                added = self._load(conn, race_id)
+                self._checked[race_id] = now
+            self._evict_idle(now)
+            return added
+
+    def _evict_idle(self, now):
+        for race_id in [r for r, t in self._read.items() if now - t > self.idle_s]:
+            self.drop(race_id)
+
+    def drop(self, race_id):
+        with self._lock:
+            for d in (self._races, self._checked, self._read):
+                d.pop(race_id, None)
+
+    def racer(self, race_id, racer_id):
+        return self._races.get(race_id, {}).get(racer_id)
+
+    def race_laps(self, race_id, last_n=None):
+        """RaceLaps (arrays numpy) com as últimas last_n voltas de cada racer da corrida (todas se None)."""
+        with self._lock:
+            self._read[race_id] = time.monotonic()
+            racers = self._races.get(race_id, {})
+            ids, numbers, lap_ms, total_ms = [], [], [], []
+            for racer_id, laps in racers.items():
+                n, ms, tt, _ = laps.last(last_n)
+                if not n:
+                    continue
+                ids.append(np.full(len(n), racer_id, dtype=np.int64))
+                numbers.append(np.frombuffer(n, dtype=np.int32))
+                lap_ms.append(np.frombuffer(ms, dtype=np.int32))
+                total_ms.append(np.frombuffer(tt, dtype=np.int64))
+        if not ids:
+            return RaceLaps([], [], [], [])
+        lap_ms = np.concatenate(lap_ms).astype(np.float64)
+        total_ms = np.concatenate(total_ms).astype(np.float64)
+        lap_ms[lap_ms == NULL_MS] = np.nan
+        total_ms[total_ms == NULL_MS] = np.nan
+        return RaceLaps(np.concatenate(ids), np.concatenate(numbers), lap_ms, total_ms)
+
+    def stats(self):
+        """Corridas em memória: {race_id: {'racers', 'laps', 'bytes'}}."""
+        with self._lock:
+            return {race_id: {"racers": len(racers),
+                              "laps": sum(len(r) for r in racers.values()),
+                              "bytes": sum(r.nbytes() for r in racers.values())}
+                    for race_id, racers in self._races.items()}
+
+# Instância do processo (webapp)
+lap_store = LapStore()
+
+# ====================== CLI ======================
+def main():
+    parser = argparse.ArgumentParser(description="Hidrata corridas no lap store e mostra o uso de memória.")
+    parser.add_argument("--race-id", type=int, action="append", required=True)
+    args = parser.parse_args()
+
+    from db_config import get_mysql_conn
+    conn = get_mysql_conn()
+    try:
+        for race_id in args.race_id:
+            start = time.perf_counter()
+            n = lap_store.hydrate(conn, race_id)
+            print(f"race_id={race_id}: {n} voltas em {(time.perf_counter() - start) * 1000:.0f} ms")
+    finally:
+        conn.close()
+    for race_id, s in lap_store.stats().items():
+        print(f"race_id={race_id}: {s['racers']} racers, {s['laps']} voltas, {s['bytes'] / 1024:.1f} KiB "
+              f"({s['bytes'] / max(s['laps'], 1):.1f} bytes/volta)")
+
+if __name__ == "__main__":
+    main()
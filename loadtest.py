@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+from lap_stats import parse_ms
+from standings import drop_race
+
+# ====================== CONFIG ======================
+# Teste de carga do webapp: N telas de pit-wall em /dashboard?auto=on (recarregam a cada 60 s, como o
+# setInterval de dashboard.html) + usuários de /box_eval, enquanto um ingest simulado grava voltas na
+# mesma corrida pelo caminho real (racer_rows → WriteBehindBuffer → standings).
+# Só roda contra um banco descartável informado em --database (com o schema de SQL/Table_Structure.sql),
+# nunca o padrão do db_config: o webapp testado sobe com MYKART_DB_NAME=<mesmo banco>. Seed e ingest não
+# alimentam os agregados entre corridas (kart_race_stats), que misturariam karts sintéticos com os reais.
+LOADTEST_URL = "http://127.0.0.1:5000"
+LOADTEST_RACE_ID = 990001      # race_id alto: sem app_config, vira a corrida atual (MAX(race_id)) do banco de teste
+DASHBOARD_REFRESH_S = 60       # dashboard.html: setInterval(reload, 60000)
+BOX_THINK_S = 30               # intervalo entre avaliações de box de um usuário
+REQUEST_TIMEOUT_S = 60
+INGEST_TICK_S = 0.5
+INGEST_FLUSH_S = 5.0           # como WRITE_MAX_AGE_S do scheduler em modo batch
+
+BASE_LAP_MS = 60_000
+PIT_EVERY_LAPS = 25
+PIT_LAP_MS = (232_000, 248_000)  # cai na faixa padrão do box_eval (opt_230_250)
+BOX_CHOICES = ("opt_230_250", "opt_two_windows")
+
+def fmt_time(ms):
+    """ms → 'MM:SS.mmm' (ou 'H:MM:SS.mmm'), formato dos tempos do GetRacer."""
+    h, rest = divmod(int(ms), 3_600_000)
+    m, rest = divmod(rest, 60_000)
+    s, frac = divmod(rest, 1000)
+    return f"{h}:{m:02d}:{s:02d}.{frac:03d}" if h else f"{m:02d}:{s:02d}.{frac:03d}"
+
+def percentile(sorted_values, p):
+    """Percentil por posição mais próxima (lista já ordenada)."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+# ====================== CORRIDA SINTÉTICA ======================
+class SyntheticRace:
+    """
+    Estado de uma corrida simulada: voltas por racer no formato do GetRacer (Laps) e o Competitor
+    correspondente. Ritmo base por racer fixo (seed = racer_id), parada de box a cada PIT_EVERY_LAPS.
+    """
+
+    def __init__(self, race_id, racer_ids):
+        self.race_id = race_id
+        self.laps = {rid: [] for rid in racer_ids}
+        self.total_ms = {rid: 0 for rid in racer_ids}
+        self._rng = {rid: random.Random(rid) for rid in racer_ids}
+        self._pace = {rid: BASE_LAP_MS + self._rng[rid].randint(-1500, 2500) for rid in racer_ids}
+
+    @classmethod
+    def new(cls, race_id, racers):
+        return cls(race_id, list(range(101, 101 + racers)))
+
+    @classmethod
+    def from_db(cls, conn, race_id):
+        """Retoma uma corrida já semeada (competitor_laps) para o ingest continuar dela."""
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT racer_id, lap_number, position, lap_time, flag_status, total_time
+            FROM competitor_laps WHERE race_id = %s ORDER BY racer_id, lap_number
+        """, (race_id,))
+        rows = cur.fetchall()
+        cur.close()
+        if not rows:
+            raise ValueError(f"race_id={race_id} sem voltas: rode `loadtest.py seed` antes.")
+        race = cls(race_id, sorted({r[0] for r in rows}))
+        for racer_id, lap_number, position, lap_time, flag, total_time in rows:
+            race.laps[racer_id].append({"Lap": lap_number, "Position": position, "LapTime": lap_time,
+                                        "FlagStatus": flag, "TotalTime": total_time})
+            race.total_ms[racer_id] = parse_ms(total_time) or race.total_ms[racer_id]
+        return race
+
+    def positions(self):
+        order = sorted(self.laps, key=lambda rid: (-len(self.laps[rid]), self.total_ms[rid]))
+        return {rid: i + 1 for i, rid in enumerate(order)}
+
+    def advance(self, racer_id, positions=None):
+        """Fecha mais uma volta do racer. Retorna o tempo da volta (ms)."""
+        rng = self._rng[racer_id]
+        n = len(self.laps[racer_id]) + 1
+        if n % PIT_EVERY_LAPS == 0:
+            lap_ms = rng.randint(*PIT_LAP_MS)
+        else:
+            lap_ms = max(45_000, int(rng.gauss(self._pace[racer_id], 450)))
+        self.total_ms[racer_id] += lap_ms
+        position = (positions or {}).get(racer_id, 0)
+        self.laps[racer_id].append({"Lap": n, "Position": position, "LapTime": fmt_time(lap_ms),
+                                    "FlagStatus": "Green", "TotalTime": fmt_time(self.total_ms[racer_id])})
+        return lap_ms
+
+    def due(self, elapsed_ms):
+        """Racers cuja próxima volta já terminou no relógio simulado (elapsed_ms desde o início da corrida)."""
+        return [rid for rid in self.laps
+                if self.total_ms[rid] + self._pace[rid] <= elapsed_ms]
+
+    def payload(self, racer_id, positions):
+        """(Competitor, Laps) como no GetRacer."""
+        laps = self.laps[racer_id]
+        timed = [(parse_ms(l["LapTime"]), l["Lap"]) for l in laps if l["Lap"] % PIT_EVERY_LAPS]
+        best_ms, best_lap = min(timed) if timed else (0, 0)
+        comp = {
+            "RacerID": racer_id, "Number": str(racer_id - 100), "Transponder": f"T{racer_id}",
+            "FirstName": "Kart", "LastName": str(racer_id - 100), "Nationality": "BR",
+            "AdditionalData": "loadtest", "ClassID": 1, "Position": positions.get(racer_id, 0),
+            "Laps": len(laps), "TotalTime": fmt_time(self.total_ms[racer_id]),
+            "BestPosition": positions.get(racer_id, 0), "BestLap": best_lap,
+            "BestLapTime": fmt_time(best_ms), "LastLapTime": laps[-1]["LapTime"] if laps else "00:00.000",
+        }
+        return comp, laps
+
+def write_payloads(buffer, race, racer_ids, positions):
+    """Grava os payloads pelo mesmo caminho do scheduler (conversão + buffer + classificação ao vivo)."""
+    from race_monitor_worker import racer_rows, feed_standings
+    for rid in racer_ids:
+        comp, laps = race.payload(rid, positions)
+        values, laps_data = racer_rows(comp, laps, race.race_id)
+        buffer.add_competitor(values, laps_data)
+        feed_standings(race.race_id, rid, laps)
+
+# ====================== BANCO DE TESTE ======================
+def connect(database):
+    """Conexão com o banco de teste; recusa o banco padrão do app (dados reais)."""
+    from db_config import DEFAULT_DATABASE, get_mysql_conn
+    if not database or database == DEFAULT_DATABASE:
+        raise SystemExit(f"❌ Informe --database com um banco de teste (não '{DEFAULT_DATABASE}').")
+    return get_mysql_conn(database=database)
+
+def disable_kart_aggregates():
+    """Voltas sintéticas não entram em kart_race_stats/kart_race_lap_hist (ranking entre corridas)."""
+    import kart_aggregates
+    kart_aggregates.KART_AGG_ENABLED = False
+
+def reset_race(conn, race_id):
+    """Apaga tudo que o seed/ingest gravou da corrida, inclusive a partição e a classificação ao vivo."""
+    from race_archive import drop_race_partition, list_partitions, partition_name
+    cur = conn.cursor()
+    for table in ("competitor_laps", "competitors", "update_group_2min", "update_group_4min", "update_group_rest",
+                  "kart_race_stats", "kart_race_lap_hist"):
+        cur.execute(f"DELETE FROM {table} WHERE race_id = %s", (race_id,))
+    conn.commit()
+    cur.close()
+    if partition_name(race_id) in list_partitions(conn):
+        drop_race_partition(conn, race_id)
+    drop_race(race_id)
+
+# ====================== SEED ======================
+def seed(conn, race_id, racers, laps, reset=False):
+    """Cria a corrida sintética: competitors, competitor_laps, grupos (top 5 no 2min) e classificação."""
+    from write_behind import WriteBehindBuffer
+    disable_kart_aggregates()
+    if reset:
+        reset_race(conn, race_id)
+    cur = conn.cursor()
+    race = SyntheticRace.new(race_id, racers)
+    for _ in range(laps):
+        positions = race.positions()
+        for rid in race.laps:
+            race.advance(rid, positions)
+    positions = race.positions()
+    buffer = WriteBehindBuffer(conn, durability="batch", max_rows=float("inf"), max_age_s=float("inf"))
+    write_payloads(buffer, race, list(race.laps), positions)
+    written = buffer.flush()
+
+    by_position = sorted(race.laps, key=positions.get)
+    cur.executemany("INSERT IGNORE INTO update_group_2min (race_id, racer_id, last_update) VALUES (%s, %s, NOW())",
+                    [(race_id, rid) for rid in by_position[:5]])
+    cur.executemany("INSERT IGNORE INTO update_group_rest (race_id, racer_id, last_update) VALUES (%s, %s, NOW())",
+                    [(race_id, rid) for rid in by_position[5:]])
+    conn.commit()
+    cur.close()
+    return written
+
+# ====================== INGEST SIMULADO ======================
+class Ingest(threading.Thread):
+    """
+    Grava voltas novas em paralelo aos viewers: a cada INGEST_TICK_S, os racers que fecharam volta no
+    relógio simulado (speed = aceleração) viram payloads no buffer; flush a cada flush_s (um commit).
+    """
+
+    def __init__(self, race, stop, database, speed=1.0, flush_s=INGEST_FLUSH_S):
+        super().__init__(daemon=True)
+        self.race = race
+        self.database = database
+        self.stop = stop
+        self.speed = speed
+        self.flush_s = flush_s
+        self.payloads = 0
+        self.laps_written = 0
+        self.flush_ms = []
+        self.errors = 0
+        self.last_error = None
+
+    def _flush(self, buffer):
+        start = time.perf_counter()
+        self.laps_written += buffer.flush()
+        self.flush_ms.append((time.perf_counter() - start) * 1000.0)
+
+    def run(self):
+        from write_behind import WriteBehindBuffer
+        disable_kart_aggregates()
+        conn = connect(self.database)
+        buffer = WriteBehindBuffer(conn, durability="batch", max_rows=float("inf"), max_age_s=float("inf"))
+        start_ms = max(self.race.total_ms.values())
+        t0 = last_flush = time.monotonic()
+        try:
+            while not self.stop.is_set():
+                now = time.monotonic()
+                try:
+                    due = self.race.due(start_ms + (now - t0) * 1000.0 * self.speed)
+                    if due:
+                        positions = self.race.positions()
+                        for rid in due:
+                            self.race.advance(rid, positions)
+                        write_payloads(buffer, self.race, due, self.race.positions())
+                        self.payloads += len(due)
+                    if now - last_flush >= self.flush_s:
+                        self._flush(buffer)
+                        last_flush = now
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = repr(e)
+                    conn.rollback()
+                    buffer = WriteBehindBuffer(conn, durability="batch", max_rows=float("inf"), max_age_s=float("inf"))
+                self.stop.wait(INGEST_TICK_S)
+            self._flush(buffer)
+        finally:
+            conn.close()
+
+# ====================== VIEWERS ======================
+class Results:
+    """Amostras de todas as threads: (endpoint, status, ms, db_queries, db_ms, erro)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+
+    def add(self, *sample):
+        with self._lock:
+            self.samples.append(sample)
+
+class Viewer(threading.Thread):
+    """
+    Um navegador: cookies próprios (sessão do box_eval), primeira carga espalhada no ramp-up e depois
+    uma ação a cada interval_s (±10%), como o recarregamento automático da página.
+    """
+
+    def __init__(self, kind, base_url, race_id, results, deadline, interval_s, ramp_s, seed):
+        super().__init__(daemon=True)
+        self.kind = kind
+        self.base_url = base_url.rstrip("/")
+        self.race_id = race_id
+        self.results = results
+        self.deadline = deadline
+        self.interval_s = interval_s
+        self.ramp_s = ramp_s
+        self.rng = random.Random(seed)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, label, path, data=None):
+        url = self.base_url + path
+        body = urllib.parse.urlencode(data).encode("utf-8") if data is not None else None
+        start = time.perf_counter()
+        status, headers, error = None, None, None
+        try:
+            with self.opener.open(url, data=body, timeout=REQUEST_TIMEOUT_S) as resp:
+                resp.read()
+                status, headers = resp.status, resp.headers
+        except urllib.error.HTTPError as e:
+            status, headers, error = e.code, e.headers, f"HTTP {e.code}"
+        except Exception as e:
+            error = type(e).__name__
+        ms = (time.perf_counter() - start) * 1000.0
+        queries = db_ms = None
+        if headers is not None and headers.get("X-DB-Queries") is not None:
+            queries = int(headers["X-DB-Queries"])
+            db_ms = float(headers.get("X-DB-Ms") or 0)
+        self.results.add(label, status, ms, queries, db_ms, error)
+
+    def action(self):
+        if self.kind == "dashboard":
+            self.request("GET /dashboard", f"/dashboard?auto=on&race_id={self.race_id}")
+        else:
+            self.request("GET /box_eval", "/box_eval")
+            self.request("POST /box_eval", "/box_eval", {"box_choice": self.rng.choice(BOX_CHOICES)})
+
+    def run(self):
+        if self.ramp_s:
+            time.sleep(self.rng.uniform(0, self.ramp_s))
+        while time.monotonic() < self.deadline:
+            start = time.monotonic()
+            self.action()
+            pause = self.interval_s * self.rng.uniform(0.9, 1.1) - (time.monotonic() - start)
+            if time.monotonic() + max(pause, 0) >= self.deadline:
+                break
+            if pause > 0:
+                time.sleep(pause)
+
+# ====================== RELATÓRIO ======================
+def summarize(samples, duration_s):
+    """Por endpoint: requisições, erros, latência p50/p95/p99/máx (ms), req/s e queries por request."""
+    by_endpoint = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    out = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        ms = sorted(r[2] for r in rows)
+        queries = [r[3] for r in rows if r[3] is not None]
+        db_ms = sorted(r[4] for r in rows if r[4] is not None)
+        errors = sum(1 for r in rows if r[5] is not None)
+        out[endpoint] = {
+            "requests": len(rows), "errors": errors, "error_rate": round(errors / len(rows), 4),
+            "rps": round(len(rows) / duration_s, 3) if duration_s else None,
+            "p50_ms": round(percentile(ms, 50), 1), "p95_ms": round(percentile(ms, 95), 1),
+            "p99_ms": round(percentile(ms, 99), 1), "max_ms": round(ms[-1], 1),
+            "db_queries_avg": round(sum(queries) / len(queries), 2) if queries else None,
+            "db_queries_max": max(queries) if queries else None,
+            "db_ms_p95": round(percentile(db_ms, 95), 1) if db_ms else None,
+        }
+    return out
+
+def print_report(summary, ingest=None):
+    print(f"{'endpoint':<18} {'req':>6} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'máx':>8} {'q/req':>6} {'q máx':>6} {'db p95':>7}")
+    for endpoint, s in summary.items():
+        q_avg = "—" if s["db_queries_avg"] is None else f"{s['db_queries_avg']:.1f}"
+        q_max = "—" if s["db_queries_max"] is None else str(s["db_queries_max"])
+        db_p95 = "—" if s["db_ms_p95"] is None else f"{s['db_ms_p95']:.0f}"
+        print(f"{endpoint:<18} {s['requests']:>6} {s['error_rate'] * 100:>5.1f}% {s['p50_ms']:>8.0f} {s['p95_ms']:>8.0f} "
+              f"{s['p99_ms']:>8.0f} {s['max_ms']:>8.0f} {q_avg:>6} {q_max:>6} {db_p95:>7}")
+    if ingest is not None:
+        flush = sorted(ingest["flush_ms"])
+        print(f"ingest: {ingest['payloads']} payloads, {ingest['laps_written']} voltas novas, {len(flush)} commits"
+              + (f", flush p50={percentile(flush, 50):.0f} ms p95={percentile(flush, 95):.0f} ms" if flush else "")
+              + (f", {ingest['errors']} erro(s) ({ingest['last_error']})" if ingest["errors"] else ""))
+
+def parse_budget(text):
+    """'dashboard=6,box_eval=4' → {'dashboard': 6.0, 'box_eval': 4.0} (média de queries por request)."""
+    budget = {}
+    for item in filter(None, (text or "").split(",")):
+        name, _, value = item.partition("=")
+        budget[name.strip()] = float(value)
+    return budget
+
+def check_budget(summary, budget, max_error_rate):
+    """Violações do orçamento de queries (por trecho do endpoint) e da taxa de erro."""
+    problems = []
+    for endpoint, s in summary.items():
+        for name, limit in budget.items():
+            if name in endpoint and s["db_queries_avg"] is not None and s["db_queries_avg"] > limit:
+                problems.append(f"{endpoint}: {s['db_queries_avg']} queries/request (orçamento {limit:g})")
+        if max_error_rate is not None and s["error_rate"] > max_error_rate:
+            problems.append(f"{endpoint}: taxa de erro {s['error_rate']:.2%} (máx {max_error_rate:.2%})")
+    return problems
+
+# ====================== CLI ======================
+def run(args):
+    stop = threading.Event()
+    ingest = None
+    if args.ingest:
+        conn = connect(args.database)
+        try:
+            race = SyntheticRace.from_db(conn, args.race_id)
+        finally:
+            conn.close()
+        ingest = Ingest(race, stop, args.database, speed=args.ingest_speed)
+        ingest.start()
+
+    results = Results()
+    start = time.monotonic()
+    deadline = start + args.duration_s
+    viewers = [Viewer("dashboard", args.url, args.race_id, results, deadline, args.dashboard_refresh_s, args.ramp_s, i)
+               for i in range(args.viewers)]
+    viewers += [Viewer("box_eval", args.url, args.race_id, results, deadline, args.box_think_s, args.ramp_s, 10_000 + i)
+                for i in range(args.box_users)]
+    print(f"{args.viewers} dashboard(s) a cada {args.dashboard_refresh_s:g}s + {args.box_users} usuário(s) de box_eval "
+          f"a cada {args.box_think_s:g}s, por {args.duration_s:g}s contra {args.url}"
+          + (f" (ingest {args.ingest_speed:g}x)" if ingest else ""), file=sys.stderr)
+    for v in viewers:
+        v.start()
+    for v in viewers:
+        v.join()
+    stop.set()
+    if ingest is not None:
+        ingest.join()
+    elapsed = time.monotonic() - start
+
+    summary = summarize(results.samples, elapsed)
+    ingest_stats = None
+    if ingest is not None:
+        ingest_stats = {"payloads": ingest.payloads, "laps_written": ingest.laps_written, "flush_ms": ingest.flush_ms,
+                        "errors": ingest.errors, "last_error": ingest.last_error}
+    print_report(summary, ingest_stats)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"params": {k: v for k, v in vars(args).items() if k != "func"}, "duration_s": round(elapsed, 1),
+                       "endpoints": summary,
+                       "ingest": {**ingest_stats, "flush_ms": [round(x, 1) for x in ingest_stats["flush_ms"]]}
+                       if ingest_stats else None}, f, ensure_ascii=False, indent=2)
+    problems = check_budget(summary, parse_budget(args.query_budget), args.max_error_rate)
+    for p in problems:
+        print(f"❌ {p}")
+    if problems:
+        raise SystemExit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do webapp (viewers simultâneos + ingest simulado).")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_seed = sub.add_parser("seed", help="Cria a corrida sintética no banco de teste.")
+    p_seed.add_argument("--database", required=True, help="Banco de teste (o padrão do app é recusado).")
+    p_seed.add_argument("--race-id", type=int, default=LOADTEST_RACE_ID)
+    p_seed.add_argument("--racers", type=int, default=30)
+    p_seed.add_argument("--laps", type=int, default=120, help="Voltas já completadas por racer.")
+    p_seed.add_argument("--reset", action="store_true",
+                        help="Apaga os dados da corrida (tabelas, agregados, partição, classificação) antes de semear.")
+
+    p_run = sub.add_parser("run", help="Roda a carga e mostra p50/p95/p99, queries por request e erros.")
+    p_run.add_argument("--url", default=LOADTEST_URL)
+    p_run.add_argument("--database", required=True,
+                       help="Banco de teste do ingest (o mesmo do MYKART_DB_NAME do webapp testado).")
+    p_run.add_argument("--race-id", type=int, default=LOADTEST_RACE_ID)
+    p_run.add_argument("--viewers", type=int, default=10, help="Telas em /dashboard?auto=on.")
+    p_run.add_argument("--box-users", type=int, default=2, help="Usuários avaliando box em /box_eval.")
+    p_run.add_argument("--duration-s", type=float, default=300)
+    p_run.add_argument("--ramp-s", type=float, default=DASHBOARD_REFRESH_S, help="Primeiras cargas espalhadas neste tempo.")
+    p_run.add_argument("--dashboard-refresh-s", type=float, default=DASHBOARD_REFRESH_S)
+    p_run.add_argument("--box-think-s", type=float, default=BOX_THINK_S)
+    p_run.add_argument("--ingest", action=argparse.BooleanOptionalAction, default=True,
+                       help="Grava voltas novas em paralelo (corrida semeada com seed).")
+    p_run.add_argument("--ingest-speed", type=float, default=1.0, help="Aceleração do relógio da corrida simulada.")
+    p_run.add_argument("--query-budget", help="Máximo de queries/request por endpoint, ex.: dashboard=6,box_eval=4.")
+    p_run.add_argument("--max-error-rate", type=float, help="Falha (exit 1) acima desta taxa de erro, ex.: 0.01.")
+    p_run.add_argument("--json", help="Grava o resultado completo neste arquivo.")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        conn = connect(args.database)
+        try:
+            written = seed(conn, args.race_id, args.racers, args.laps, args.reset)
+        finally:
+            conn.close()
+        print(f"✅ race_id={args.race_id}: {args.racers} racers, {written} voltas gravadas")
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+
+import glob
+import os
+import re
+import threading
+import time
+from array import array
+from collections import deque
+
+BLOCK_SIZE = 8192
+TIME_MARK_EVERY = 256  # 1 marca de tempo a cada N linhas indexadas
+
+_TIME_RE = re.compile(r"(\d{2}):(\d{2}):(\d{2})")
+_RACER_RES = (
+    re.compile(r"racer_id\W{0,3}(\d+)"),
+    re.compile(r"OK → (\d+)"),
+)
+
+# ====================== TAIL ======================
+def tail_lines(path, n=200, block_size=BLOCK_SIZE):
+    """
+    Retorna as últimas n linhas (com quebra de linha) lendo o arquivo de trás para frente.
+    Memória limitada ao tamanho das linhas retornadas, independente do tamanho do log.
+    """
+    if n <= 0:
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        chunks = []
+        newlines = 0
+        while pos > 0 and newlines <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            newlines += chunk.count(b"\n")
+            chunks.append(chunk)
+    data = b"".join(reversed(chunks))
+    return [l.decode("utf-8", errors="replace") for l in data.splitlines(keepends=True)[-n:]]
+
+# ====================== FOLLOW ======================
+def follow_lines(path, poll_interval=1.0, max_seconds=None, from_end=True):
+    """
+    Gera as novas linhas do arquivo conforme são escritas (equivalente a `tail -F`).
+    Reabre o arquivo quando ele é rotacionado ou truncado.
+    Gera None a cada ciclo ocioso (útil para heartbeat / detectar cliente desconectado).
+    """
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    f = None
+    inode = None
+    pending = b""
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            if f is None:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    yield None
+                    time.sleep(poll_interval)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                if from_end:
+                    f.seek(0, os.SEEK_END)
+                from_end = False  # após rotação, o arquivo novo é lido desde o início
+
+            line = f.readline()
+            if line:
+                if line.endswith(b"\n"):
+                    yield (pending + line).decode("utf-8", errors="replace")
+                    pending = b""
+                else:
+                    pending += line
+                continue
+
+            # Sem dados novos: verifica rotação/truncamento
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            if st is not None and (st.st_ino != inode or st.st_size < f.tell()):
+                f.close()
+                f = None
+                pending = b""
+                continue
+
+            yield None
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
+
+# ====================== SEARCH (indexada) ======================
+def rotated_files(path):
+    """Arquivo atual + rotacionados (path.1, path.2, path.AAAA-MM-DD...), do mais antigo ao mais novo."""
+    files = [
+        p for p in glob.glob(glob.escape(path) + ".*")
+        if os.path.isfile(p) and not p.endswith((".gz", ".zip"))
+    ]
+    files.sort(key=os.path.getmtime)
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def parse_hhmmss(value):
+    """'HH:MM' ou 'HH:MM:SS' → segundos desde meia-noite (None se inválido)."""
+    if not value:
+        return None
+    parts = value.strip().split(":")
+    try:
+        if len(parts) == 2:
+            h, m, s = int(parts[0]), int(parts[1]), 0
+        elif len(parts) == 3:
+            h, m, s = int(parts[0]), int(parts[1]), int(parts[2])
+        else:
+            return None
+    except ValueError:
+        return None
+    return h * 3600 + m * 60 + s
+
+def line_time_sec(line):
+    """Extrai o horário (segundos desde meia-noite) do início da linha de log, se houver."""
+    m = _TIME_RE.search(line, 0, 48)
+    if not m:
+        return None
+    h, mi, s = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    return h * 3600 + mi * 60 + s
+
+def line_racer_ids(line):
+    ids = set()
+    for rx in _RACER_RES:
+        for m in rx.finditer(line):
+            ids.add(int(m.group(1)))
+    return ids
+
+def _in_range(sec, start, end):
+    if sec is None:
+        return False
+    if start is None:
+        return sec <= end
+    if end is None:
+        return sec >= start
+    if start <= end:
+        return start <= sec <= end
+    return sec >= start or sec <= end  # faixa atravessa a meia-noite
+
+class _FileIndex:
+    """
+    Índice incremental de um arquivo de log:
+      - racer_offsets: racer_id → offsets (array 'q') das linhas que o citam
+      - marks: (offset, segundos) a cada TIME_MARK_EVERY linhas, para pular blocos fora da faixa de horário
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.indexed_upto = 0
+        self.line_count = 0
+        self.racer_offsets = {}
+        self.mark_offsets = []
+        self.mark_secs = []
+
+    def _reset(self, inode):
+        self.__init__(self.path)
+        self.inode = inode
+
+    def refresh(self):
+        """Indexa apenas o trecho novo do arquivo; reconstrói se ele foi rotacionado/truncado."""
+        st = os.stat(self.path)
+        if st.st_ino != self.inode or st.st_size < self.indexed_upto:
+            self._reset(st.st_ino)
+        if st.st_size == self.indexed_upto:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.indexed_upto)
+            offset = self.indexed_upto
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # linha incompleta: indexa na próxima vez
+                line = raw.decode("utf-8", errors="replace")
+                if self.line_count % TIME_MARK_EVERY == 0:
+                    sec = line_time_sec(line)
+                    if sec is not None:
+                        self.mark_offsets.append(offset)
+                        self.mark_secs.append(sec)
+                for rid in line_racer_ids(line):
+                    self.racer_offsets.setdefault(rid, array("q")).append(offset)
+                self.line_count += 1
+                offset += len(raw)
+            self.indexed_upto = offset
+
+    def _time_spans(self, start, end):
+        """Faixas de bytes [ini, fim) que podem conter linhas no horário pedido."""
+        spans = []
+        bounds = [0] + self.mark_offsets + [self.indexed_upto]
+        secs = [None] + self.mark_secs + [None]
+        for i in range(len(bounds) - 1):
+            lo_sec, hi_sec = secs[i], secs[i + 1]
+            if lo_sec is not None and hi_sec is not None and lo_sec <= hi_sec:
+                # bloco monotônico: descarta se não intercepta a faixa
+                if start is not None and end is not None and start <= end:
+                    if hi_sec < start or lo_sec > end:
+                        continue
+                elif start is None and lo_sec > end:
+                    continue
+                elif end is None and hi_sec < start:
+                    continue
+            if spans and spans[-1][1] == bounds[i]:
+                spans[-1] = (spans[-1][0], bounds[i + 1])
+            else:
+                spans.append((bounds[i], bounds[i + 1]))
+        return spans
+
+    def search(self, racer_id=None, start=None, end=None):
+        """Gera as linhas que atendem aos filtros, em ordem de arquivo."""
+        with open(self.path, "rb") as f:
+            if racer_id is not None:
+                for off in self.racer_offsets.get(racer_id, ()):
+                    f.seek(off)
+                    line = f.readline().decode("utf-8", errors="replace")
+                    if (start is None and end is None) or _in_range(line_time_sec(line), start, end):
+                        yield line
+                return
+            for lo, hi in self._time_spans(start, end):
+                f.seek(lo)
+                pos = lo
+                while pos < hi:
+                    raw = f.readline()
+                    if not raw:
+                        break
+                    pos += len(raw)
+                    line = raw.decode("utf-8", errors="replace")
+                    if _in_range(line_time_sec(line), start, end):
+                        yield line
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _get_index(path):
+    with _indexes_lock:
+        idx = _indexes.get(path)
+        if idx is None:
+            idx = _indexes[path] = _FileIndex(path)
+        idx.refresh()
+        return idx
+
+def search_logs(path, racer_id=None, start=None, end=None, limit=500):
+    """
+    Busca nas versões rotacionadas + atual do log por racer_id e/ou faixa de horário ('HH:MM[:SS]').
+    Retorna as últimas `limit` ocorrências como lista de (arquivo, linha), da mais antiga à mais nova.
+    """
+    start_sec = parse_hhmmss(start) if isinstance(start, str) else start
+    end_sec = parse_hhmmss(end) if isinstance(end, str) else end
+    if racer_id is None and start_sec is None and end_sec is None:
+        raise ValueError("Informe racer_id e/ou faixa de horário para a busca.")
+
+    found = deque(maxlen=max(1, int(limit)))
+    files = rotated_files(path)
+    with _indexes_lock:
+        for stale in set(_indexes) - set(files):
+            if stale == path or stale.startswith(path + "."):
+                del _indexes[stale]
+    for fpath in files:
+        try:
+            idx = _get_index(fpath)
+        except FileNotFoundError:
+            continue  # rotacionado entre a listagem e a leitura
+        for line in idx.search(racer_id, start_sec, end_sec):
+            found.append((os.path.basename(fpath), line))
+    return list(found)
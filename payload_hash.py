@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# ====================== CONFIG ======================
+# Hash do último payload GetRacer gravado de cada (race_id, racer_id). Kart parado no box ou consultado
+# antes de fechar volta devolve exatamente o mesmo conteúdo: o scheduler compara o hash e pula o upsert
+# de competitors e o insert de voltas (nenhuma transação no MySQL).
+# Os schedulers do cron são processos curtos, então o hash fica num SQLite local (WAL) compartilhado.
+# O hash só é gravado depois do commit (ou da gravação no spool) e vence em PAYLOAD_HASH_TTL_S: mesmo
+# payload é regravado de tempos em tempos (se as tabelas forem limpas por fora, o dado volta sozinho).
+PAYLOAD_HASH_PATH = os.environ.get("MYKART_PAYLOAD_HASH_PATH", "/home/ubuntu/mykartapp/spool/payload_hashes.db")
+PAYLOAD_HASH_ENABLED = os.environ.get("MYKART_PAYLOAD_HASH", "1") != "0"
+PAYLOAD_HASH_TTL_S = float(os.environ.get("MYKART_PAYLOAD_HASH_TTL_S", 600))
+PAYLOAD_HASH_BUSY_MS = 10_000
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS payload_hash (
+        race_id INTEGER NOT NULL,
+        racer_id INTEGER NOT NULL,
+        digest BLOB NOT NULL,
+        written_at REAL NOT NULL,
+        PRIMARY KEY (race_id, racer_id)
+    );
+    CREATE TABLE IF NOT EXISTS payload_hash_stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+"""
+
+def payload_digest(values, lap_rows):
+    """
+    Hash (16 bytes) do que o payload gravaria (linhas de competitors e competitor_laps, ver
+    race_monitor_worker.racer_rows): campos do GetRacer que não vão para o banco não contam.
+    """
+    data = json.dumps([values, lap_rows], separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).digest()
+
+class PayloadHashStore:
+    """
+    unchanged(race_id, racer_id, digest) diz se o payload é igual ao último gravado (e ainda no TTL);
+    remember() registra o hash depois da gravação. Contadores hits/misses do processo vão para
+    payload_hash_stats no close() (taxa de acerto acumulada entre todos os processos).
+    """
+
+    def __init__(self, path=PAYLOAD_HASH_PATH, ttl_s=PAYLOAD_HASH_TTL_S):
+        self.path = path
+        self.ttl_s = ttl_s
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=PAYLOAD_HASH_BUSY_MS / 1000.0, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # perder o último hash só custa uma regravação
+        self.db.execute(f"PRAGMA busy_timeout={PAYLOAD_HASH_BUSY_MS}")
+        self.db.executescript(SCHEMA_SQL)
+        self.hits = 0
+        self.misses = 0
+
+    def unchanged(self, race_id, racer_id, digest):
+        row = self.db.execute("SELECT digest, written_at FROM payload_hash WHERE race_id = ? AND racer_id = ?",
+                              (race_id, racer_id)).fetchone()
+        hit = row is not None and row[0] == digest and time.time() - row[1] < self.ttl_s
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    def remember(self, race_id, racer_id, digest):
+        self.db.execute("INSERT OR REPLACE INTO payload_hash (race_id, racer_id, digest, written_at) VALUES (?, ?, ?, ?)",
+                        (race_id, racer_id, digest, time.time()))
+
+    def forget(self, race_id=None):
+        """Esquece os hashes (de uma corrida ou todos): o próximo payload de cada racer é gravado."""
+        if race_id is None:
+            return self.db.execute("DELETE FROM payload_hash").rowcount
+        return self.db.execute("DELETE FROM payload_hash WHERE race_id = ?", (race_id,)).rowcount
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def save_counters(self):
+        if not (self.hits or self.misses):
+            return
+        self.db.executemany("""
+            INSERT INTO payload_hash_stats (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        """, [("hits", self.hits), ("misses", self.misses)])
+        self.hits = self.misses = 0
+
+    def totals(self):
+        """Acumulado de todos os processos: {'hits', 'misses', 'hit_rate', 'racers'}."""
+        out = {"hits": 0, "misses": 0}
+        out.update(dict(self.db.execute("SELECT name, value FROM payload_hash_stats")))
+        total = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / total, 4) if total else 0.0
+        out["racers"] = self.db.execute("SELECT COUNT(*) FROM payload_hash").fetchone()[0]
+        return out
+
+    def reset_counters(self):
+        self.db.execute("DELETE FROM payload_hash_stats")
+
+    def close(self):
+        try:
+            self.save_counters()
+        finally:
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+def forget_hashes(race_id=None, path=PAYLOAD_HASH_PATH):
+    """Para quem apaga competitors/competitor_laps (cleanup_tables): sem hashes, tudo é regravado."""
+    if not os.path.exists(path):
+        return 0
+    with PayloadHashStore(path) as store:
+        return store.forget(race_id)
+
+# ====================== CLI ======================
+def main():
+    parser = argparse.ArgumentParser(description="Hashes dos últimos payloads gravados: taxa de acerto e limpeza.")
+    parser.add_argument("--path", default=PAYLOAD_HASH_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Acertos (gravações puladas) x gravações, acumulado.")
+    sub.add_parser("reset-stats", help="Zera os contadores.")
+    p_forget = sub.add_parser("forget", help="Esquece os hashes (todos ou de uma corrida).")
+    p_forget.add_argument("--race-id", type=int)
+    args = parser.parse_args()
+
+    with PayloadHashStore(args.path) as store:
+        if args.command == "stats":
+            t = store.totals()
+            print(f"hits={t['hits']} misses={t['misses']} taxa={t['hit_rate']:.1%} racers={t['racers']}")
+        elif args.command == "reset-stats":
+            store.reset_counters()
+            print("✅ Contadores zerados.")
+        else:
+            print(f"✅ {store.forget(args.race_id)} hash(es) apagados.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from event_log import get_event_logger, log_event
+from json_stream import loads
+
+# ====================== CONFIG ======================
+# Spool local (SQLite em modo WAL) entre a API e o MySQL: o scheduler grava o payload do GetRacer
+# aqui (alguns ms, sem depender do banco) e o drainer aplica no MySQL em lotes.
+# Entrega "pelo menos uma vez": a linha só é marcada como aplicada depois do commit no MySQL; se o
+# drainer morrer entre os dois, o lote é reaplicado — competitors é upsert e competitor_laps é
+# INSERT IGNORE, então a reaplicação na mesma ordem (seq) deixa o banco no mesmo estado.
+SPOOL_PATH = os.environ.get("MYKART_SPOOL_PATH", "/home/ubuntu/mykartapp/spool/payloads.db")
+SPOOL_ENABLED = os.environ.get("MYKART_SPOOL", "0") == "1"
+SPOOL_BATCH = int(os.environ.get("MYKART_SPOOL_BATCH", 200))      # payloads por commit no MySQL
+SPOOL_POLL_S = float(os.environ.get("MYKART_SPOOL_POLL_S", 1.0))
+SPOOL_KEEP_S = float(os.environ.get("MYKART_SPOOL_KEEP_S", 6 * 3600))  # aplicados ficam este tempo (auditoria)
+SPOOL_MAX_ATTEMPTS = 5   # lote que falha tantas vezes é aplicado um a um para isolar o payload ruim
+SPOOL_BUSY_MS = 10_000   # vários schedulers gravando ao mesmo tempo: espera o lock do SQLite
+
+PENDING = "pending"
+APPLIED = "applied"
+DEAD = "dead"   # payload que não dá para aplicar (JSON inválido, dado rejeitado pelo MySQL)
+
+log = get_event_logger("payload_spool", "payload_spool.log")
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS spool (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        race_id INTEGER NOT NULL,
+        racer_id INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        fetched_at REAL NOT NULL,
+        worker_id TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        applied_at REAL,
+        last_error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS spool_status_seq ON spool (status, seq);
+"""
+
+# ====================== SPOOL ======================
+class PayloadSpool:
+    """
+    Fila durável de payloads do GetRacer num arquivo SQLite local (WAL + synchronous=FULL:
+    append() só retorna depois do fsync). Vários processos podem gravar; um drainer consome.
+    """
+
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=SPOOL_BUSY_MS / 1000.0, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(f"PRAGMA busy_timeout={SPOOL_BUSY_MS}")
+        self.db.executescript(SCHEMA_SQL)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def append(self, race_id, racer_id, competitor, laps, worker_id=None):
+        """Grava o payload (Competitor + Laps) e retorna o seq. Um INSERT em autocommit: atômico e durável."""
+        payload = json.dumps({"Competitor": competitor, "Laps": laps}, separators=(",", ":")).encode("utf-8")
+        cur = self.db.execute(
+            "INSERT INTO spool (race_id, racer_id, payload, fetched_at, worker_id) VALUES (?, ?, ?, ?, ?)",
+            (race_id, racer_id, payload, time.time(), worker_id))
+        return cur.lastrowid
+
+    def pending(self, limit=SPOOL_BATCH):
+        """Próximos payloads a aplicar, na ordem em que foram buscados: [(seq, race_id, racer_id, payload, attempts, fetched_at)]."""
+        return self.db.execute(
+            "SELECT seq, race_id, racer_id, payload, attempts, fetched_at FROM spool WHERE status = ? ORDER BY seq LIMIT ?",
+            (PENDING, limit)).fetchall()
+
+    def _set_status(self, seqs, status, error=None):
+        if not seqs:
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany(
+                "UPDATE spool SET status = ?, applied_at = ?, last_error = ? WHERE seq = ?",
+                [(status, time.time(), error, seq) for seq in seqs])
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def mark_applied(self, seqs):
+        self._set_status(seqs, APPLIED)
+
+    def mark_dead(self, seq, error):
+        self._set_status([seq], DEAD, str(error)[:500])
+
+    def mark_failed(self, seqs, error):
+        """Lote não aplicado (MySQL fora, timeout...): continua pendente, com a tentativa contada."""
+        self.db.executemany("UPDATE spool SET attempts = attempts + 1, last_error = ? WHERE seq = ?",
+                            [(str(error)[:500], seq) for seq in seqs])
+
+    def requeue_dead(self):
+        """Devolve os payloads DEAD para a fila (depois de corrigir a causa). Retorna quantos."""
+        return self.db.execute("UPDATE spool SET status = ?, attempts = 0 WHERE status = ?", (PENDING, DEAD)).rowcount
+
+    def purge(self, keep_s=SPOOL_KEEP_S):
+        """Apaga os aplicados há mais de keep_s segundos. Retorna quantos."""
+        deleted = self.db.execute("DELETE FROM spool WHERE status = ? AND applied_at < ?",
+                                  (APPLIED, time.time() - keep_s)).rowcount
+        if deleted:
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+    def stats(self):
+        """{'pending'|'applied'|'dead': quantidade} + idade do pendente mais antigo (lag do drainer, s)."""
+        out = {PENDING: 0, APPLIED: 0, DEAD: 0}
+        for status, n in self.db.execute("SELECT status, COUNT(*) FROM spool GROUP BY status"):
+            out[status] = n
+        oldest = self.db.execute("SELECT MIN(fetched_at) FROM spool WHERE status = ?", (PENDING,)).fetchone()[0]
+        out["lag_s"] = round(time.time() - oldest, 1) if oldest is not None else 0.0
+        return out
+
+# ====================== DRAINER ======================
+def _decode(entries):
+    """Payloads → linhas de gravação. Payload ilegível vai direto para DEAD (não adianta repetir)."""
+    from race_monitor_worker import racer_rows
+    rows, bad = [], []
+    for seq, race_id, racer_id, payload, _, _ in entries:
+        try:
+            data = loads(payload)
+            rows.append((seq, race_id, racer_rows(data["Competitor"], data["Laps"], race_id)))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            bad.append((seq, e))
+    return rows, bad
+
+def _apply(conn, rows):
+    """Grava as linhas num único flush (um commit). Retorna as voltas novas."""
+    from write_behind import WriteBehindBuffer
+    buffer = WriteBehindBuffer(conn, durability="batch", max_rows=float("inf"), max_age_s=float("inf"))
+    for _, _, (values, laps_data) in rows:
+        buffer.add_competitor(values, laps_data)
+    return buffer.flush()
+
+def _sync_groups(race_ids):
+    from race_monitor_populate_groups import sync_groups_from_standings
+    for race_id in race_ids:
+        try:
+            sync_groups_from_standings(race_id)
+        except Exception as e:
+            log_event(log, "spool_group_sync_failed", logging.WARNING, race_id=race_id, error=repr(e))
+
+def drain_once(spool, conn, batch=SPOOL_BATCH):
+    """
+    Aplica um lote de pendentes no MySQL. Retorna os payloads aplicados (0 = fila vazia).
+    Erro do MySQL no lote inteiro: as linhas continuam pendentes e a exceção sobe (o loop espera e tenta de novo).
+    Lote que já falhou SPOOL_MAX_ATTEMPTS vezes é aplicado um a um: o payload rejeitado vai para DEAD
+    e não trava a fila.
+    """
+    entries = spool.pending(batch)
+    if not entries:
+        return 0
+    start = time.perf_counter()
+    rows, bad = _decode(entries)
+    for seq, error in bad:
+        spool.mark_dead(seq, error)
+        log_event(log, "spool_dead", logging.ERROR, seq=seq, error=repr(error))
+
+    if rows and max(e[4] for e in entries) >= SPOOL_MAX_ATTEMPTS:
+        applied = 0
+        for row in rows:
+            try:
+                _apply(conn, [row])
+            except Exception as e:
+                if not conn.is_connected():
+                    raise  # banco caiu: não é culpa do payload
+                spool.mark_dead(row[0], e)
+                log_event(log, "spool_dead", logging.ERROR, seq=row[0], error=repr(e))
+                continue
+            spool.mark_applied([row[0]])
+            applied += 1
+        _sync_groups({row[1] for row in rows})
+        return applied + len(bad)
+
+    try:
+        laps_written = _apply(conn, rows) if rows else 0
+    except Exception as e:
+        spool.mark_failed([row[0] for row in rows], e)
+        raise
+    # Commit no MySQL feito: daqui em diante uma queda só causa reaplicação (idempotente)
+    spool.mark_applied([row[0] for row in rows])
+    _sync_groups({row[1] for row in rows})
+    log_event(log, "spool_drained", payloads=len(rows), laps_written=laps_written,
+              lag_s=round(time.time() - entries[0][5], 1),
+              elapsed_ms=(time.perf_counter() - start) * 1000.0)
+    return len(entries)
+
+def drain(spool, batch=SPOOL_BATCH, loop=False, max_seconds=None, poll_s=SPOOL_POLL_S):
+    """
+    Esvazia o spool (loop=True: continua esperando novos payloads até max_seconds).
+    Abre/reabre a conexão MySQL conforme necessário; com o banco fora, espera e tenta de novo.
+    Retorna o total de payloads aplicados.
+    """
+    from api_health import backoff_delay
+    from db_config import get_mysql_conn
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    total, failures, conn = 0, 0, None
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = get_mysql_conn()
+                n = drain_once(spool, conn, batch)
+                failures = 0
+            except Exception as e:
+                log_event(log, "spool_drain_failed", logging.WARNING, error=repr(e))
+                print(f"⚠️ Falha ao aplicar lote do spool: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                failures += 1
+                if not loop:
+                    raise
+                time.sleep(max(poll_s, backoff_delay(failures, base=1.0, cap=30.0)))
+                n = 0
+            total += n
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if not n:
+                if not loop:
+                    break
+                spool.purge()
+                time.sleep(poll_s)
+    finally:
+        if conn is not None:
+            conn.close()
+    return total
+
+def drainer_lock(path=SPOOL_PATH):
+    """Garante um único drainer por spool (lock exclusivo não bloqueante). Retorna o arquivo ou None."""
+    lock = open(path + ".drain.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+# ====================== CLI ======================
+def main():
+    parser = argparse.ArgumentParser(description="Spool local de payloads do GetRacer: aplica no MySQL e mostra o estado.")
+    parser.add_argument("--path", default=SPOOL_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_drain = sub.add_parser("drain", help="Aplica os pendentes no MySQL.")
+    p_drain.add_argument("--batch", type=int, default=SPOOL_BATCH)
+    p_drain.add_argument("--loop", action="store_true", help="Continua esperando novos payloads.")
+    p_drain.add_argument("--max-seconds", type=float, help="Com --loop: sai depois deste tempo (ex.: 55 no cron).")
+    sub.add_parser("stats", help="Pendentes, aplicados, DEAD e lag.")
+    sub.add_parser("requeue", help="Devolve os DEAD para a fila.")
+    p_purge = sub.add_parser("purge", help="Apaga aplicados antigos.")
+    p_purge.add_argument("--keep-hours", type=float, default=SPOOL_KEEP_S / 3600)
+    args = parser.parse_args()
+
+    with PayloadSpool(args.path) as spool:
+        if args.command == "drain":
+            lock = drainer_lock(args.path)
+            if lock is None:
+                print("Outro drainer já está rodando neste spool.")
+                return
+            try:
+                n = drain(spool, max(1, args.batch), args.loop, args.max_seconds)
+            finally:
+                lock.close()
+            print(f"✅ {n} payload(s) aplicados.")
+        elif args.command == "stats":
+            s = spool.stats()
+            print(f"pendentes={s[PENDING]} aplicados={s[APPLIED]} dead={s[DEAD]} lag={s['lag_s']}s")
+        elif args.command == "requeue":
+            print(f"✅ {spool.requeue_dead()} payload(s) devolvidos à fila.")
+        else:
+            print(f"✅ {spool.purge(args.keep_hours * 3600)} payload(s) apagados.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+
+import cProfile
+import glob
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ====================== CONFIG ======================
+# Desligado por padrão. MYKART_PROFILE lista os alvos, separados por vírgula:
+#   endpoints do Flask (dashboard, box_eval, api_standings...), 'scheduler', 'ingest' ou 'all'.
+# Ex.: MYKART_PROFILE=dashboard,box_eval,scheduler MYKART_PROFILE_SAMPLE=0.2
+PROFILE_TARGETS = {t.strip() for t in os.environ.get("MYKART_PROFILE", "").split(",") if t.strip()}
+PROFILE_SAMPLE = float(os.environ.get("MYKART_PROFILE_SAMPLE", 1.0))  # fração das execuções perfiladas
+PROFILE_MIN_MS = float(os.environ.get("MYKART_PROFILE_MIN_MS", 0))    # só grava perfis mais lentos que isto
+PROFILE_DIR = os.environ.get("MYKART_PROFILE_DIR", "/home/ubuntu/mykartapp/profiles")
+PROFILE_KEEP = int(os.environ.get("MYKART_PROFILE_KEEP", 200))        # rotação: mantém os N mais recentes
+PROFILE_EXT = ".prof"
+
+_NAME_RE = re.compile(r"^(\d{8}-\d{6}-\d{3})_([\w.-]+?)__([\w.-]*)_(\d+)ms\.prof$")
+
+def profiling_enabled(target):
+    """True se o alvo está habilitado e esta execução caiu na amostragem."""
+    if not PROFILE_TARGETS or not (target in PROFILE_TARGETS or "all" in PROFILE_TARGETS):
+        return False
+    return PROFILE_SAMPLE >= 1.0 or random.random() < PROFILE_SAMPLE
+
+def _safe(text):
+    return re.sub(r"[^\w.-]+", "-", str(text or ""))[:60]
+
+def _rotate(directory, keep):
+    files = sorted(glob.glob(os.path.join(directory, "*" + PROFILE_EXT)))
+    for old in files[:max(0, len(files) - keep)]:
+        try:
+            os.unlink(old)
+        except FileNotFoundError:
+            pass
+
+def save_profile(profiler, target, label, elapsed_ms, directory=None):
+    """Grava o perfil como <timestamp>_<alvo>__<rótulo>_<ms>ms.prof e aplica a rotação."""
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+    name = f"{stamp}_{_safe(target)}__{_safe(label)}_{int(elapsed_ms)}ms{PROFILE_EXT}"
+    path = os.path.join(directory, name)
+    profiler.dump_stats(path)
+    _rotate(directory, PROFILE_KEEP)
+    return path
+
+# cProfile só admite um profiler ativo por processo: requisições concorrentes não são perfiladas
+_active = threading.Lock()
+
+class Profile:
+    """
+    cProfile de uma execução; stop() grava se passou de PROFILE_MIN_MS. Retorna o caminho ou None.
+    Se outro perfil já está ativo no processo, esta execução simplesmente não é perfilada.
+    """
+
+    def __init__(self, target, label=""):
+        self.target = target
+        self.label = label
+        self.profiler = None
+        self.start = time.perf_counter()
+        if _active.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self, label=None):
+        if self.profiler is None:
+            return None
+        self.profiler.disable()
+        _active.release()
+        elapsed_ms = (time.perf_counter() - self.start) * 1000.0
+        if elapsed_ms < PROFILE_MIN_MS:
+            return None
+        return save_profile(self.profiler, self.target, label if label is not None else self.label, elapsed_ms)
+
+@contextmanager
+def profile_block(target, label=""):
+    """Perfila o bloco se o alvo estiver habilitado (custo zero quando desligado)."""
+    if not profiling_enabled(target):
+        yield None
+        return
+    prof = Profile(target, label)
+    try:
+        yield prof
+    finally:
+        prof.stop()
+
+# ====================== LEITURA (página de perfis) ======================
+def list_profiles(limit=50, directory=None):
+    """Perfis mais recentes primeiro: dicts com name, target, label, time, elapsed_ms, size."""
+    directory = directory or PROFILE_DIR
+    out = []
+    for path in sorted(glob.glob(os.path.join(directory, "*" + PROFILE_EXT)), reverse=True)[:limit]:
+        name = os.path.basename(path)
+        m = _NAME_RE.match(name)
+        if not m:
+            continue
+        stamp, target, label, ms = m.groups()
+        out.append({
+            "name": name,
+            "target": target,
+            "label": label,
+            "time": datetime.strptime(stamp, "%Y%m%d-%H%M%S-%f").strftime("%d/%m %H:%M:%S"),
+            "elapsed_ms": int(ms),
+            "size": os.path.getsize(path),
+        })
+    return out
+
+def profile_path(name, directory=None):
+    """Caminho do perfil pelo nome (None se o nome não é de um perfil válido)."""
+    if not _NAME_RE.match(name or ""):
+        return None
+    path = os.path.join(directory or PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+def top_hotspots(path, n=25, sort="cumulative"):
+    """Funções mais caras do perfil: dicts com func, ncalls, tottime_ms, cumtime_ms."""
+    stats = pstats.Stats(path)
+    stats.sort_stats(sort)
+    rows = []
+    for func in stats.fcn_list[:n]:
+        cc, nc, tt, ct, _ = stats.stats[func]
+        filename, line, fname = func
+        rows.append({
+            "func": f"{fname} ({os.path.basename(filename)}:{line})" if line else fname,
+            "ncalls": nc if nc == cc else f"{nc}/{cc}",
+            "tottime_ms": round(tt * 1000.0, 1),
+            "cumtime_ms": round(ct * 1000.0, 1),
+        })
+    return rows
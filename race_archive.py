@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import os
+import sys
+
+import mysql.connector
+
+from db_config import get_mysql_conn
+from cleanup_tables import purge_race
+from columnar_file import ColumnarWriter, FILE_EXT, iter_batches, read_header
+
+# ====================== CONFIG ======================
+ARCHIVE_DIR = os.environ.get("MYKART_ARCHIVE_DIR", "/home/ubuntu/mykartapp/archive")
+TABLE_LAPS = "competitor_laps"
+TABLE_COMPETITORS = "competitors"
+FETCH_ROWS = 5_000
+
+# Erros MySQL relevantes
+ER_SAME_NAME_PARTITION = 1517
+
+LAPS_SCHEMA = [
+    ("id", "q"), ("race_id", "i"), ("racer_id", "i"), ("lap_number", "i"), ("position", "i"),
+    ("lap_time", "str"), ("flag_status", "str"), ("total_time", "str"),
+]
+COMPETITORS_SCHEMA = [
+    ("racer_id", "i"), ("race_id", "i"), ("number", "str"), ("transponder", "str"),
+    ("first_name", "str"), ("last_name", "str"), ("nationality", "str"), ("additional_data", "str"),
+    ("class_id", "i"), ("position", "i"), ("laps_completed", "i"), ("total_time", "str"),
+    ("best_position", "i"), ("best_lap", "i"), ("best_lap_time", "str"), ("last_lap_time", "str"),
+    ("updated_at", "str"),
+]
+
+def partition_name(race_id):
+    return f"p_{int(race_id)}"
+
+def archive_paths(race_id, archive_dir=ARCHIVE_DIR):
+    base = os.path.join(archive_dir, f"race_{int(race_id)}")
+    return base + "_laps" + FILE_EXT, base + "_competitors" + FILE_EXT
+
+# ====================== PARTIÇÕES ======================
+def list_partitions(conn):
+    """Partições atuais de competitor_laps ({} se a tabela não é particionada)."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT PARTITION_NAME, TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (TABLE_LAPS,))
+    rows = {name: table_rows for name, table_rows in cur.fetchall()}
+    cur.close()
+    return rows
+
+def ensure_race_partition(conn, race_id):
+    """
+    Garante a partição p_<race_id> em competitor_laps. Retorna False se a tabela não é particionada.
+    Seguro para processos concorrentes (partição duplicada é ignorada).
+    """
+    parts = list_partitions(conn)
+    if not parts:
+        return False
+    name = partition_name(race_id)
+    if name in parts:
+        return True
+    cur = conn.cursor()
+    try:
+        cur.execute(f"ALTER TABLE {TABLE_LAPS} ADD PARTITION (PARTITION {name} VALUES IN ({int(race_id)}))")
+    except mysql.connector.Error as e:
+        if e.errno != ER_SAME_NAME_PARTITION:
+            raise
+    finally:
+        cur.close()
+    return True
+
+_ready_partitions = set()  # race_ids com partição já garantida neste processo
+
+def prepare_race_partitions(conn, race_ids):
+    """
+    Garante a partição de cada corrida antes de gravar voltas. Os inserts de voltas usam INSERT IGNORE,
+    que transforma "sem partição para o valor" (1526) em warning e descarta as linhas: a partição
+    precisa existir antes do primeiro insert. ALTER TABLE faz commit implícito, então chamar fora
+    da transação do chamador. Uma verificação por corrida por processo.
+    """
+    for race_id in sorted(set(race_ids) - _ready_partitions):
+        ensure_race_partition(conn, race_id)
+        _ready_partitions.add(race_id)
+
+def partition_init_sql(conn):
+    """SQL para converter competitor_laps em PARTITION BY LIST (race_id), uma partição por corrida."""
+    cur = conn.cursor()
+    cur.execute(f"SELECT DISTINCT race_id FROM {TABLE_LAPS}")
+    race_ids = {r[0] for r in cur.fetchall()}
+    cur.execute("SELECT DISTINCT race_id FROM app_config")
+    race_ids |= {r[0] for r in cur.fetchall() if r[0]}
+    cur.execute("""
+        SELECT COLUMN_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = 'PRIMARY'
+    """, (TABLE_LAPS,))
+    pk_cols = {r[0] for r in cur.fetchall()}
+    cur.close()
+
+    queries = []
+    # Toda chave única de uma tabela particionada precisa conter a coluna de partição
+    if "race_id" not in pk_cols:
+        queries.append(f"ALTER TABLE {TABLE_LAPS} DROP PRIMARY KEY, ADD PRIMARY KEY (id, race_id)")
+    parts = ", ".join(
+        f"PARTITION {partition_name(r)} VALUES IN ({int(r)})" for r in sorted(race_ids or {0})
+    )
+    queries.append(f"ALTER TABLE {TABLE_LAPS} PARTITION BY LIST (race_id) ({parts})")
+    return queries
+
+def drop_race_partition(conn, race_id):
+    """Remove as voltas da corrida descartando a partição (instantâneo, sem undo log)."""
+    parts = list_partitions(conn)
+    name = partition_name(race_id)
+    if name not in parts:
+        raise RuntimeError(f"Partição {name} não encontrada em {TABLE_LAPS}.")
+    _ready_partitions.discard(race_id)
+    cur = conn.cursor()
+    if len(parts) == 1:
+        # MySQL não permite remover a última partição
+        cur.execute(f"ALTER TABLE {TABLE_LAPS} TRUNCATE PARTITION {name}")
+    else:
+        cur.execute(f"ALTER TABLE {TABLE_LAPS} DROP PARTITION {name}")
+    cur.close()
+
+# ====================== ARQUIVAMENTO ======================
+def _export_query(conn, path, sql, params, schema, meta):
+    """Exporta o resultado da query para o arquivo colunar (escrita atômica via .tmp)."""
+    tmp = path + ".tmp"
+    cur = conn.cursor()  # não bufferizado: lê em blocos de FETCH_ROWS
+    cur.execute(sql, params)
+    with open(tmp, "wb") as f:
+        writer = ColumnarWriter(f, schema, meta)
+        while True:
+            rows = cur.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            writer.write_rows([tuple(None if v is None else (str(v) if t == "str" else v)
+                                     for v, (_, t) in zip(row, schema)) for row in rows])
+        writer.close()
+    cur.close()
+    os.replace(tmp, path)
+    return writer.rows_written
+
+def archive_race(conn, race_id, archive_dir=ARCHIVE_DIR, keep=False):
+    """
+    Exporta voltas e competidores da corrida para arquivos colunares comprimidos e,
+    se keep=False, descarta a partição da corrida e os competidores correspondentes
+    (sem particionamento, remove as voltas com o purge em lotes do cleanup_tables).
+    Retorna (caminho_voltas, linhas_voltas, caminho_competidores, linhas_competidores).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    laps_path, comp_path = archive_paths(race_id, archive_dir)
+    meta = {"race_id": int(race_id), "table": TABLE_LAPS}
+
+    laps_cols = ", ".join(name for name, _ in LAPS_SCHEMA)
+    n_laps = _export_query(
+        conn, laps_path,
+        f"SELECT {laps_cols} FROM {TABLE_LAPS} WHERE race_id = %s ORDER BY racer_id, lap_number",
+        (race_id,), LAPS_SCHEMA, meta,
+    )
+    comp_cols = ", ".join(name for name, _ in COMPETITORS_SCHEMA)
+    n_comp = _export_query(
+        conn, comp_path,
+        f"SELECT {comp_cols} FROM {TABLE_COMPETITORS} WHERE race_id = %s ORDER BY racer_id",
+        (race_id,), COMPETITORS_SCHEMA, dict(meta, table=TABLE_COMPETITORS),
+    )
+
+    # Confere o arquivo antes de apagar qualquer coisa
+    written = sum(len(batch["race_id"]) for _, batch in iter_batches(laps_path, ["race_id"]))
+    if written != n_laps:
+        raise RuntimeError(f"Arquivo {laps_path} com {written} linhas, esperado {n_laps}.")
+
+    if not keep:
+        if list_partitions(conn):
+            drop_race_partition(conn, race_id)
+        else:
+            purge_race(conn, race_id, tables=(TABLE_LAPS,))
+        cur = conn.cursor()
+        cur.execute(f"DELETE FROM {TABLE_COMPETITORS} WHERE race_id = %s", (race_id,))
+        conn.commit()
+        cur.close()
+    return laps_path, n_laps, comp_path, n_comp
+
+# ====================== LEITURA OFFLINE ======================
+def list_archives(archive_dir=ARCHIVE_DIR):
+    """Retorna [(race_id, caminho_voltas)] dos arquivos de voltas presentes no diretório."""
+    out = []
+    if not os.path.isdir(archive_dir):
+        return out
+    for fname in sorted(os.listdir(archive_dir)):
+        if fname.startswith("race_") and fname.endswith("_laps" + FILE_EXT):
+            path = os.path.join(archive_dir, fname)
+            with open(path, "rb") as f:
+                out.append((read_header(f)["meta"].get("race_id"), path))
+    return out
+
+def query_archive(race_id, racer_id=None, columns=None, table=TABLE_LAPS, archive_dir=ARCHIVE_DIR):
+    """Gera as linhas (dict) de uma corrida arquivada, opcionalmente filtrando por racer_id."""
+    laps_path, comp_path = archive_paths(race_id, archive_dir)
+    path = laps_path if table == TABLE_LAPS else comp_path
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Corrida {race_id} não arquivada em {archive_dir}.")
+    wanted = list(columns) if columns else None
+    if wanted and racer_id is not None and "racer_id" not in wanted:
+        wanted.append("racer_id")
+    for _, batch in iter_batches(path, wanted):
+        names = list(batch)
+        for values in zip(*(batch[n] for n in names)):
+            row = dict(zip(names, values))
+            if racer_id is not None and row["racer_id"] != racer_id:
+                continue
+            yield {k: v for k, v in row.items() if not columns or k in columns}
+
+# ====================== CLI ======================
+def main():
+    parser = argparse.ArgumentParser(
+        description="Particionamento por race_id e arquivamento colunar de competitor_laps."
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_init = sub.add_parser("partition-init", help="Converte competitor_laps para PARTITION BY LIST (race_id).")
+    p_init.add_argument("--dry-run", action="store_true", help="Apenas mostra o SQL.")
+
+    p_ens = sub.add_parser("ensure", help="Cria a partição da corrida, se faltar.")
+    p_ens.add_argument("--race-id", type=int, required=True)
+
+    p_arc = sub.add_parser("archive", help="Exporta a corrida para arquivo colunar e remove a partição.")
+    p_arc.add_argument("--race-id", type=int, required=True)
+    p_arc.add_argument("--out-dir", default=ARCHIVE_DIR)
+    p_arc.add_argument("--keep", action="store_true", help="Apenas exporta, não remove dados do MySQL.")
+    p_arc.add_argument("--force", action="store_true", help="Permite arquivar a corrida ativa do app_config.")
+
+    p_list = sub.add_parser("list", help="Lista corridas arquivadas.")
+    p_list.add_argument("--dir", default=ARCHIVE_DIR)
+
+    p_q = sub.add_parser("query", help="Consulta offline uma corrida arquivada (saída CSV).")
+    p_q.add_argument("--race-id", type=int, required=True)
+    p_q.add_argument("--racer-id", type=int)
+    p_q.add_argument("--columns", help="Lista separada por vírgula (padrão: todas).")
+    p_q.add_argument("--competitors", action="store_true", help="Consulta a tabela de competidores arquivada.")
+    p_q.add_argument("--dir", default=ARCHIVE_DIR)
+
+    args = parser.parse_args()
+
+    if args.cmd == "list":
+        for race_id, path in list_archives(args.dir):
+            print(f"race_id={race_id} → {path} ({os.path.getsize(path)} bytes)")
+        return
+
+    if args.cmd == "query":
+        columns = [c.strip() for c in args.columns.split(",")] if args.columns else None
+        table = TABLE_COMPETITORS if args.competitors else TABLE_LAPS
+        writer = None
+        for row in query_archive(args.race_id, args.racer_id, columns, table, args.dir):
+            if writer is None:
+                writer = csv.DictWriter(sys.stdout, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+        return
+
+    conn = get_mysql_conn()
+    try:
+        if args.cmd == "partition-init":
+            queries = partition_init_sql(conn)
+            if args.dry_run:
+                print("🔍 Modo DRY-RUN: As seguintes queries seriam executadas:")
+                for q in queries:
+                    print(f"→ {q}")
+                return
+            cur = conn.cursor()
+            for q in queries:
+                print(f"→ {q}")
+                cur.execute(q)
+            cur.close()
+            print("✅ competitor_laps particionada por race_id.")
+
+        elif args.cmd == "ensure":
+            if ensure_race_partition(conn, args.race_id):
+                print(f"✅ Partição {partition_name(args.race_id)} disponível.")
+            else:
+                print(f"⚠️ {TABLE_LAPS} não é particionada (rode partition-init).")
+
+        elif args.cmd == "archive":
+            cur = conn.cursor()
+            cur.execute("SELECT race_id FROM app_config WHERE race_id = %s LIMIT 1", (args.race_id,))
+            active = cur.fetchone()
+            cur.close()
+            if active and not args.force and not args.keep:
+                print(f"Erro: race_id={args.race_id} está ativa em app_config (use --force).")
+                sys.exit(1)
+            laps_path, n_laps, comp_path, n_comp = archive_race(conn, args.race_id, args.out_dir, args.keep)
+            print(f"✅ {n_laps} voltas → {laps_path}")
+            print(f"✅ {n_comp} competidores → {comp_path}")
+            if not args.keep:
+                print(f"🗑️ Voltas e competidores da corrida {args.race_id} removidos do MySQL.")
+    except Exception as e:
+        conn.rollback()
+        print("❌ Erro:", e)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
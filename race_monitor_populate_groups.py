@@ -1,9 +1,15 @@
 
+import argparse
 import http.client
 import json
 from datetime import datetime
 
-from db_config import get_mysql_conn, get_app_config
+import mysql.connector
+
+from db_config import get_mysql_conn, get_app_config, get_active_race_ids
+
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
 
 def safe_int(value, default=0):
     try:
@@ -11,9 +17,9 @@ def safe_int(value, default=0):
     except (ValueError, TypeError):
         return default
 
-def fetch_session():
-    """Busca dados da sessão (competidores) na API Race Monitor."""
-    cfg = get_app_config()
+def fetch_session(race_id=None):
+    """Busca dados da sessão (competidores) na API Race Monitor (com chave da corrida, se informada)."""
+    cfg = get_app_config(race_id)
     api_token = cfg["api_token"]
     race_id = cfg["race_id"]
 
@@ -26,48 +32,150 @@ def fetch_session():
     conn.close()
     return json.loads(raw)
 
-def get_group_2min_ids():
-    """Lê racer_ids da tabela de 2 minutos (não alterada por este script)."""
+def get_group_2min_ids(race_id):
+    """Lê racer_ids da tabela de 2 minutos da corrida (não alterada por este script)."""
     conn_db = get_mysql_conn()
     cur = conn_db.cursor()
-    cur.execute("SELECT racer_id FROM update_group_2min")
+    cur.execute("SELECT racer_id FROM update_group_2min WHERE race_id = %s", (race_id,))
     ids = {row[0] for row in cur.fetchall()}
     cur.close()
     conn_db.close()
     return ids
 
-def reset_and_fill_aux_tables(top5_ids, other_ids):
+GROUP_TABLES = ("update_group_4min", "update_group_rest")
+TOP_N = 5
+
+def split_groups(racer_ids_by_position, group2_ids, top_n=TOP_N):
+    """Divide os racer_ids (já ordenados por posição) em top N (4min) e restante, ignorando o grupo 2min."""
+    filtered = [rid for rid in racer_ids_by_position if rid not in group2_ids]
+    return filtered[:top_n], filtered[top_n:]
+
+def _replace_group(cur, table, race_id, racer_ids):
+    """Troca o grupo da corrida por racer_ids: 1 DELETE + 1 INSERT multi-linha (mantém last_update de quem fica)."""
+    if racer_ids:
+        placeholders = ",".join(["%s"] * len(racer_ids))
+        cur.execute(f"DELETE FROM {table} WHERE race_id = %s AND racer_id NOT IN ({placeholders})",
+                    (race_id, *racer_ids))
+        values = ",".join(["(%s, %s, NULL)"] * len(racer_ids))
+        params = [v for rid in racer_ids for v in (race_id, rid)]
+        cur.execute(f"""
+            INSERT INTO {table} (race_id, racer_id, last_update)
+            VALUES {values}
+            ON DUPLICATE KEY UPDATE racer_id = VALUES(racer_id)
+        """, params)
+    else:
+        cur.execute(f"DELETE FROM {table} WHERE race_id = %s", (race_id,))
+
+def reset_and_fill_aux_tables(race_id, top5_ids, other_ids, conn_db=None):
     """
-    Limpa as tabelas de 4 minutos e restante, depois insere IDs.
+    Atualiza as tabelas de 4 minutos e restante numa única transação (sem TRUNCATE):
+    leitores continuam vendo a composição anterior até o COMMIT, então não existe janela com tabela vazia.
     Não toca na 2 minutos (manual).
     """
-    conn_db = get_mysql_conn()
+    own_conn = conn_db is None
+    if own_conn:
+        conn_db = get_mysql_conn()
     cur = conn_db.cursor()
-
-    cur.execute("TRUNCATE TABLE update_group_4min")
-    cur.execute("TRUNCATE TABLE update_group_rest")
-
-    for racer_id in top5_ids:
-        cur.execute("""
-            INSERT INTO update_group_4min (racer_id, last_update)
-            VALUES (%s, NULL)
-        """, (racer_id,))
-
-    for racer_id in other_ids:
-        cur.execute("""
-            INSERT INTO update_group_rest (racer_id, last_update)
-            VALUES (%s, NULL)
-        """, (racer_id,))
-
-    conn_db.commit()
+    try:
+        # Remove primeiro de quem perde o racer, depois insere em quem ganha (mesma ordem em todo processo)
+        _replace_group(cur, "update_group_rest", race_id, list(other_ids))
+        _replace_group(cur, "update_group_4min", race_id, list(top5_ids))
+        conn_db.commit()
+    except Exception:
+        conn_db.rollback()
+        raise
+    finally:
+        cur.close()
+        if own_conn:
+            conn_db.close()
+
+def move_known_racers(race_id, top5_ids, other_ids, group2_ids, current, conn_db):
+    """
+    Ajuste incremental dos grupos 4min/rest numa transação: só mexe nos racers de top5_ids/other_ids
+    (os que já têm posição em competitors) e tira do 4min/rest quem está no 2min.
+    Racers sem linha em competitors (ainda não consultados no início da corrida) ficam onde estão.
+    Retorna True se algo mudou.
+    """
+    to_4min = [rid for rid in top5_ids if rid not in current["update_group_4min"]]
+    to_rest = [rid for rid in other_ids if rid not in current["update_group_rest"]]
+    from_2min = sorted(group2_ids & (current["update_group_4min"] | current["update_group_rest"]))
+    if not (to_4min or to_rest or from_2min):
+        return False
+    cur = conn_db.cursor()
+    try:
+        # Remove primeiro de quem perde o racer, depois insere em quem ganha (mesma ordem em todo processo)
+        for table, ids in (("update_group_rest", to_4min + from_2min), ("update_group_4min", to_rest + from_2min)):
+            if ids:
+                placeholders = ",".join(["%s"] * len(ids))
+                cur.execute(f"DELETE FROM {table} WHERE race_id = %s AND racer_id IN ({placeholders})",
+                            (race_id, *ids))
+        for table, ids in (("update_group_4min", to_4min), ("update_group_rest", to_rest)):
+            if ids:
+                values = ",".join(["(%s, %s, NULL)"] * len(ids))
+                cur.execute(f"""
+                    INSERT INTO {table} (race_id, racer_id, last_update)
+                    VALUES {values}
+                    ON DUPLICATE KEY UPDATE racer_id = VALUES(racer_id)
+                """, [v for rid in ids for v in (race_id, rid)])
+        conn_db.commit()
+    except Exception:
+        conn_db.rollback()
+        raise
+    finally:
+        cur.close()
+    return True
+
+def get_group_members(conn_db, race_id):
+    """{tabela: set(racer_id)} para 4min e rest da corrida."""
+    cur = conn_db.cursor()
+    members = {}
+    for table in GROUP_TABLES:
+        cur.execute(f"SELECT racer_id FROM {table} WHERE race_id = %s", (race_id,))
+        members[table] = {row[0] for row in cur.fetchall()}
     cur.close()
-    conn_db.close()
+    return members
 
-if __name__ == "__main__":
-    data = fetch_session()
+def sync_groups_from_standings(race_id, conn_db=None):
+    """
+    Recalcula os grupos a partir das posições já gravadas em competitors (dados ao vivo, sem chamada à API)
+    e só escreve se o top 5 / restante mudou. Retorna True se os grupos foram atualizados.
+    Só move racers que já têm posição: no início da corrida competitors ainda não tem todos os karts,
+    e os que faltam continuam no grupo em que populate_race os colocou (senão nunca seriam consultados).
+    """
+    own_conn = conn_db is None
+    if own_conn:
+        conn_db = get_mysql_conn()
+    try:
+        cur = conn_db.cursor()
+        cur.execute("""
+            SELECT racer_id FROM competitors
+            WHERE race_id = %s AND position > 0
+            ORDER BY position ASC, racer_id ASC
+        """, (race_id,))
+        by_position = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT racer_id FROM update_group_2min WHERE race_id = %s", (race_id,))
+        group2_ids = {row[0] for row in cur.fetchall()}
+        cur.close()
+        if not by_position:
+            return False
+
+        top5_ids, other_ids = split_groups(by_position, group2_ids)
+        current = get_group_members(conn_db, race_id)
+        try:
+            return move_known_racers(race_id, top5_ids, other_ids, group2_ids, current, conn_db)
+        except mysql.connector.Error as e:
+            if e.errno in (ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT):
+                return False  # outro processo está aplicando a mesma troca
+            raise
+    finally:
+        if own_conn:
+            conn_db.close()
+
+def populate_race(race_id):
+    """Popula 4min/rest de uma corrida a partir da sessão ao vivo (GetSession)."""
+    data = fetch_session(race_id)
     if not data.get("Successful"):
-        print("Erro da API:", data.get("Message", "Falha desconhecida"))
-        raise SystemExit(1)
+        raise RuntimeError(f"Erro da API (race_id={race_id}): {data.get('Message', 'Falha desconhecida')}")
 
     competitors_dict = data["Session"]["Competitors"]  # dicionário: chaves são RacerID
     # Lista ordenada por posição crescente
@@ -77,16 +185,29 @@ if __name__ == "__main__":
     )
 
     # IDs que já estão na tabela 2min (excluídos)
-    group2_ids = get_group_2min_ids()
-
-    filtered = [c for c in competitors_sorted if safe_int(c.get("RacerID")) not in group2_ids]
+    group2_ids = get_group_2min_ids(race_id)
 
-    top5_ids = [safe_int(c.get("RacerID")) for c in filtered[:5]]
-    other_ids = [safe_int(c.get("RacerID")) for c in filtered[5:]]
+    top5_ids, other_ids = split_groups([safe_int(c.get("RacerID")) for c in competitors_sorted], group2_ids)
 
-    reset_and_fill_aux_tables(top5_ids, other_ids)
+    reset_and_fill_aux_tables(race_id, top5_ids, other_ids)
 
-    print(f"✅ População concluída às {datetime.now().strftime('%H:%M:%S')}")
+    print(f"✅ População concluída (race_id={race_id}) às {datetime.now().strftime('%H:%M:%S')}")
     print(f"➡️ Ignorados (2min): {sorted(group2_ids)}")
     print(f"➡️ 4min (top5): {top5_ids}")
     print(f"➡️ REST (outros): {other_ids}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Popula os grupos 4min/rest a partir da sessão ao vivo.")
+    parser.add_argument("--race-id", type=int, help="Corrida a popular (padrão: todas as corridas ativas).")
+    args = parser.parse_args()
+
+    race_ids = [args.race_id] if args.race_id else get_active_race_ids()
+    failed = False
+    for race_id in race_ids:
+        try:
+            populate_race(race_id)
+        except Exception as e:
+            failed = True
+            print("Erro:", e)
+    if failed or not race_ids:
+        raise SystemExit(1)
@@ -1,45 +1,90 @@
 
+import argparse
+import os
+import socket
 import mysql.connector
 from datetime import datetime
 
-from db_config import get_mysql_conn
-from race_monitor_worker import fetch_racer, update_database
+from db_config import get_mysql_conn, get_active_race_ids
+from race_monitor_worker import fetch_racer, update_database, feed_standings, racer_rows
+from race_monitor_populate_groups import sync_groups_from_standings
+from profiling import profile_block
+from write_behind import WriteBehindBuffer, WRITE_DURABILITY, DURABILITY_MODES
+from payload_spool import PayloadSpool, SPOOL_ENABLED, SPOOL_PATH
+from payload_hash import PayloadHashStore, payload_digest, PAYLOAD_HASH_ENABLED, PAYLOAD_HASH_PATH
+from event_log import get_event_logger, log_event
 
 INTERVAL_A = 120  # 2 min
 INTERVAL_B = 240  # 4 min
 
+# Lease: enquanto claimed_until > NOW(), nenhum outro worker pega o mesmo racer.
+# Deve cobrir com folga uma chamada à API + gravação (se o worker morrer, a linha volta sozinha).
+LEASE_SECONDS = 60
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+log = get_event_logger("race_monitor", "race_monitor.log")
+
 TABLES = [
     ("update_group_2min", INTERVAL_A),
     ("update_group_4min", INTERVAL_B),
     ("update_group_rest", 0)  # sem intervalo mínimo específico
 ]
 
-def get_next_record():
+def claim_next_record(race_id, worker_id=WORKER_ID, lease_seconds=LEASE_SECONDS):
     """
-    Lê o candidato mais antigo de cada tabela (ORDER BY last_update ASC, racer_id ASC),
-    e escolhe o mais antigo geral (em empate, menor racer_id).
+    Reivindica (lease) o candidato mais antigo da corrida entre as três tabelas.
+
+    Numa única transação, lê o candidato livre mais antigo de cada tabela com
+    FOR UPDATE SKIP LOCKED (linhas travadas por outro worker são puladas) e ignora
+    linhas com lease ainda válido (claimed_until > NOW()). O mais antigo geral
+    (em empate, menor racer_id) só é reivindicado se já venceu o intervalo mínimo.
+
+    Retorna (table, interval, racer_id, last_update, claimed):
+      claimed=False → candidato existe, mas ainda não venceu o intervalo (nada foi reservado).
+    Retorna None se não há candidato livre.
     """
     conn_db = get_mysql_conn()
     cur = conn_db.cursor()
+    try:
+        candidates = []
+        for table, interval in TABLES:
+            cur.execute(f"""
+                SELECT racer_id, COALESCE(last_update, '1970-01-01 00:00:00') AS last_update
+                FROM {table}
+                WHERE race_id = %s
+                  AND (claimed_until IS NULL OR claimed_until < NOW())
+                ORDER BY last_update ASC, racer_id ASC
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            """, (race_id,))
+            row = cur.fetchone()
+            if row:
+                racer_id, last_update = row
+                candidates.append((table, interval, racer_id, str(last_update)))
 
-    candidates = []
-    for table, interval in TABLES:
-        cur.execute(f"""
-            SELECT racer_id, COALESCE(last_update, '1970-01-01 00:00:00') AS last_update
-            FROM {table}
-            ORDER BY last_update ASC, racer_id ASC
-            LIMIT 1
-        """)
-        row = cur.fetchone()
-        if row:
-            racer_id, last_update = row
-            candidates.append((table, interval, racer_id, last_update))
+        if not candidates:
+            conn_db.rollback()
+            return None
 
-    cur.close()
-    conn_db.close()
+        candidates.sort(key=lambda x: (x[3], x[2]))
+        table, interval, racer_id, last_update = candidates[0]
+        if not should_update(last_update, interval):
+            conn_db.rollback()
+            return table, interval, racer_id, last_update, False
 
-    candidates.sort(key=lambda x: (x[3], x[2]))
-    return candidates[0] if candidates else None
+        cur.execute(f"""
+            UPDATE {table}
+            SET claimed_by = %s, claimed_until = NOW() + INTERVAL %s SECOND
+            WHERE race_id = %s AND racer_id = %s
+        """, (worker_id, int(lease_seconds), race_id, racer_id))
+        conn_db.commit()  # libera os locks; a partir daqui o lease protege a linha
+        return table, interval, racer_id, last_update, True
+    except Exception:
+        conn_db.rollback()
+        raise
+    finally:
+        cur.close()
+        conn_db.close()
 
 def parse_dt(dt_str):
     """Converte 'YYYY-MM-DD HH:MM:SS' para datetime (garante hora caso falte)."""
@@ -55,32 +100,156 @@ def should_update(last_update_str, interval_seconds):
     now = datetime.now()
     return (now - last_update_dt).total_seconds() >= interval_seconds
 
-def update_last_update(table_name, racer_id):
-    """Marca last_update = NOW() na tabela auxiliar."""
+def release_claim(table_name, race_id, racer_id, worker_id=WORKER_ID, updated=True):
+    """
+    Libera o lease do racer. Com updated=True marca last_update = NOW() (atualização concluída);
+    com updated=False só libera, para que outro worker tente de novo.
+    Só libera se o lease ainda é deste worker (pode ter expirado e sido reivindicado por outro).
+    """
     conn_db = get_mysql_conn()
     cur = conn_db.cursor()
-    cur.execute(f"UPDATE {table_name} SET last_update = NOW() WHERE racer_id = %s", (racer_id,))
+    set_last = "last_update = NOW(), " if updated else ""
+    cur.execute(f"""
+        UPDATE {table_name}
+        SET {set_last}claimed_by = NULL, claimed_until = NULL
+        WHERE race_id = %s AND racer_id = %s AND claimed_by = %s
+    """, (race_id, racer_id, worker_id))
     conn_db.commit()
     cur.close()
     conn_db.close()
 
-def update_racer_once(racer_id, table_name):
-    """Chama API, atualiza DB principal e marca last_update."""
-    data = fetch_racer(racer_id)
-    if data.get("Successful"):
-        update_database(data["Details"]["Competitor"], data["Details"]["Laps"])
-        update_last_update(table_name, racer_id)
-        print(f"[{table_name}] Atualizado racer_id={racer_id} às {datetime.now().strftime('%H:%M:%S')}")
+def _after_write(table_name, race_id, racer_id, ok):
+    """Roda depois que a gravação do racer está commitada: libera o lease e ressincroniza os grupos."""
+    release_claim(table_name, race_id, racer_id, updated=ok)
+    if not ok:
+        return
+    # Posição pode ter mudado: mantém o top 5 (4min) seguindo a classificação, sem chamada extra à API
+    try:
+        if sync_groups_from_standings(race_id):
+            print(f"Grupos 4min/rest reordenados pela classificação (race_id={race_id})")
+    except Exception as e:
+        print(f"Falha ao sincronizar grupos: {e}")
+
+def _release_updated(table_name, race_id, racer_id):
+    """
+    Racer em dia sem gravação no MySQL agora (payload no spool ou igual ao último gravado):
+    libera o lease como atualizado. Com o MySQL fora, o lease expira sozinho.
+    """
+    try:
+        release_claim(table_name, race_id, racer_id, updated=True)
+    except mysql.connector.Error as e:
+        print(f"⚠️ Lease de racer_id={racer_id} não liberado ({e}); expira em {LEASE_SECONDS}s")
+
+def update_racer_once(racer_id, table_name, race_id, buffer=None, spool=None, hashes=None):
+    """
+    Chama API (com chave da corrida), atualiza DB principal e libera o lease marcando last_update.
+    Com buffer (write-behind), o lease só é liberado depois do flush que grava o racer.
+    Com spool (PayloadSpool), o payload só é gravado no spool local e o drainer (payload_spool.py)
+    aplica no MySQL depois; a classificação ao vivo é alimentada na hora.
+    Com hashes (PayloadHashStore), payload igual ao último gravado não é gravado de novo.
+    """
+    digest = None
+    skipped = False
+    try:
+        data = fetch_racer(racer_id, race_id)
+        ok = bool(data.get("Successful"))
+        if ok:
+            comp, laps = data["Details"]["Competitor"], data["Details"]["Laps"]
+            if hashes is not None:
+                digest = payload_digest(*racer_rows(comp, laps, race_id))
+                skipped = hashes.unchanged(race_id, racer_id, digest)
+            if not skipped and spool is not None:
+                spool.append(race_id, racer_id, comp, laps, WORKER_ID)
+                feed_standings(race_id, racer_id, laps)
+            elif not skipped:
+                update_database(comp, laps, race_id, buffer)
+    except Exception:
+        release_claim(table_name, race_id, racer_id, updated=False)
+        raise
+
+    def written():
+        # Hash só depois do commit (ou do spool): se a gravação falhar, o mesmo payload é gravado de novo
+        if digest is not None:
+            hashes.remember(race_id, racer_id, digest)
+        if spool is None:
+            _after_write(table_name, race_id, racer_id, ok)
+
+    if skipped:
+        _release_updated(table_name, race_id, racer_id)
+    elif ok and spool is not None:
+        written()
+        _release_updated(table_name, race_id, racer_id)
+    elif not ok:
+        _after_write(table_name, race_id, racer_id, ok)
+    elif buffer is None:
+        written()
+    else:
+        buffer.after_flush(written)
+    if skipped:
+        print(f"[{table_name}] Sem mudanças race_id={race_id} racer_id={racer_id} (gravação pulada)")
+    elif ok:
+        print(f"[{table_name}] Atualizado race_id={race_id} racer_id={racer_id} às {datetime.now().strftime('%H:%M:%S')} ({WORKER_ID})")
     else:
-        print(f"Falha API para racer_id={racer_id}: {data.get('Message')}")
+        print(f"Falha API para race_id={race_id} racer_id={racer_id}: {data.get('Message')}")
+    return ok
+
+def run_tick(race_id, max_calls=1, buffer=None, spool=None, hashes=None):
+    """
+    Um tick para uma corrida: reivindica e atualiza até max_calls racers já vencidos.
+    Vários processos podem rodar ao mesmo tempo: cada um reivindica racers diferentes.
+    """
+    for _ in range(max_calls):
+        record = claim_next_record(race_id)
+        if record is None:
+            print(f"[race_id={race_id}] Nenhum registro livre nas tabelas auxiliares.")
+            return
+        table, interval, racer_id, last_update, claimed = record
+        if not claimed:
+            print(f"[race_id={race_id}] Registro {racer_id} ({table}) ainda não atingiu intervalo mínimo.")
+            return
+        update_racer_once(racer_id, table, race_id, buffer, spool, hashes)
 
 if __name__ == "__main__":
-    record = get_next_record()
-    if record:
-        table, interval, racer_id, last_update = record
-        if should_update(last_update, interval):
-            update_racer_once(racer_id, table)
-        else:
-            print(f"Registro {racer_id} ({table}) ainda não atingiu intervalo mínimo.")
-    else:
-        print("Nenhum registro encontrado nas tabelas auxiliares.")
+    parser = argparse.ArgumentParser(description="Tick do scheduler: 1 atualização por corrida ativa.")
+    parser.add_argument("--race-id", type=int, help="Processa só esta corrida (partição de worker por corrida).")
+    parser.add_argument("--max-calls", type=int, default=1, help="Máximo de racers atualizados por corrida neste tick.")
+    parser.add_argument("--durability", choices=DURABILITY_MODES, default=WRITE_DURABILITY,
+                        help="sync = commit por racer; batch = agrupa as gravações do tick (flush por tamanho/tempo e no fim).")
+    parser.add_argument("--spool", action=argparse.BooleanOptionalAction, default=SPOOL_ENABLED,
+                        help="Grava os payloads no spool local em vez do MySQL (aplicados por payload_spool.py drain).")
+    parser.add_argument("--skip-unchanged", action=argparse.BooleanOptionalAction, default=PAYLOAD_HASH_ENABLED,
+                        help="Não grava payload igual ao último gravado do racer (hash do conteúdo).")
+    args = parser.parse_args()
+
+    # Sem --race-id, o orçamento de chamadas é dividido igualmente: 1 chamada por corrida ativa por tick,
+    # cada uma usando as chaves da própria corrida.
+    race_ids = [args.race_id] if args.race_id else get_active_race_ids()
+    if not race_ids:
+        print("Nenhuma corrida ativa em app_config.")
+    failed = 0
+    conn_db = get_mysql_conn()
+    buffer = WriteBehindBuffer(conn_db, durability=args.durability)
+    spool = PayloadSpool(SPOOL_PATH) if args.spool else None
+    hashes = PayloadHashStore(PAYLOAD_HASH_PATH) if args.skip_unchanged else None
+    try:
+        for race_id in race_ids:
+            try:
+                with profile_block("scheduler", f"race{race_id}"):
+                    run_tick(race_id, max(1, args.max_calls), buffer, spool, hashes)
+            except Exception as e:
+                failed += 1
+                print(f"[race_id={race_id}] Erro no tick: {e}")
+        buffer.close()
+        if buffer.flushes:
+            print(f"Gravação: {buffer.flushes} commit(s), {buffer.rows_flushed} linhas, {buffer.laps_written} voltas novas")
+        if hashes is not None and (hashes.hits or hashes.misses):
+            log_event(log, "payload_hash", hits=hashes.hits, misses=hashes.misses, hit_rate=round(hashes.hit_rate(), 4))
+            print(f"Payloads sem mudança: {hashes.hits}/{hashes.hits + hashes.misses} ({hashes.hit_rate():.0%}) gravações puladas")
+    finally:
+        conn_db.close()
+        if spool is not None:
+            spool.close()
+        if hashes is not None:
+            hashes.close()
+    if failed:
+        raise SystemExit(1)
@@ -2,20 +2,18 @@
 import http.client
 import json
 import logging
-import os
+import time
 from datetime import datetime
 import mysql.connector
 from db_config import get_mysql_conn
+from event_log import get_event_logger, log_event
+from api_health import (KEY_AVAILABLE_SQL, API_MAX_ATTEMPTS, OK, AUTH, RETRYABLE,
+                        classify, record_result, retry_after_seconds, sleep_backoff)
+from write_behind import WriteBehindBuffer
+from standings import feed_laps
 
 # ====================== LOG ======================
-os.makedirs("/home/ubuntu/mykartapp", exist_ok=True)
-logging.basicConfig(
-    filename='/home/ubuntu/mykartapp/race_monitor.log',
-    filemode='a',
-    level=logging.INFO,
-    format='%(asctime)s %(message)s',
-    datefmt='%H:%M:%S'
-)
+log = get_event_logger("race_monitor", "race_monitor.log")
 
 def safe_int(value, default=0):
     try:
@@ -31,19 +29,22 @@ def format_racer_id(racer_id):
         return "000"  # fallback seguro
 
 # ====================== NOVAS FUNÇÕES ======================
-def get_least_used_api_key():
+def get_least_used_api_key(race_id=None):
     """
-    Busca a chave de API menos utilizada na tabela app_config.
+    Busca a chave de API menos utilizada na tabela app_config (opcionalmente só as da corrida).
+    Chaves com circuit breaker aberto ficam fora do rodízio (ver api_health).
     Assume colunas: id, api_token, race_id, last_used (DATETIME).
     """
     conn_db = get_mysql_conn()
     cur = conn_db.cursor(dictionary=True)
-    cur.execute("""
+    cur.execute(f"""
         SELECT id, api_token, race_id, COALESCE(last_used, '1970-01-01 00:00:00') AS last_used
         FROM app_config
+        WHERE (%s IS NULL OR race_id = %s)
+          AND {KEY_AVAILABLE_SQL}
         ORDER BY last_used ASC
         LIMIT 1
-    """)
+    """, (race_id, race_id))
     row = cur.fetchone()
     cur.close()
     conn_db.close()
@@ -58,79 +59,96 @@ def update_api_key_usage(api_id):
     cur.close()
     conn_db.close()
 
-# ====================== FUNÇÃO AJUSTADA ======================
-def fetch_racer(racer_id):
-    """Faz chamada à API Race Monitor (GetRacer) usando a chave menos utilizada."""
-    api_info = get_least_used_api_key()
-    if not api_info:
-        raise Exception("Nenhuma chave de API encontrada na tabela app_config.")
-
-    api_token = api_info["api_token"]
-    race_id = api_info["race_id"]
-    api_id = api_info["id"]
-
-    # Atualiza last_used para esta chave
-    update_api_key_usage(api_id)
-
-    # Ajusta racer_id para 3 dígitos
-    racer_id = format_racer_id(racer_id)
+def record_key_result(api_id, kind, status=None, detail=None, retry_after=None):
+    """Registra o resultado da chamada no breaker da chave; nunca derruba o fetch."""
+    conn_db = get_mysql_conn()
+    try:
+        opened = record_result(conn_db, api_id, kind, status, detail, retry_after)
+        if opened:
+            log_event(log, "key_breaker_open", logging.WARNING, api_id=api_id, failure=kind,
+                      status=status, open_s=round(opened, 1))
+            print(f"⚠️ Chave {api_id} fora do rodízio por {opened:.0f}s ({kind})")
+    except Exception as e:
+        log_event(log, "key_health_failed", logging.WARNING, api_id=api_id, error=repr(e))
+    finally:
+        conn_db.close()
 
-    conn = http.client.HTTPSConnection("api.race-monitor.com")
+# ====================== FUNÇÃO AJUSTADA ======================
+def _call_get_racer(api_token, race_id, racer_id):
+    """Uma chamada GetRacer. Retorna (status, headers, payload|None, erro|None)."""
+    conn = http.client.HTTPSConnection("api.race-monitor.com", timeout=30)
     endpoint = f"/v2/Live/GetRacer?apiToken={api_token}&raceID={race_id}&racerID={racer_id}"
     headers = {"Content-Type": "application/json"}
-    conn.request("POST", endpoint, '', headers)
-    res = conn.getresponse()
-    raw_data = res.read().decode("utf-8")
-    conn.close()
-
-    # ✅ Log da API utilizada
-    logging.info(f"API usada → ID:{api_id}, Token:{api_token[:6]}..., RaceID:{race_id}")
-    print(f"API usada → ID:{api_id}, Token:{api_token[:6]}..., RaceID:{race_id}")
+    try:
+        conn.request("POST", endpoint, '', headers)
+        res = conn.getresponse()
+        raw_data = res.read()
+        status, res_headers = res.status, res.headers
+    except Exception as e:
+        return None, None, None, e
+    finally:
+        conn.close()
+    try:
+        return status, res_headers, json.loads(raw_data), None
+    except ValueError:
+        return status, res_headers, None, None
 
-    return json.loads(raw_data)
+def fetch_racer(racer_id, race_id=None):
+    """
+    Faz chamada à API Race Monitor (GetRacer) usando a chave menos utilizada (da corrida, se informada).
+    Falhas são classificadas (api_health.classify): as da chave alimentam o circuit breaker dela e,
+    se forem transitórias, a chamada é repetida com outra chave após backoff exponencial com jitter.
+    """
+    racer_id = format_racer_id(racer_id)  # Ajusta racer_id para 3 dígitos
+    last = None
+    for attempt in range(API_MAX_ATTEMPTS):
+        api_info = get_least_used_api_key(race_id)
+        if not api_info:
+            if last is not None:
+                break  # todas as chaves da corrida com breaker aberto
+            raise Exception(f"Nenhuma chave de API disponível na tabela app_config (race_id={race_id}).")
+
+        api_token = api_info["api_token"]
+        key_race_id = api_info["race_id"]
+        api_id = api_info["id"]
+
+        # Atualiza last_used para esta chave
+        update_api_key_usage(api_id)
+
+        start = time.perf_counter()
+        status, headers, payload, error = _call_get_racer(api_token, key_race_id, racer_id)
+        kind = classify(status, error, payload)
+
+        # ✅ Log da API utilizada
+        log_event(log, "api_call", api_id=api_id, race_id=key_race_id, racer_id=racer_id,
+                  status=status, failure=None if kind == OK else kind, attempt=attempt + 1,
+                  elapsed_ms=(time.perf_counter() - start) * 1000.0)
+        print(f"API usada → ID:{api_id}, Token:{api_token[:6]}..., RaceID:{key_race_id}" + ("" if kind == OK else f" ({kind})"))
+
+        detail = repr(error) if error else (payload or {}).get("Message") if isinstance(payload, dict) else None
+        record_key_result(api_id, kind, status, detail, retry_after_seconds(headers))
+
+        if kind == AUTH:
+            last = (kind, status, None)
+            continue  # chave rejeitada: tenta outra da corrida, sem espera
+        if kind not in RETRYABLE:
+            return payload
+        last = (kind, status, error)
+        if attempt + 1 < API_MAX_ATTEMPTS:
+            sleep_backoff(attempt)
+
+    kind, status, error = last
+    if error is not None:
+        raise error
+    return {"Successful": False, "Message": f"API indisponível após {API_MAX_ATTEMPTS} tentativa(s): {kind} (status {status})."}
 
 # ====================== RESTANTE DO CÓDIGO (update_database) ======================
-def update_database(comp, laps):
-    """Atualiza dados do competidor e voltas no banco MySQL."""
-    cfg = get_least_used_api_key()  # Pode usar race_id daqui se necessário
-    race_id = cfg["race_id"]
-
-    conn_db = get_mysql_conn()
-    cur = conn_db.cursor()
-
+def racer_rows(comp, laps, race_id):
+    """
+    Converte Competitor/Laps do GetRacer nas linhas de gravação:
+    (values na ordem de COMPETITOR_COLUMNS, [linhas de INSERT_LAPS_SQL]).
+    """
     racer_id = safe_int(comp.get("RacerID"))
-    number = comp.get("Number") or ""
-    transponder = comp.get("Transponder") or ""
-    first_name = comp.get("FirstName") or ""
-    last_name = comp.get("LastName") or ""
-    nationality = comp.get("Nationality") or ""
-    additional_data = comp.get("AdditionalData") or ""
-    class_id = safe_int(comp.get("ClassID"))
-    position = safe_int(comp.get("Position"))
-    laps_completed = safe_int(comp.get("Laps"))
-    total_time = comp.get("TotalTime") or "00:00.000"
-    best_position = safe_int(comp.get("BestPosition"))
-    best_lap = safe_int(comp.get("BestLap"))
-    best_lap_time = comp.get("BestLapTime") or "00:00.000"
-    last_lap_time = comp.get("LastLapTime") or "00:00.000"
-
-    cur.execute("""
-        INSERT INTO competitors (
-            racer_id, race_id, number, transponder, first_name, last_name,
-            nationality, additional_data, class_id, position, laps_completed,
-            total_time, best_position, best_lap, best_lap_time, last_lap_time, updated_at
-        ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s, NOW())
-        ON DUPLICATE KEY UPDATE
-            position=VALUES(position), laps_completed=VALUES(laps_completed),
-            total_time=VALUES(total_time), best_position=VALUES(best_position),
-            best_lap=VALUES(best_lap), best_lap_time=VALUES(best_lap_time),
-            last_lap_time=VALUES(last_lap_time), updated_at=NOW()
-    """, (
-        racer_id, race_id, number, transponder, first_name, last_name,
-        nationality, additional_data, class_id, position, laps_completed,
-        total_time, best_position, best_lap, best_lap_time, last_lap_time
-    ))
-
     laps_data = []
     for lap in laps:
         lap_number = safe_int(lap.get("Lap"))
@@ -140,16 +158,58 @@ def update_database(comp, laps):
         total_time_lap = lap.get("TotalTime") or "00:00.000"
         laps_data.append((race_id, racer_id, lap_number, lap_position, lap_time, flag_status, total_time_lap))
 
-    if laps_data:
-        cur.executemany("""
-            INSERT IGNORE INTO competitor_laps
-            (race_id, racer_id, lap_number, position, lap_time, flag_status, total_time)
-            VALUES (%s,%s,%s,%s,%s,%s,%s)
-        """, laps_data)
-
-    conn_db.commit()
-    cur.close()
-    conn_db.close()
+    values = (
+        racer_id, race_id,
+        comp.get("Number") or "",
+        comp.get("Transponder") or "",
+        comp.get("FirstName") or "",
+        comp.get("LastName") or "",
+        comp.get("Nationality") or "",
+        comp.get("AdditionalData") or "",
+        safe_int(comp.get("ClassID")),
+        safe_int(comp.get("Position")),
+        safe_int(comp.get("Laps")),
+        comp.get("TotalTime") or "00:00.000",
+        safe_int(comp.get("BestPosition")),
+        safe_int(comp.get("BestLap")),
+        comp.get("BestLapTime") or "00:00.000",
+        comp.get("LastLapTime") or "00:00.000",
+    )
+    return values, laps_data
+
+def feed_standings(race_id, racer_id, laps):
+    """Classificação ao vivo (gaps/intervalos): falha aqui não invalida a gravação no MySQL."""
+    try:
+        feed_laps(race_id, racer_id, laps)
+    except Exception as e:
+        log_event(log, "standings_feed_failed", logging.WARNING, racer_id=racer_id, race_id=race_id, error=repr(e))
 
-    logging.info(f"OK → {racer_id} {first_name} {last_name} Pos {position} {len(laps)} voltas")
+def update_database(comp, laps, race_id=None, buffer=None):
+    """
+    Atualiza dados do competidor e voltas no banco MySQL. Retorna o race_id usado.
+    race_id deve ser o mesmo usado no fetch_racer; sem ele, cai no race_id da chave menos usada (legado).
+    Com buffer (WriteBehindBuffer), as linhas entram no buffer e são gravadas no próximo flush
+    junto com as de outros racers; sem buffer, grava e faz commit na hora.
+    """
+    start = time.perf_counter()
+    if race_id is None:
+        race_id = get_least_used_api_key()["race_id"]
+
+    values, laps_data = racer_rows(comp, laps, race_id)
+    racer_id, first_name, last_name, position = values[0], values[4], values[5], values[9]
+    if buffer is None:
+        conn_db = get_mysql_conn()
+        try:
+            laps_written = WriteBehindBuffer(conn_db, durability="sync").add_competitor(values, laps_data)
+        finally:
+            conn_db.close()
+    else:
+        laps_written = buffer.add_competitor(values, laps_data)  # None = ainda no buffer
+
+    feed_standings(race_id, racer_id, laps)
+
+    log_event(log, "racer_synced", racer_id=racer_id, race_id=race_id, position=position,
+              laps_received=len(laps), laps_written=laps_written,
+              elapsed_ms=(time.perf_counter() - start) * 1000.0)
     print(f"OK → {racer_id} {first_name} {last_name} sincronizado às {datetime.now().strftime('%H:%M:%S')}")
+    return race_id
@@ -2,33 +2,33 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import sys
 import time
 import http.client
-import json
 import logging
-import os
 from datetime import datetime
 import mysql.connector
 from tqdm import tqdm  # barra de progresso
 
 from db_config import get_mysql_conn
+from event_log import get_event_logger, log_event
+from json_stream import loads, stream_array, BACKEND as JSON_BACKEND, HAVE_STREAMING, JSONDecodeError
+from write_behind import WriteBehindBuffer, WRITE_DURABILITY, DURABILITY_MODES
+from bulk_load import BulkLoader
+from profiling import profile_block
+from api_health import (KEY_AVAILABLE_SQL, API_MAX_ATTEMPTS, OK, AUTH, TRANSPORT, BAD_PAYLOAD, RETRYABLE,
+                        classify, record_result, retry_after_seconds, sleep_backoff)
+from standings import feed_laps
 
 # ====================== CONFIG / LOG ======================
-LOG_DIR = "/home/ubuntu/mykartapp"
-os.makedirs(LOG_DIR, exist_ok=True)
-logging.basicConfig(
-    filename=os.path.join(LOG_DIR, "results_ingest.log"),
-    filemode="a",
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    datefmt="%H:%M:%S",
-)
+log = get_event_logger("results_ingest", "results_ingest.log")
 
 TABLE_COMPETITORS = "competitors"
 TABLE_LAPS_NAME = "competitor_laps"  # ajuste se necessário
 API_HOST = "api.race-monitor.com"
 MAX_CALLS_PER_MINUTE = 10  # <<<<<<<<<<<<<< AJUSTE: agora 10/min
+LAP_BATCH_ROWS = 500  # modo streaming: voltas gravadas por lote enquanto o corpo ainda está chegando
 
 # ====================== HELPERS ======================
 def safe_int(value, default=0):
@@ -44,10 +44,11 @@ def mask_token(token: str, head=6):
 def get_least_used_api_key():
     conn = get_mysql_conn()
     cur = conn.cursor(dictionary=True)
-    cur.execute("""
+    cur.execute(f"""
         SELECT id, api_token, COALESCE(last_used, '1970-01-01 00:00:00') AS last_used
         FROM app_config
         WHERE api_token IS NOT NULL AND api_token <> ''
+          AND {KEY_AVAILABLE_SQL}
         ORDER BY last_used ASC
         LIMIT 1
     """)
@@ -76,117 +77,209 @@ def enforce_rate_limit():
     if len(call_timestamps) >= MAX_CALLS_PER_MINUTE:
         sleep_time = 60.0 - (now - call_timestamps[0])
         if sleep_time > 0:
-            logging.info(f"[RATE LIMIT] Aguardando {sleep_time:.1f}s para não exceder {MAX_CALLS_PER_MINUTE} chamadas/min")
+            log_event(log, "rate_limit_wait", wait_ms=round(sleep_time * 1000.0, 1),
+                      max_calls_per_minute=MAX_CALLS_PER_MINUTE)
             time.sleep(sleep_time)
         # após dormir, lista é podada novamente na próxima chamada
 
 # ====================== API CALL ======================
-def api_call_with_rotation(path: str) -> dict:
+class KeyUnavailable(RuntimeError):
+    """Todas as chaves estão com circuit breaker aberto."""
+
+def _open_api(path: str):
+    """
+    Aplica rate limit, escolhe/marca a chave e abre a requisição. Retorna (conn, resp, ctx).
+    `path` traz '{token}' no lugar do apiToken: o token usado é sempre o da chave escolhida aqui.
+    """
     # Aplica rate limit antes de escolher a chave (regras claras e uniformes)
     enforce_rate_limit()
 
     api_info = get_least_used_api_key()
     if not api_info:
-        raise RuntimeError("Nenhuma API key disponível em app_config.")
+        raise KeyUnavailable("Nenhuma API key disponível em app_config (todas com breaker aberto?).")
 
-    api_id = api_info["id"]
-    token_mask = mask_token(api_info["api_token"])
+    ctx = {"api_id": api_info["id"], "token": mask_token(api_info["api_token"]),
+           "endpoint": path.split("?", 1)[0], "start": time.time()}
 
     # Atualiza last_used antes da chamada para mitigar corrida entre processos
-    update_api_key_usage(api_id)
+    update_api_key_usage(ctx["api_id"])
 
-    start = time.time()
     conn = http.client.HTTPSConnection(API_HOST, timeout=30)
     headers = {"Content-Type": "application/json"}
-
     try:
-        conn.request("POST", path, body="", headers=headers)
+        conn.request("POST", path.format(token=api_info["api_token"]), body="", headers=headers)
         resp = conn.getresponse()
-        raw = resp.read().decode("utf-8", errors="replace")
-        status = resp.status
     except Exception as e:
-        elapsed = (time.time() - start) * 1000.0
-        logging.error(
-            f"[API CALL FAIL] app_config.id={api_id} token={token_mask} path={path} "
-            f"error={repr(e)} elapsed_ms={elapsed:.1f}"
-        )
-        raise
-    finally:
         conn.close()
+        _log_api_failed(ctx, e)
+        raise
+    return conn, resp, ctx
 
-    elapsed = (time.time() - start) * 1000.0
-    logging.info(
-        f"[API CALL] app_config.id={api_id} token={token_mask} path={path} "
-        f"status={status} elapsed_ms={elapsed:.1f}"
-    )
+def _log_api_failed(ctx, error):
+    log_event(log, "api_call_failed", logging.ERROR, api_id=ctx["api_id"], token=ctx["token"],
+              endpoint=ctx["endpoint"], error=repr(error), elapsed_ms=(time.time() - ctx["start"]) * 1000.0)
 
+def _log_api_call(ctx, status, nbytes, **fields):
+    log_event(log, "api_call", api_id=ctx["api_id"], token=ctx["token"], endpoint=ctx["endpoint"],
+              status=status, bytes=nbytes, elapsed_ms=(time.time() - ctx["start"]) * 1000.0,
+              json_backend=JSON_BACKEND, **fields)
     # registra a chamada para controle da janela
     call_timestamps.append(time.time())
 
+def _record_key(ctx, kind, status=None, detail=None, retry_after=None):
+    """Alimenta o circuit breaker da chave usada (api_health)."""
+    conn = get_mysql_conn()
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError as e:
-        logging.error(
-            f"[API JSON ERROR] path={path} status={status} error={repr(e)} payload_head={raw[:300]!r}"
-        )
-        raise RuntimeError(f"Falha ao decodificar JSON para {path}: {e}")
+        opened = record_result(conn, ctx["api_id"], kind, status, detail, retry_after)
+    except Exception as e:
+        log_event(log, "key_health_failed", logging.WARNING, api_id=ctx["api_id"], error=repr(e))
+        return
+    finally:
+        conn.close()
+    if opened:
+        log_event(log, "key_breaker_open", logging.WARNING, api_id=ctx["api_id"], token=ctx["token"],
+                  failure=kind, status=status, open_s=round(opened, 1))
+
+def _with_retries(path: str, attempt_call):
+    """
+    Executa attempt_call(conn, resp, ctx) → (kind, resultado) com rodízio de chave:
+    falhas transitórias repetem após backoff exponencial com jitter; chave rejeitada (auth) troca na hora.
+    """
+    last_error = None
+    for attempt in range(API_MAX_ATTEMPTS):
+        try:
+            conn, resp, ctx = _open_api(path)
+        except KeyUnavailable:
+            raise
+        except Exception as e:
+            # falha de transporte ao abrir a requisição (ctx ainda não existe para o breaker)
+            last_error = e
+            if attempt + 1 < API_MAX_ATTEMPTS:
+                sleep_backoff(attempt)
+            continue
+        kind, result, detail = attempt_call(conn, resp, ctx)
+        _record_key(ctx, kind, getattr(resp, "status", None), detail, retry_after_seconds(resp.headers))
+        if kind == AUTH:
+            last_error = RuntimeError(f"Chave {ctx['api_id']} rejeitada pela API ({resp.status}).")
+            continue
+        if kind not in RETRYABLE:
+            return result
+        last_error = RuntimeError(f"Falha {kind} em {ctx['endpoint']} (status {resp.status}): {detail}")
+        if attempt + 1 < API_MAX_ATTEMPTS:
+            log_event(log, "api_retry", logging.WARNING, api_id=ctx["api_id"], endpoint=ctx["endpoint"],
+                      failure=kind, status=resp.status, attempt=attempt + 1)
+            sleep_backoff(attempt)
+    raise last_error or RuntimeError(f"Falha na chamada {path.split('?', 1)[0]}")
+
+def api_call_with_rotation(path: str) -> dict:
+    def attempt(conn, resp, ctx):
+        try:
+            raw = resp.read()  # bytes: o backend decodifica direto, sem cópia em str
+        except Exception as e:
+            _log_api_failed(ctx, e)
+            return TRANSPORT, None, repr(e)
+        finally:
+            conn.close()
+        _log_api_call(ctx, resp.status, len(raw))
+        try:
+            payload = loads(raw)
+        except JSONDecodeError as e:
+            log_event(log, "api_json_error", logging.ERROR, endpoint=ctx["endpoint"],
+                      status=resp.status, error=repr(e), payload_head=raw[:300].decode("utf-8", errors="replace"))
+            payload = None
+        kind = classify(resp.status, None, payload)
+        return kind, payload, (payload or {}).get("Message") if isinstance(payload, dict) else None
+
+    return _with_retries(path, attempt)
+
+class _CountingReader:
+    """Envolve a resposta HTTP contando os bytes lidos pelo parser incremental."""
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.bytes = 0
+
+    def read(self, size=-1):
+        chunk = self.resp.read(size)
+        self.bytes += len(chunk)
+        return chunk
+
+def api_stream_with_rotation(path: str, array_path: str):
+    """
+    Igual a api_call_with_rotation, mas decodifica o corpo enquanto ele chega:
+    gera os eventos de json_stream.stream_array (um elemento de `array_path` por vez).
+    Só o status HTTP é verificado (e repetido com outra chave) antes do streaming começar;
+    depois que elementos já foram entregues, uma falha não é repetida.
+    """
+    def attempt(conn, resp, ctx):
+        if resp.status == 200:
+            return OK, (conn, resp, ctx), None
+        try:
+            body = resp.read()
+        except Exception:
+            body = b""
+        finally:
+            conn.close()
+        try:
+            payload = loads(body) if body else None
+        except JSONDecodeError:
+            payload = None
+        return classify(resp.status, None, payload), None, body[:200].decode("utf-8", errors="replace")
+
+    conn, resp, ctx = _with_retries(path, attempt)
+    reader = _CountingReader(resp)
+    try:
+        yield from stream_array(reader, array_path)
+    except JSONDecodeError as e:
+        log_event(log, "api_json_error", logging.ERROR, endpoint=ctx["endpoint"],
+                  status=resp.status, error=repr(e), streaming=True)
+        _record_key(ctx, BAD_PAYLOAD, resp.status, repr(e))
+        raise RuntimeError(f"Falha ao decodificar JSON para {ctx['endpoint']}: {e}")
+    except Exception as e:
+        _log_api_failed(ctx, e)
+        _record_key(ctx, TRANSPORT, resp.status, repr(e))
+        raise
+    finally:
+        conn.close()
+    _log_api_call(ctx, resp.status, reader.bytes, streaming=True)
 
 # ====================== WRAPPERS ======================
 def fetch_session_details(session_id: int) -> dict:
-    api_info = get_least_used_api_key()
-    token = api_info["api_token"]
-    path = f"/v2/Results/SessionDetails?apiToken={token}&sessionID={session_id}"
-    return api_call_with_rotation(path)
+    return api_call_with_rotation(f"/v2/Results/SessionDetails?apiToken={{token}}&sessionID={session_id}")
 
 def fetch_competitor_details(competitor_id: int) -> dict:
-    api_info = get_least_used_api_key()
-    token = api_info["api_token"]
-    path = f"/v2/Results/CompetitorDetails?apiToken={token}&competitorID={competitor_id}"
-    return api_call_with_rotation(path)
+    return api_call_with_rotation(f"/v2/Results/CompetitorDetails?apiToken={{token}}&competitorID={competitor_id}")
+
+def stream_session_competitor_ids(session_id: int):
+    """SessionDetails em streaming: retorna (doc sem SortedCompetitors, [IDs]) sem montar a lista de competidores."""
+    path = f"/v2/Results/SessionDetails?apiToken={{token}}&sessionID={session_id}"
+    ids = []
+    doc = {}
+    for kind, value, doc in api_stream_with_rotation(path, "Session.SortedCompetitors"):
+        if kind == "item":
+            ids.append(safe_int((value or {}).get("ID")))
+    return doc or {}, ids
+
+def stream_competitor_details(competitor_id: int):
+    """CompetitorDetails em streaming: gera ('item', volta, doc_parcial) e por fim ('done', doc, doc)."""
+    path = f"/v2/Results/CompetitorDetails?apiToken={{token}}&competitorID={competitor_id}"
+    return api_stream_with_rotation(path, "Competitor.LapTimes")
 
 # ====================== DB OPS ======================
-def upsert_competitor(conn, comp: dict):
-    racer_id = safe_int(comp.get("ID"))
-    race_id = safe_int(comp.get("RaceID"))
-    number = comp.get("Number") or ""
-    transponder = comp.get("Transponder") or ""
-    first_name = comp.get("FirstName") or ""
-    last_name = comp.get("LastName") or ""
-    nationality = comp.get("Nationality") or ""
-    additional_data = comp.get("AdditionalData") or ""
-    class_id = safe_int(comp.get("Category"))
-    position = safe_int(comp.get("Position"))
-    laps_completed = safe_int(comp.get("Laps"))
-    total_time = comp.get("TotalTime") or "00:00.000"
-    best_position = safe_int(comp.get("BestPosition"))
-    best_lap = safe_int(comp.get("BestLap"))
-    best_lap_time = comp.get("BestLapTime") or "00:00.000"
-    last_lap_time = comp.get("LastLapTime") or "00:00.000"
-
-    sql = f"""
-        INSERT INTO {TABLE_COMPETITORS} (
-            racer_id, race_id, number, transponder, first_name, last_name,
-            nationality, additional_data, class_id, position, laps_completed,
-            total_time, best_position, best_lap, best_lap_time, last_lap_time, updated_at
-        ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s, NOW())
-        ON DUPLICATE KEY UPDATE
-            position=VALUES(position), laps_completed=VALUES(laps_completed),
-            total_time=VALUES(total_time), best_position=VALUES(best_position),
-            best_lap=VALUES(best_lap), best_lap_time=VALUES(best_lap_time),
-            last_lap_time=VALUES(last_lap_time), updated_at=NOW()
-    """
-    vals = (
-        racer_id, race_id, number, transponder, first_name, last_name,
-        nationality, additional_data, class_id, position, laps_completed,
-        total_time, best_position, best_lap, best_lap_time, last_lap_time
+def competitor_values(comp: dict) -> tuple:
+    """Linha de competitors (ordem de write_behind.COMPETITOR_COLUMNS) a partir do CompetitorDetails."""
+    return (
+        safe_int(comp.get("ID")), safe_int(comp.get("RaceID")),
+        comp.get("Number") or "", comp.get("Transponder") or "",
+        comp.get("FirstName") or "", comp.get("LastName") or "",
+        comp.get("Nationality") or "", comp.get("AdditionalData") or "",
+        safe_int(comp.get("Category")), safe_int(comp.get("Position")), safe_int(comp.get("Laps")),
+        comp.get("TotalTime") or "00:00.000", safe_int(comp.get("BestPosition")), safe_int(comp.get("BestLap")),
+        comp.get("BestLapTime") or "00:00.000", comp.get("LastLapTime") or "00:00.000",
     )
-    cur = conn.cursor()
-    cur.execute(sql, vals)
-    cur.close()
 
-def insert_laps(conn, race_id: int, racer_id: int, laps: list):
-    if not laps:
-        return
+def lap_rows(race_id: int, racer_id: int, laps: list) -> list:
+    """Linhas de competitor_laps (race_id, racer_id, lap_number, position, lap_time, flag_status, total_time)."""
     data = []
     for lap in laps:
         lap_number = safe_int(lap.get("Lap"))
@@ -195,66 +288,154 @@ def insert_laps(conn, race_id: int, racer_id: int, laps: list):
         flag_status = safe_int(lap.get("FlagStatus"))
         total_time_lap = lap.get("TotalTime") or "00:00.000"
         data.append((race_id, racer_id, lap_number, lap_position, lap_time, flag_status, total_time_lap))
+    return data
+
+# ====================== MAIN FLOW ======================
+def feed_standings(race_id: int, racer_id: int, laps: list):
+    """Alimenta a classificação ao vivo; falha aqui não invalida a gravação no MySQL."""
+    try:
+        feed_laps(race_id, racer_id, laps)
+    except Exception as e:
+        log_event(log, "standings_feed_failed", logging.WARNING, race_id=race_id, racer_id=racer_id, error=repr(e))
 
-    sql = f"""
-        INSERT IGNORE INTO {TABLE_LAPS_NAME}
-        (race_id, racer_id, lap_number, position, lap_time, flag_status, total_time)
-        VALUES (%s,%s,%s,%s,%s,%s,%s)
+def ingest_competitor_streaming(buffer, competitor_id: int):
     """
-    cur = conn.cursor()
-    cur.executemany(sql, data)
-    cur.close()
+    Consome CompetitorDetails em streaming: as voltas entram no buffer de escrita em lotes de
+    LAP_BATCH_ROWS enquanto o corpo ainda está sendo lido (o buffer grava por tamanho/tempo).
+    Retorna (race_id, racer_id, laps_received) ou None.
+    """
+    batch = []
+    crossings = []  # só (Lap, TotalTime) de cada volta, para a classificação ao vivo
+    received = 0
+    race_id = racer_id = 0
+    doc = {}
+    for kind, value, doc in stream_competitor_details(competitor_id):
+        if kind != "item":
+            continue
+        batch.append(value)
+        crossings.append({"Lap": value.get("Lap"), "TotalTime": value.get("TotalTime")})
+        received += 1
+        if len(batch) >= LAP_BATCH_ROWS:
+            comp = (doc or {}).get("Competitor") or {}
+            race_id, racer_id = safe_int(comp.get("RaceID")), safe_int(comp.get("ID"))
+            if race_id > 0 and racer_id > 0:  # IDs ainda não chegaram: mantém o lote em memória
+                buffer.add_laps(race_id, lap_rows(race_id, racer_id, batch))
+                batch = []
+
+    doc = doc or {}
+    if not doc.get("Successful"):
+        log_event(log, "competitor_details_failed", logging.WARNING,
+                  competitor_id=competitor_id, api_message=doc.get("Message"))
+        return None
+
+    comp = doc.get("Competitor") or {}
+    race_id, racer_id = safe_int(comp.get("RaceID")), safe_int(comp.get("ID"))
+    buffer.add_competitor(competitor_values(comp), lap_rows(race_id, racer_id, batch))
+    feed_standings(race_id, racer_id, crossings)
+    return race_id, racer_id, received
+
+def ingest_competitor(buffer, competitor_id: int):
+    """Grava o competidor a partir do CompetitorDetails completo. Retorna como ingest_competitor_streaming."""
+    details_json = fetch_competitor_details(competitor_id)
+    if not details_json.get("Successful"):
+        log_event(log, "competitor_details_failed", logging.WARNING,
+                  competitor_id=competitor_id, api_message=details_json.get("Message"))
+        return None
+
+    comp = details_json.get("Competitor") or {}
+    race_id = safe_int(comp.get("RaceID"))
+    racer_id = safe_int(comp.get("ID"))
+    laps = comp.get("LapTimes") or []
+    buffer.add_competitor(competitor_values(comp), lap_rows(race_id, racer_id, laps))
+    feed_standings(race_id, racer_id, laps)
+    return race_id, racer_id, len(laps)
 
-# ====================== MAIN FLOW ======================
-def process_session(session_id: int):
-    logging.info(f"Iniciando ingestão da sessão {session_id}")
-    session_json = fetch_session_details(session_id)
+def process_session(session_id: int, streaming: bool = False, durability: str = WRITE_DURABILITY, buffer=None):
+    """
+    Ingere uma sessão. Sem buffer, abre conexão própria e um WriteBehindBuffer (durability);
+    com buffer (ex.: BulkLoader compartilhado por várias sessões), só acumula nele.
+    """
+    session_start = time.perf_counter()
+    log_event(log, "session_start", session_id=session_id, streaming=streaming, json_backend=JSON_BACKEND)
+    if streaming:
+        session_json, competitor_ids = stream_session_competitor_ids(session_id)
+    else:
+        session_json = fetch_session_details(session_id)
+        session = session_json.get("Session") or {}
+        competitor_ids = [safe_int(sc.get("ID")) for sc in session.get("SortedCompetitors") or []]
     if not session_json.get("Successful"):
         raise RuntimeError(f"SessionDetails falhou: {session_json}")
 
-    session = session_json.get("Session") or {}
-    sorted_competitors = session.get("SortedCompetitors") or []
-    total = len(sorted_competitors)
-    logging.info(f"Session {session_id}: {total} competidores")
+    total = len(competitor_ids)
+    log_event(log, "session_competitors", session_id=session_id, competitors=total)
+    ingest = ingest_competitor_streaming if streaming else ingest_competitor
 
-    conn = get_mysql_conn()
+    own = buffer is None
+    conn = get_mysql_conn() if own else None
     try:
+        # Competidores e voltas de vários fetches vão para o mesmo buffer: um commit por flush, não por competidor
+        if own:
+            buffer = WriteBehindBuffer(conn, durability=durability)
         with tqdm(total=total, desc="Processando competidores", unit="comp") as pbar:
-            for sc in sorted_competitors:
-                competitor_id = safe_int(sc.get("ID"))
+            for competitor_id in competitor_ids:
                 if competitor_id <= 0:
                     pbar.update(1)
                     continue
 
-                details_json = fetch_competitor_details(competitor_id)
-                if not details_json.get("Successful"):
-                    logging.warning(f"CompetitorDetails falhou para ID={competitor_id}: {details_json}")
-                    pbar.update(1)
-                    continue
-
-                comp = details_json.get("Competitor") or {}
-                upsert_competitor(conn, comp)
+                result = ingest(buffer, competitor_id)
+                if result:
+                    race_id, racer_id, laps_received = result
+                    log_event(log, "racer_synced", session_id=session_id, race_id=race_id, racer_id=racer_id,
+                              laps_received=laps_received)
+                pbar.update(1)
+        if own:
+            buffer.close()
+    except Exception:
+        if own:
+            conn.rollback()
+        raise
+    finally:
+        if own:
+            conn.close()
 
-                race_id = safe_int(comp.get("RaceID"))
-                racer_id = safe_int(comp.get("ID"))
-                laps = comp.get("LapTimes") or []
-                insert_laps(conn, race_id, racer_id, laps)
+    log_event(log, "session_done", session_id=session_id, competitors=total,
+              laps_written=buffer.laps_written, flushes=buffer.flushes,
+              durability=durability if own else type(buffer).__name__,
+              elapsed_ms=(time.perf_counter() - session_start) * 1000.0)
 
-                conn.commit()
-                logging.info(f"OK → racer_id={racer_id}, laps={len(laps)}")
-                pbar.update(1)
+def backfill_sessions(session_ids, streaming=False):
+    """Modo bulk: todas as sessões acumulam no mesmo BulkLoader (CSV + LOAD DATA + merge set-based)."""
+    conn = get_mysql_conn(allow_local_infile=True)
+    try:
+        with BulkLoader(conn) as loader:
+            for session_id in session_ids:
+                process_session(session_id, streaming=streaming, buffer=loader)
+        return loader
     finally:
         conn.close()
 
-    logging.info(f"Finalizado sessão {session_id}")
-
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Uso: python3 results_ingest.py <SESSION_ID>")
-        sys.exit(1)
-    session_id = safe_int(sys.argv[1])
-    if session_id <= 0:
+    parser = argparse.ArgumentParser(description="Ingestão de resultados de sessões (SessionDetails + CompetitorDetails).")
+    parser.add_argument("session_ids", type=int, nargs="+", metavar="SESSION_ID", help="SESSION_ID(s) da Race Monitor.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Decodifica as respostas em streaming e grava as voltas em lotes (requer ijson para memória constante).")
+    parser.add_argument("--durability", choices=DURABILITY_MODES, default=WRITE_DURABILITY,
+                        help="sync = commit por competidor; batch = upserts multi-linha com commit por tamanho/tempo.")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Backfill histórico: CSV temporário + LOAD DATA LOCAL INFILE + merge set-based (requer local_infile=ON).")
+    args = parser.parse_args()
+    session_ids = [safe_int(s) for s in args.session_ids]
+    if any(s <= 0 for s in session_ids):
         print("SESSION_ID inválido.")
         sys.exit(1)
-    process_session(session_id)
-    print(f"✅ Ingestão concluída para session_id={session_id} às {datetime.now().strftime('%H:%M:%S')}")
+    if args.stream and not HAVE_STREAMING:
+        print("⚠️ ijson não instalado: --stream vai decodificar cada resposta inteira (mesmo resultado, sem ganho de memória).")
+    if args.bulk:
+        with profile_block("ingest", "bulk"):
+            loader = backfill_sessions(session_ids, streaming=args.stream)
+        print(f"✅ Backfill concluído: {len(session_ids)} sessão(ões), {loader.laps_written} voltas novas em {loader.flushes} carga(s) às {datetime.now().strftime('%H:%M:%S')}")
+    else:
+        for session_id in session_ids:
+            with profile_block("ingest", f"session{session_id}"):
+                process_session(session_id, streaming=args.stream, durability=args.durability)
+            print(f"✅ Ingestão concluída para session_id={session_id} às {datetime.now().strftime('%H:%M:%S')}")
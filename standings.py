@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import fcntl
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from lap_stats import parse_ms
+
+# ====================== CONFIG ======================
+# Estado por corrida: o worker (processo do cron) atualiza e o webapp só lê a classificação pronta
+STANDINGS_DIR = os.environ.get("MYKART_STANDINGS_DIR", "/home/ubuntu/mykartapp/standings")
+GAP_TREND_LAPS = 5  # voltas usadas na tendência do gap para o líder
+STANDINGS_BUSY_MS = 10_000
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS crossing (
+        racer_id INTEGER NOT NULL,
+        lap_number INTEGER NOT NULL,
+        total_ms INTEGER NOT NULL,
+        PRIMARY KEY (racer_id, lap_number)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS crossing_lap ON crossing (lap_number, total_ms, racer_id);
+    CREATE TABLE IF NOT EXISTS kart (
+        racer_id INTEGER PRIMARY KEY,
+        laps INTEGER NOT NULL,
+        total_ms INTEGER NOT NULL,
+        gap_ms INTEGER,
+        interval_ms INTEGER,
+        gap_trend_ms_per_lap REAL
+    );
+    CREATE INDEX IF NOT EXISTS kart_lap ON kart (laps, total_ms, racer_id);
+"""
+
+# ====================== ENGINE ======================
+class StandingsEngine:
+    """
+    Classificação ao vivo de uma corrida, atualizada volta a volta.
+
+    O estado fica num SQLite por corrida (WAL, compartilhado entre os processos do cron):
+      - crossing: log só de inserção das passagens (racer_id, volta, tempo acumulado), indexado por volta
+      - kart:     última passagem com tempo de cada kart, com gap/intervalo/tendência já calculados
+    Gap e intervalo saem do índice por volta:
+      - gap para o líder  = meu tempo na volta L - primeira passagem na volta L
+      - intervalo         = meu tempo na volta L - passagem imediatamente anterior na volta L
+    Ao chegar uma volta entra uma linha em crossing e só as linhas de kart que dependem dela são
+    recalculadas: a do próprio kart e a do kart que passou logo atrás na mesma volta; se a passagem é a
+    nova primeira da volta, todos os karts parados nessa volta (gap) ou GAP_TREND_LAPS à frente (tendência).
+    Normalmente são uma ou duas linhas, independente do grid e da duração da corrida.
+    standings() é um SELECT ordenado da tabela kart (O(grid), sem buscas por kart).
+    Voltas repetidas (reenvio da API) são ignoradas.
+    """
+
+    def __init__(self, race_id, path=":memory:"):
+        self.race_id = race_id
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=STANDINGS_BUSY_MS / 1000.0, isolation_level=None)
+        if path != ":memory:":
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")  # perda das últimas voltas num crash: 'rebuild' recupera
+        self.db.execute(f"PRAGMA busy_timeout={STANDINGS_BUSY_MS}")
+        self.db.executescript(SCHEMA_SQL)
+
+    @contextmanager
+    def transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def last_lap(self, racer_id):
+        row = self.db.execute("SELECT laps FROM kart WHERE racer_id = ?", (racer_id,)).fetchone()
+        return row[0] if row else 0
+
+    def add_lap(self, racer_id, lap_number, total_ms):
+        """Registra a passagem do kart na volta. Retorna False se ignorada (inválida ou repetida)."""
+        if lap_number is None or lap_number <= 0 or total_ms is None:
+            return False
+        leader = self._leader_at(lap_number)
+        cur = self.db.execute("INSERT OR IGNORE INTO crossing (racer_id, lap_number, total_ms) VALUES (?, ?, ?)",
+                              (racer_id, lap_number, total_ms))
+        if not cur.rowcount:
+            return False
+        self.db.execute("""
+            INSERT INTO kart (racer_id, laps, total_ms) VALUES (?, ?, ?)
+            ON CONFLICT(racer_id) DO UPDATE SET laps = excluded.laps, total_ms = excluded.total_ms
+            WHERE excluded.laps > kart.laps
+        """, (racer_id, lap_number, total_ms))
+        affected = {racer_id}
+        if leader is None or total_ms < leader:
+            affected.update(r for (r,) in self.db.execute(
+                "SELECT racer_id FROM kart WHERE laps IN (?, ?)", (lap_number, lap_number + GAP_TREND_LAPS)))
+        else:
+            behind = self.db.execute("""
+                SELECT racer_id FROM crossing
+                WHERE lap_number = ? AND (total_ms > ? OR (total_ms = ? AND racer_id > ?))
+                ORDER BY total_ms, racer_id LIMIT 1
+            """, (lap_number, total_ms, total_ms, racer_id)).fetchone()
+            if behind:
+                affected.add(behind[0])
+        for rid in affected:
+            self._update_kart(rid)
+        return True
+
+    def _update_kart(self, racer_id):
+        row = self.kart(racer_id)
+        if row:
+            self.db.execute("UPDATE kart SET gap_ms = ?, interval_ms = ?, gap_trend_ms_per_lap = ? WHERE racer_id = ?",
+                            (row["gap_ms"], row["interval_ms"], row["gap_trend_ms_per_lap"], racer_id))
+
+    def add_laps(self, racer_id, laps):
+        """
+        laps: dicts da API (Lap, TotalTime), normalmente a lista inteira do kart a cada consulta.
+        Só as voltas depois da última passagem registrada são aplicadas. Retorna quantas entraram.
+        """
+        last = self.last_lap(racer_id)
+        added = 0
+        for lap in laps:
+            try:
+                lap_number = int(lap.get("Lap"))
+            except (TypeError, ValueError):
+                continue
+            if lap_number <= last:
+                continue
+            if self.add_lap(racer_id, lap_number, parse_ms(lap.get("TotalTime") or "")):
+                added += 1
+        return added
+
+    def _leader_at(self, lap_number):
+        row = self.db.execute("SELECT MIN(total_ms) FROM crossing WHERE lap_number = ?", (lap_number,)).fetchone()
+        return row[0]
+
+    def _gap_at(self, racer_id, lap_number, total):
+        """(gap_para_lider_ms, intervalo_ms) na volta informada."""
+        row = self.db.execute("""
+            SELECT total_ms FROM crossing
+            WHERE lap_number = ? AND (total_ms < ? OR (total_ms = ? AND racer_id < ?))
+            ORDER BY total_ms DESC, racer_id DESC LIMIT 1
+        """, (lap_number, total, total, racer_id)).fetchone()
+        ahead = row[0] if row else total
+        return total - self._leader_at(lap_number), total - ahead
+
+    def _kart_row(self, racer_id, lap, total):
+        gap, interval = self._gap_at(racer_id, lap, total)
+        # Tendência: variação média do gap por volta nas últimas GAP_TREND_LAPS voltas (negativo = aproximando)
+        back = lap - GAP_TREND_LAPS
+        trend = None
+        if back >= 1:
+            row = self.db.execute("SELECT total_ms FROM crossing WHERE racer_id = ? AND lap_number = ?",
+                                  (racer_id, back)).fetchone()
+            if row:
+                trend = (gap - (row[0] - self._leader_at(back))) / GAP_TREND_LAPS
+        return {"racer_id": racer_id, "laps": lap, "total_ms": total,
+                "gap_ms": gap, "interval_ms": interval, "gap_trend_ms_per_lap": trend}
+
+    def kart(self, racer_id):
+        """Estado atual de um kart (None se ainda não tem voltas com tempo)."""
+        row = self.db.execute("SELECT laps, total_ms FROM kart WHERE racer_id = ?", (racer_id,)).fetchone()
+        return self._kart_row(racer_id, *row) if row else None
+
+    def kart_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM kart").fetchone()[0]
+
+    def standings(self):
+        """
+        Classificação completa: mais voltas primeiro, depois menor tempo acumulado.
+        Karts com voltas a menos recebem laps_down em vez de gap/intervalo em tempo.
+        """
+        cur = self.db.execute("""
+            SELECT racer_id, laps, total_ms, gap_ms, interval_ms, gap_trend_ms_per_lap
+            FROM kart ORDER BY laps DESC, total_ms, racer_id
+        """)
+        keys = [c[0] for c in cur.description]
+        rows = [dict(zip(keys, r)) for r in cur.fetchall()]
+        if not rows:
+            return rows
+        leader_laps = rows[0]["laps"]
+        prev = None
+        for pos, row in enumerate(rows, start=1):
+            row["position"] = pos
+            row["laps_down"] = leader_laps - row["laps"]
+            if row["laps_down"]:
+                row["gap_ms"] = None
+            if prev is not None and prev["laps"] != row["laps"]:
+                row["interval_ms"] = None  # kart à frente está em outra volta
+            elif prev is None:
+                row["interval_ms"] = 0
+            prev = row
+        return rows
+
+    def close(self):
+        self.db.close()
+
+# ====================== ESTADO EM ARQUIVO ======================
+def state_path(race_id, directory=None):
+    """Estado do engine (SQLite com as passagens), usado pelo ingest."""
+    return os.path.join(directory or STANDINGS_DIR, f"race_{int(race_id)}.db")
+
+def standings_path(race_id, directory=None):
+    """Classificação pronta (pequena), lida pelo webapp."""
+    return os.path.join(directory or STANDINGS_DIR, f"race_{int(race_id)}.standings.json")
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+_engines = {}
+
+def load_engine(race_id, directory=None):
+    """Engine da corrida (conexão reaproveitada no processo; o SQLite enxerga o que outros processos gravaram)."""
+    path = state_path(race_id, directory)
+    engine = _engines.get(path)
+    if engine is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        engine = StandingsEngine(race_id, path)
+        _engines[path] = engine
+    return engine
+
+def save_standings(engine, directory=None):
+    """
+    Grava a classificação de forma atômica (o webapp nunca lê um arquivo pela metade).
+    Custo O(grid): um SELECT ordenado de kart e um JSON com uma linha por kart.
+    """
+    _write_atomic(standings_path(engine.race_id, directory), {"race_id": engine.race_id, "standings": engine.standings()})
+
+def drop_race(race_id, directory=None):
+    """Apaga o estado e a classificação da corrida."""
+    path = state_path(race_id, directory)
+    engine = _engines.pop(path, None)
+    if engine is not None:
+        engine.close()
+    for p in (path, f"{path}-wal", f"{path}-shm", standings_path(race_id, directory)):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+@contextmanager
+def _race_lock(race_id, directory=None):
+    """Lock exclusivo por corrida: vários workers do scheduler podem alimentar a mesma corrida."""
+    path = state_path(race_id, directory) + ".lock"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def feed_laps(race_id, racer_id, laps, directory=None):
+    """
+    Ponto de entrada do ingest: aplica só as voltas novas (O(1) por volta: uma passagem e as poucas
+    linhas de kart afetadas) e, se algo mudou, regrava a classificação (O(grid), uma vez por chamada).
+    """
+    with _race_lock(race_id, directory):
+        engine = load_engine(race_id, directory)
+        with engine.transaction():
+            added = engine.add_laps(racer_id, laps)
+        if added:
+            save_standings(engine, directory)
+    return added
+
+_cache = {}
+
+def standings_version(race_id, directory=None):
+    """mtime_ns da classificação pronta (0 se não existe): entra na versão/ETag das respostas do webapp."""
+    try:
+        return os.stat(standings_path(race_id, directory)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def read_standings(race_id, directory=None):
+    """
+    Leitura para o webapp: {racer_id: linha} da classificação já calculada pelo ingest.
+    Reaproveita o resultado enquanto o arquivo não muda (mtime). Vazio se ainda não há classificação.
+    """
+    path = standings_path(race_id, directory)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    hit = _cache.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    with open(path, "r", encoding="utf-8") as f:
+        rows = json.load(f).get("standings") or []
+    result = {row["racer_id"]: row for row in rows}
+    _cache[path] = (mtime, result)
+    return result
+
+def rebuild_from_db(conn, race_id, directory=None):
+    """Reconstrói o estado a partir de competitor_laps (bootstrap ou após reinício no meio da corrida)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT racer_id, lap_number, total_time
+            FROM competitor_laps
+            WHERE race_id = %s
+            ORDER BY lap_number, racer_id
+        """, (race_id,))
+        rows = [(racer_id, lap_number, parse_ms(total_time)) for racer_id, lap_number, total_time in cur]
+    finally:
+        cur.close()
+    with _race_lock(race_id, directory):
+        engine = load_engine(race_id, directory)
+        with engine.transaction():  # no mesmo arquivo: conexões abertas em outros processos continuam válidas
+            engine.db.execute("DELETE FROM crossing")
+            engine.db.execute("DELETE FROM kart")
+            for racer_id, lap_number, total_ms in rows:
+                engine.add_lap(racer_id, lap_number, total_ms)
+        save_standings(engine, directory)
+    return engine
+
+# ====================== CLI ======================
+def main():
+    parser = argparse.ArgumentParser(description="Classificação ao vivo (gaps/intervalos) por corrida.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("rebuild", help="Reconstrói o estado a partir do MySQL.")
+    p.add_argument("--race-id", type=int, required=True)
+    p = sub.add_parser("show", help="Mostra a classificação pronta.")
+    p.add_argument("--race-id", type=int, required=True)
+    args = parser.parse_args()
+
+    if args.cmd == "rebuild":
+        from db_config import get_mysql_conn
+        conn = get_mysql_conn()
+        try:
+            engine = rebuild_from_db(conn, args.race_id)
+        finally:
+            conn.close()
+        print(f"✅ Estado reconstruído: race_id={args.race_id}, {engine.kart_count()} karts → {state_path(args.race_id)}")
+    else:
+        rows = sorted(read_standings(args.race_id).values(), key=lambda r: r["position"])
+        for r in rows:
+            gap = f"+{r['laps_down']} volta(s)" if r["laps_down"] else f"{r['gap_ms'] / 1000:+.3f}s"
+            interval = "—" if r["interval_ms"] is None else f"{r['interval_ms'] / 1000:+.3f}s"
+            print(f"{r['position']:>3} {r['racer_id']:>8} voltas={r['laps']:<4} gap={gap:<14} int={interval}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 
 # -*- coding: utf-8 -*-
-import os, sys, re, logging, subprocess, threading
-from logging.handlers import RotatingFileHandler
+import os, sys, re, json, gzip, time, fcntl, socket, signal, argparse, hashlib, logging, subprocess, threading
+from decimal import Decimal
+from logging.handlers import WatchedFileHandler
 from datetime import datetime
-from statistics import mean
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session, stream_with_context, g, abort
 
 # Caminhos base
 ROOT_DIR = '/home/ubuntu/mykartapp'
@@ -14,9 +14,21 @@ LOGS_DIR = os.path.join(WEBAPP_DIR, 'logs')
 # Acesso ao db_config
 sys.path.append(ROOT_DIR)
 try:
-    from db_config import get_mysql_conn
+    from db_config import get_mysql_conn, app_config_cache
 except Exception:
-    get_mysql_conn = None
+    get_mysql_conn = app_config_cache = None
+from log_reader import tail_lines, follow_lines, search_logs
+from race_archive import ensure_race_partition
+from lap_stats import parse_ms, compute_kart_metrics, STATS_WINDOW_LAPS
+from lap_store import lap_store
+from lap_export import stream_export, export_filename, FORMATS as EXPORT_FORMATS
+from kart_aggregates import kart_history, kart_ranking, KINDS as KART_KINDS
+from box_sweep import load_box_laps, build_grid, sweep, SWEEP_WINDOW_MIN, WINDOWS_MIN
+from standings import read_standings, standings_version
+from event_log import LOG_DIR as EVENT_LOG_DIR
+from db_instrument import SLOW_QUERY_LOG, SLOW_QUERY_MS, reset_query_counter, query_counter
+from api_health import key_metrics
+from profiling import Profile, profiling_enabled, list_profiles, profile_path, top_hotspots, PROFILE_TARGETS, PROFILE_DIR
 
 APP_TITLE = "MyKartApp – Controle"
 SCRIPTS_DIR = os.environ.get('MYKART_SCRIPTS_DIR', ROOT_DIR)
@@ -24,6 +36,10 @@ CLEANUP_SCRIPT = os.path.join(SCRIPTS_DIR, 'cleanup_tables.py')
 POPULATE_SCRIPT = os.path.join(SCRIPTS_DIR, 'race_monitor_populate_groups.py')
 SCHEDULER_SCRIPT = os.path.join(SCRIPTS_DIR, 'race_monitor_scheduler.py')
 RACE_LOG_FILE = os.path.join(SCRIPTS_DIR, 'race_monitor.log')
+BOX_LOG_FILE = os.path.join(LOGS_DIR, 'box_eval.log')
+SLOW_QUERY_FILE = os.path.join(EVENT_LOG_DIR, SLOW_QUERY_LOG)
+LOG_FILES = {'race': RACE_LOG_FILE, 'box_eval': BOX_LOG_FILE, 'slow_query': SLOW_QUERY_FILE}
+FOLLOW_MAX_SECONDS = 300  # o navegador (EventSource) reconecta sozinho ao fim do stream
 
 # Thresholds de cor (ms de delta vs média global)
 try:
@@ -43,7 +59,8 @@ os.makedirs(LOGS_DIR, exist_ok=True)
 def _make_logger(name, filename):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    handler = RotatingFileHandler(os.path.join(LOGS_DIR, filename), maxBytes=1_000_000, backupCount=3, encoding='utf-8')
+    # Workers do pre-fork escrevem no mesmo arquivo: rotação só pelo logrotate (ver event_log)
+    handler = WatchedFileHandler(os.path.join(LOGS_DIR, filename), encoding='utf-8')
     fmt = logging.Formatter('[%(asctime)s] %(levelname)s %(name)s: %(message)s')
     handler.setFormatter(fmt)
     if not any(getattr(h, 'baseFilename', None) == handler.baseFilename for h in logger.handlers):
@@ -59,85 +76,163 @@ boot_logger = _make_logger('app_boot', 'app_boot.log')
 box_logger  = _make_logger('box_eval', 'box_eval.log')
 
 # ---------------------- Scheduler ----------------------
+# Vários processos web (ver serve_prefork) compartilham UM scheduler: cada processo disputa o flock
+# de SCHED_LOCK_FILE e só o líder roda SCHEDULER_SCRIPT. start/stop (em qualquer worker) gravam o estado
+# desejado em SCHED_CONTROL_FILE; o líder grava o status em SCHED_STATUS_FILE, lido por /scheduler/status.
+# Se o líder morre, o SO libera o lock e outro worker assume em até SCHED_ELECT_S.
+SCHED_DIR = os.environ.get('MYKART_SCHED_DIR', LOGS_DIR)
+SCHED_LOCK_FILE = os.path.join(SCHED_DIR, 'scheduler.lock')
+SCHED_CONTROL_FILE = os.path.join(SCHED_DIR, 'scheduler_control.json')
+SCHED_STATUS_FILE = os.path.join(SCHED_DIR, 'scheduler_status.json')
+SCHED_POLL_S = 1.0   # líder relê o controle (stop/intervalo) a cada segundo
+SCHED_ELECT_S = 5.0  # seguidores tentam o lock a cada 5s
+
+def _read_json(path, default=None):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {} if default is None else default
+
+def _write_json(path, data):
+    """Escrita atômica (tmp + os.replace): leitores nunca veem o arquivo pela metade."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
 class SchedulerManager:
     def __init__(self):
+        self._pid = None
         self._thread = None
-        self._stop_evt = threading.Event()
-        self.interval_seconds = None
-        self.running = False
-        self.start_time = None
-        self.last_run = None
-        self.run_count = 0
-        self.last_returncode = None
-        self.last_stdout = ''
-        self.last_stderr = ''
+        self._lock_fd = None
+        self.is_leader = False
+
+    def ensure_candidate(self):
+        """Inicia (uma vez por processo, inclusive após fork) a thread que disputa a liderança."""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        # Thread morta neste processo: solta o lock que ela segurava. Após fork o fd herdado é só fechado
+        # (LOCK_UN liberaria também o lock do processo pai, que compartilha a mesma descrição de arquivo).
+        self._release_lock(unlock=self._pid == os.getpid())
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name='scheduler-leader')
+        self._thread.start()
+
+    def _try_lead(self):
+        fd = os.open(SCHED_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0); os.write(fd, str(os.getpid()).encode())
+        self._lock_fd = fd
+        self.is_leader = True
+        return True
+
+    def _release_lock(self, unlock=True):
+        fd, self._lock_fd = self._lock_fd, None
+        self.is_leader = False
+        if fd is None:
+            return
+        try:
+            if unlock:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _run_once(self, state):
+        try:
+            proc = subprocess.run(['/usr/bin/python3', SCHEDULER_SCRIPT], capture_output=True, text=True, timeout=120)
+            state['last_returncode'] = proc.returncode
+            state['last_stdout'] = proc.stdout[-4000:]
+            state['last_stderr'] = proc.stderr[-4000:]
+            state['run_count'] = state.get('run_count', 0) + 1
+        except Exception as e:
+            state['last_stderr'] = f"Exception: {e}"
+            state['last_returncode'] = -1
+        state['last_run'] = datetime.now().isoformat()
 
     def _loop(self):
-        while not self._stop_evt.is_set():
-            try:
-                proc = subprocess.run(['/usr/bin/python3', SCHEDULER_SCRIPT], capture_output=True, text=True, timeout=120)
-                self.last_returncode = proc.returncode
-                self.last_stdout = proc.stdout[-4000:]
-                self.last_stderr = proc.stderr[-4000:]
-                self.run_count += 1
-                self.last_run = datetime.now()
-            except Exception as e:
-                self.last_stderr = f"Exception: {e}"
-                self.last_returncode = -1
-                self.last_run = datetime.now()
-            self._stop_evt.wait(self.interval_seconds)
-        self.running = False
+        try:
+            while True:
+                try:
+                    if self._try_lead():
+                        break
+                except OSError as e:
+                    boot_logger.error('Scheduler: falha ao disputar o lock: %s', e)
+                time.sleep(SCHED_ELECT_S)
+            boot_logger.info('Scheduler: processo %s é o líder', os.getpid())
+            state = _read_json(SCHED_STATUS_FILE)
+            state.update(leader_pid=os.getpid(), leader_since=datetime.now().isoformat())
+            next_run = 0.0
+            dirty = True
+            while True:
+                # Erro num ciclo (arquivo de controle inválido, disco cheio...) não derruba o líder
+                try:
+                    if dirty:
+                        _write_json(SCHED_STATUS_FILE, state)
+                        dirty = False
+                    control = _read_json(SCHED_CONTROL_FILE)
+                    if control.get('running') and control.get('interval_seconds'):
+                        interval = int(control['interval_seconds'])
+                        if state.get('start_time') != control.get('start_time'):  # novo start: zera a contagem
+                            state.update(start_time=control.get('start_time'), run_count=0)
+                            next_run = 0.0
+                        if time.monotonic() >= next_run:
+                            next_run = time.monotonic() + interval
+                            self._run_once(state)
+                            dirty = True
+                            _write_json(SCHED_STATUS_FILE, state)
+                            dirty = False
+                except Exception as e:
+                    boot_logger.error('Scheduler: erro no ciclo do líder: %s', e)
+                time.sleep(SCHED_POLL_S)
+        finally:
+            # Só chega aqui se a thread morrer: solta o lock para outro worker (ou a próxima eleição) assumir
+            if self._pid == os.getpid():
+                self._release_lock()
 
     def start(self, interval_seconds: int):
         if not interval_seconds or interval_seconds <= 0:
             raise ValueError("Intervalo deve ser > 0 segundos")
-        self.interval_seconds = int(interval_seconds)
-        if self._thread and self._thread.is_alive():
-            return
-        self._stop_evt.clear()
-        self.run_count = 0
-        self.start_time = datetime.now()
-        self.running = True
-        self._thread = threading.Thread(target=self._loop, daemon=True)
-        self._thread.start()
+        control = _read_json(SCHED_CONTROL_FILE)
+        if not control.get('running'):
+            control.update(running=True, start_time=datetime.now().isoformat())
+        control['interval_seconds'] = int(interval_seconds)
+        _write_json(SCHED_CONTROL_FILE, control)
+        self.ensure_candidate()
 
     def stop(self):
-        if self._thread and self._thread.is_alive():
-            self._stop_evt.set()
-            self._thread.join(timeout=10)
-        self.running = False
+        control = _read_json(SCHED_CONTROL_FILE)
+        control['running'] = False
+        _write_json(SCHED_CONTROL_FILE, control)
 
     def status(self):
+        control = _read_json(SCHED_CONTROL_FILE)
+        state = _read_json(SCHED_STATUS_FILE)
         return {
-            'running': self.running,
-            'interval_seconds': self.interval_seconds,
-            'start_time': self.start_time.isoformat() if self.start_time else None,
-            'last_run': self.last_run.isoformat() if self.last_run else None,
-            'run_count': self.run_count,
-            'last_returncode': self.last_returncode,
+            'running': bool(control.get('running')),
+            'interval_seconds': control.get('interval_seconds'),
+            'start_time': control.get('start_time'),
+            'last_run': state.get('last_run'),
+            'run_count': state.get('run_count', 0),
+            'last_returncode': state.get('last_returncode'),
+            'leader_pid': state.get('leader_pid'),
+            'leader_since': state.get('leader_since'),
+            'worker_pid': os.getpid(),
+            'is_leader': self.is_leader,
         }
 
 sched = SchedulerManager()
 
-# ---------------------- Helpers ----------------------
-
-def parse_ms(s: str):
-    if not s: return None
-    s = s.strip()
-    try:
-        if s.count(':') == 2:
-            h, m, rest = s.split(':')
-            sec, ms = rest.split('.') if '.' in rest else (rest, '0')
-            return int(h)*3600000 + int(m)*60000 + int(sec)*1000 + int(ms.ljust(3,'0')[:3])
-        elif s.count(':') == 1:
-            m, rest = s.split(':')
-            sec, ms = rest.split('.') if '.' in rest else (rest, '0')
-            return int(m)*60000 + int(sec)*1000 + int(ms.ljust(3,'0')[:3])
-        else:
-            return None
-    except Exception:
-        return None
+@app.before_request
+def _sched_candidate():
+    # Funciona com qualquer servidor (app.run, serve_prefork, gunicorn): cada processo entra na eleição
+    sched.ensure_candidate()
 
+# ---------------------- Helpers ----------------------
 
 def fmt_ms(ms):
     if ms is None: return '—'
@@ -164,7 +259,52 @@ def get_color_class(delta):
         return 'cell-warn'
     return 'cell-slow'
 
+def fmt_gap(row, key='gap_ms'):
+    """Gap/intervalo ao vivo: '+1.234' (s), '+N v' se está voltas atrás, '—' sem dado."""
+    if not row: return '—'
+    if key == 'gap_ms' and row.get('laps_down'):
+        return f"+{row['laps_down']} v"
+    ms = row.get(key)
+    if ms is None: return '—'
+    return f"+{ms / 1000:.3f}" if ms else '0.000'
+
+# ---------------------- Profiling (opt-in via MYKART_PROFILE) ----------------------
+PROFILE_SKIP_ENDPOINTS = {'static', 'logs_follow', 'profiles_view', 'profile_detail', 'export_laps'}
+
+@app.before_request
+def _profile_start():
+    endpoint = request.endpoint
+    if endpoint and endpoint not in PROFILE_SKIP_ENDPOINTS and profiling_enabled(endpoint):
+        g._profile = Profile(endpoint, request.query_string.decode('utf-8', errors='replace'))
+
+@app.teardown_request
+def _profile_stop(exc):
+    prof = g.pop('_profile', None)
+    if prof is not None:
+        try:
+            prof.stop()
+        except Exception as e:
+            boot_logger.error('profile save error: %s', e)
+
+# ---------------------- Métricas por request (loadtest.py) ----------------------
+# Cada resposta informa quantas queries rodou e o tempo no banco (conexões instrumentadas, DB_INSTRUMENT)
+@app.before_request
+def _request_metrics_start():
+    reset_query_counter()
+    g._request_start = time.perf_counter()
+
+@app.after_request
+def _request_metrics_headers(response):
+    queries, db_ms = query_counter()
+    response.headers['X-DB-Queries'] = str(queries)
+    response.headers['X-DB-Ms'] = f"{db_ms:.1f}"
+    start = g.get('_request_start')
+    if start is not None:
+        response.headers['X-App-Ms'] = f"{(time.perf_counter() - start) * 1000:.1f}"
+    return response
+
 app.jinja_env.globals['fmt_ms'] = fmt_ms
+app.jinja_env.globals['fmt_gap'] = fmt_gap
 app.jinja_env.globals['get_color_class'] = get_color_class
 
 # ---------------------- DB helpers ----------------------
@@ -183,9 +323,8 @@ def _conn_or_flash():
 
 def get_current_race_id(conn):
     try:
-        cur = conn.cursor(); cur.execute("SELECT race_id FROM app_config WHERE id = 1")
-        row = cur.fetchone(); cur.close()
-        if row and row[0]: return row[0]
+        race_id = app_config_cache.current_race_id(conn)
+        if race_id: return race_id
         cur = conn.cursor(); cur.execute("SELECT MAX(race_id) FROM competitors")
         row = cur.fetchone(); cur.close()
         return row[0] if row and row[0] else None
@@ -194,112 +333,64 @@ def get_current_race_id(conn):
         return None
 
 
-def fetch_competitor_basic(conn, race_id, racer_id):
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT racer_id, number, first_name, last_name, last_lap_time FROM competitors WHERE race_id=%s AND racer_id=%s", (race_id, racer_id))
-        row = cur.fetchone()
-        return None if not row else {
-            'racer_id': row[0], 'number': row[1], 'first_name': row[2], 'last_name': row[3], 'last_lap_ms': parse_ms(row[4])
-        }
-    finally:
-        cur.close()
+def race_kart_stats(conn, race_id):
+    """Métricas por kart a partir do lap store em memória (só as voltas novas vêm do MySQL)."""
+    lap_store.refresh(conn, race_id)
+    return compute_kart_metrics(lap_store.race_laps(race_id, STATS_WINDOW_LAPS))
 
 
-def fetch_last_n_laps_ms(conn, race_id, racer_id, n=5):
-    cur = conn.cursor()
+def warm_lap_store():
+    """Hidrata as corridas ativas ao subir o processo (em thread: não atrasa o início do servidor)."""
     try:
-        cur.execute("SELECT lap_number, lap_time FROM competitor_laps WHERE race_id=%s AND racer_id=%s ORDER BY lap_number DESC LIMIT %s", (race_id, racer_id, n))
-        rows = cur.fetchall(); laps = [parse_ms(t[1]) for t in rows]
-        return laps[::-1]
-    finally:
-        cur.close()
-
-
-def fetch_global_lastlap_mean_ms(conn, race_id):
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            SELECT cl.lap_time
-            FROM competitor_laps cl
-            JOIN (
-                SELECT racer_id, MAX(lap_number) AS max_lap
-                FROM competitor_laps
-                WHERE race_id = %s
-                GROUP BY racer_id
-            ) t ON t.racer_id = cl.racer_id AND t.max_lap = cl.lap_number
-            WHERE cl.race_id = %s
-            """,
-            (race_id, race_id)
-        )
-        vals = []
-        for (lap_time_str,) in cur.fetchall():
-            ms = parse_ms(lap_time_str)
-            if ms is not None and ms <= 120000:  # ignora > 2:00
-                vals.append(ms)
-        return int(mean(vals)) if vals else None
-    finally:
-        cur.close()
+        conn = get_mysql_conn()
+        try:
+            for race_id in app_config_cache.active_race_ids(conn):
+                n = lap_store.hydrate(conn, race_id)
+                boot_logger.info('Lap store: race_id=%s hidratada (%s voltas)', race_id, n)
+        finally:
+            conn.close()
+    except Exception as e:
+        boot_logger.error('warm_lap_store error: %s', e)
 
 
-def fetch_top_positions(conn, race_id, positions=(1,2,3)):
+def fetch_competitors_basic(conn, race_id):
+    """Dados básicos de todos os competidores da corrida em uma query: {racer_id: dict}."""
     cur = conn.cursor()
     try:
-        data = []
-        for pos in positions:
-            cur.execute("SELECT racer_id FROM competitors WHERE race_id=%s AND position=%s", (race_id, pos))
-            racers = [r[0] for r in cur.fetchall()]
-            if not racers: continue
-            max_lap, chosen = -1, None
-            for rid in racers:
-                cur.execute("SELECT MAX(lap_number) FROM competitor_laps WHERE race_id=%s AND racer_id=%s", (race_id, rid))
-                ml = cur.fetchone()[0] or 0
-                if ml > max_lap: max_lap, chosen = ml, rid
-            if chosen: data.append({'position': pos, 'racer_id': chosen})
-        return data
+        cur.execute("SELECT racer_id, number, first_name, last_name, last_lap_time, position FROM competitors WHERE race_id=%s", (race_id,))
+        return {
+            row[0]: {'racer_id': row[0], 'number': row[1], 'first_name': row[2], 'last_name': row[3],
+                     'last_lap_ms': parse_ms(row[4]), 'position': row[5]}
+            for row in cur.fetchall()
+        }
     finally:
         cur.close()
 
 
-def fetch_fastest_slowest_lastlaps(conn, race_id, top=5):
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            SELECT cl.racer_id, cl.lap_time
-            FROM competitor_laps cl
-            JOIN (
-                SELECT racer_id, MAX(lap_number) AS max_lap
-                FROM competitor_laps
-                WHERE race_id = %s
-                GROUP BY racer_id
-            ) t ON t.racer_id = cl.racer_id AND t.max_lap = cl.lap_number
-            WHERE cl.race_id = %s
-            """,
-            (race_id, race_id)
-        )
-        rows = [(r, parse_ms(t)) for r, t in cur.fetchall()]
-        rows = [(r, ms) for r, ms in rows if ms is not None]
-        fast = sorted(rows, key=lambda x: x[1])[:top]
-        rows90 = [(r, ms) for r, ms in rows if ms <= 90000]  # slowest ignora >1:30
-        slow = sorted(rows90, key=lambda x: x[1], reverse=True)[:top]
-        avg_ms = int(mean([ms for _, ms in rows if ms <= 120000])) if rows else None
-        return fast, slow, avg_ms
-    finally:
-        cur.close()
+def fetch_top_positions(basics, stats, positions=(1,2,3)):
+    """Para cada posição, escolhe o racer com mais voltas (desempate quando há posições repetidas)."""
+    data = []
+    for pos in positions:
+        racers = [rid for rid, b in basics.items() if b['position'] == pos]
+        if not racers: continue
+        chosen = max(racers, key=lambda rid: (stats.get(rid) or {}).get('max_lap') or 0)
+        data.append({'position': pos, 'racer_id': chosen})
+    return data
 
 
-def build_comp_row(conn, race_id, racer_id):
-    base = fetch_competitor_basic(conn, race_id, racer_id)
+def build_comp_row(basics, stats, racer_id, live=None):
+    """live: classificação ao vivo (standings.read_standings) para gap/intervalo, sem consultar o MySQL."""
+    base = basics.get(racer_id)
     if not base: return None
-    last5 = fetch_last_n_laps_ms(conn, race_id, racer_id, 5)
-    last10 = fetch_last_n_laps_ms(conn, race_id, racer_id, 10)
+    m = stats.get(racer_id) or {}
+    last5 = m.get('last_laps') or []
     return {
+        'live': (live or {}).get(racer_id),
         'racer_id': base['racer_id'], 'number': base['number'], 'first_name': base['first_name'], 'last_name': base['last_name'],
         'last_lap_ms': last5[-1] if last5 else base['last_lap_ms'], 'last5_ms': last5,
-        'avg5_ms': int(mean([x for x in last5 if x is not None])) if last5 else None,
-        'avg10_ms': int(mean([x for x in last10 if x is not None])) if last10 else None,
+        'avg5_ms': m.get('avg5_ms'), 'avg10_ms': m.get('avg10_ms'),
+        'stddev10_ms': m.get('stddev10_ms'), 'best_stint_ms': m.get('best_stint_ms'),
+        'trend_ms_per_lap': m.get('trend_ms_per_lap'),
     }
 
 # ---------------------- Health ----------------------
@@ -331,35 +422,38 @@ def dashboard():
                                    chosen_rows=[], chosen_numbers='', auto_refresh=False)
         auto_refresh = request.args.get('auto', 'off') == 'on'
 
+        # Uma query de competidores + voltas novas no lap store; métricas de todos os karts numa passada (lap_stats)
+        basics = fetch_competitors_basic(conn, race_id)
+        stats = race_kart_stats(conn, race_id)
+
         # Grupo principal 2min
-        cur = conn.cursor(); cur.execute("SELECT racer_id FROM update_group_2min ORDER BY racer_id ASC")
+        cur = conn.cursor(); cur.execute("SELECT racer_id FROM update_group_2min WHERE race_id = %s ORDER BY racer_id ASC", (race_id,))
         main_ids = [r[0] for r in cur.fetchall()]; cur.close()
-        main_rows = [r for rid in main_ids if (r:=build_comp_row(conn, race_id, rid))]
+        live = read_standings(race_id)
+        main_rows = [r for rid in main_ids if (r:=build_comp_row(basics, stats, rid, live))]
 
-        global_avg_ms = fetch_global_lastlap_mean_ms(conn, race_id)
+        global_avg_ms = stats.mean_last_lap(max_ms=120000)
         pos_rows = []
-        for info in fetch_top_positions(conn, race_id, positions=(1,2,3)):
-            r = build_comp_row(conn, race_id, info['racer_id']);
+        for info in fetch_top_positions(basics, stats, positions=(1,2,3)):
+            r = build_comp_row(basics, stats, info['racer_id'])
             if r: r['position'] = info['position']; pos_rows.append(r)
 
-        fastest, slowest, avg_last_ms = fetch_fastest_slowest_lastlaps(conn, race_id, top=5)
-        fastest_rows = [build_comp_row(conn, race_id, rid) for rid, _ in fastest]
-        slowest_rows = [build_comp_row(conn, race_id, rid) for rid, _ in slowest]
+        fastest = stats.fastest_last_laps(top=5)
+        slowest = stats.slowest_last_laps(top=5, max_ms=90000)
+        avg_last_ms = global_avg_ms
+        fastest_rows = [build_comp_row(basics, stats, rid) for rid, _ in fastest]
+        slowest_rows = [build_comp_row(basics, stats, rid) for rid, _ in slowest]
 
         # Karts selecionados (múltiplos)
         chosen_numbers = (request.args.get('kart_numbers') or '').strip()
         chosen_rows = []
         if chosen_numbers:
             nums = [n.strip() for n in chosen_numbers.replace(';', ',').split(',') if n.strip()]
-            if nums:
-                cur = conn.cursor()
-                for num in nums:
-                    cur.execute("SELECT racer_id FROM competitors WHERE race_id=%s AND number=%s", (race_id, num))
-                    row = cur.fetchone()
-                    if row:
-                        r = build_comp_row(conn, race_id, row[0])
-                        if r: chosen_rows.append(r)
-                cur.close()
+            by_number = {str(b['number']): rid for rid, b in basics.items()}
+            for num in nums:
+                rid = by_number.get(num)
+                r = build_comp_row(basics, stats, rid) if rid is not None else None
+                if r: chosen_rows.append(r)
 
         if not main_rows:
             flash('Grupo 2min vazio ou sem dados para o race_id atual. Use Configuração → Popular grupos.')
@@ -370,7 +464,7 @@ def dashboard():
                                race_id=race_id, main_rows=main_rows, global_avg_ms=global_avg_ms,
                                pos_rows=pos_rows, fastest_rows=fastest_rows, slowest_rows=slowest_rows,
                                avg_last_ms=avg_last_ms, chosen_rows=chosen_rows, chosen_numbers=chosen_numbers,
-                               auto_refresh=auto_refresh)
+                               auto_refresh=auto_refresh, active_races=fetch_active_races(conn))
     finally:
         try: conn.close()
         except Exception: pass
@@ -424,10 +518,11 @@ def callproc_with(conn, sp_name, params):
     return sets
 
 
-def run_both_procs_for_intervals(intervals):
+def run_both_procs_for_intervals(intervals, race_id=None):
     out = {'ranking': [], 'summary': []}
     for (mn, mx) in intervals:
         p = list(BASE_PARAMS)
+        p[0] = race_id
         p[1] = int(mn)
         p[2] = int(mx)
         conn_a = get_mysql_conn(); rank_sets = callproc_with(conn_a, 'my_karting_app.sp_kart_box_ranking', p)
@@ -446,6 +541,23 @@ BOX_OPTIONS = {
     'opt_custom': []  # definidas pelo usuário
 }
 
+def intervals_from_args(args):
+    """Intervalos de box a partir de choice ou pit_min/pit_max (e pit_min2/pit_max2 opcionais)."""
+    if args.get('pit_min') or args.get('pit_max'):
+        pairs = [('pit_min', 'pit_max'), ('pit_min2', 'pit_max2')]
+        intervals = []
+        for kmin, kmax in pairs:
+            mn, mx = args.get(kmin, type=int), args.get(kmax, type=int)
+            if mn is None and mx is None: continue
+            if mn is None or mx is None:
+                raise ValueError(f'Informe {kmin} e {kmax}.')
+            intervals.append((min(mn, mx), max(mn, mx)))
+        return intervals
+    choice = args.get('choice', 'opt_230_250')
+    if choice not in BOX_OPTIONS or not BOX_OPTIONS[choice]:
+        raise ValueError('choice inválido (use opt_230_250, opt_two_windows ou pit_min/pit_max).')
+    return BOX_OPTIONS[choice]
+
 @app.route('/box_eval', methods=['GET', 'POST'])
 def box_eval():
     # Restaurar da sessão (lembrar escolhas)
@@ -492,8 +604,11 @@ def box_eval():
             else:
                 intervals = BOX_OPTIONS.get(choice, BOX_OPTIONS['opt_230_250'])
 
-            # Executar ambas as SPs
-            results = run_both_procs_for_intervals(intervals)
+            # Executar ambas as SPs (restritas à corrida ativa → só a partição dela é lida)
+            conn = get_mysql_conn()
+            try: race_id = get_current_race_id(conn)
+            finally: conn.close()
+            results = run_both_procs_for_intervals(intervals, race_id)
         except Exception as e:
             err = str(e)
             box_logger.error('box_eval error: %s', err)
@@ -503,35 +618,410 @@ def box_eval():
                            custom_min1=custom_min1, custom_max1=custom_max1,
                            custom_min2=custom_min2, custom_max2=custom_max2)
 
+SWEEP_DEFAULTS = {'min_from': 220, 'min_to': 260, 'max_from': 240, 'max_to': 280, 'step': 10, 'win_min': SWEEP_WINDOW_MIN}
+
+def sweep_params(args):
+    """Grade da varredura a partir de min_from/min_to/max_from/max_to/step/win_min (faltando = padrão)."""
+    params = {k: args.get(k, default, type=int) for k, default in SWEEP_DEFAULTS.items()}
+    if params['win_min'] not in WINDOWS_MIN:
+        raise ValueError(f"win_min deve ser uma das janelas {', '.join(map(str, WINDOWS_MIN))}.")
+    grid = build_grid(params['min_from'], params['min_to'], params['max_from'], params['max_to'], params['step'])
+    return params, grid
+
+def run_box_sweep(grid, race_id, win_min):
+    """Varredura de faixas: uma leitura das voltas da corrida, todas as faixas avaliadas em memória."""
+    conn = get_mysql_conn()
+    try:
+        laps = load_box_laps(conn, race_id)
+    finally:
+        conn.close()
+    return sweep(laps, grid, win_min)
+
+@app.route('/box_eval/sweep')
+def box_sweep_view():
+    result, err = None, None
+    try:
+        params, grid = sweep_params(request.args)
+    except ValueError as e:
+        params, grid, err = dict(SWEEP_DEFAULTS), None, str(e)
+    race_id = request.args.get('race_id', type=int)
+    if grid and request.args.get('run'):
+        try:
+            if not race_id:
+                conn = get_mysql_conn()
+                try: race_id = get_current_race_id(conn)
+                finally: conn.close()
+            result = run_box_sweep(grid, race_id, params['win_min'])
+        except Exception as e:
+            err = str(e)
+            box_logger.error('box_sweep error: %s', err)
+    return render_template('box_sweep.html', app_title=APP_TITLE, params=params, result=result, err=err,
+                           race_id=race_id, windows=WINDOWS_MIN, n_ranges=len(grid) if grid else 0)
+
+# ---------------------- JSON API (ETag + gzip) ----------------------
+GZIP_MIN_BYTES = 512
+
+
+RACE_VERSION_SQL = """
+    SELECT COUNT(*), COALESCE(SUM(laps_completed), 0),
+           COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', racer_id, position, laps_completed, total_time,
+                                             best_lap_time, last_lap_time))), 0)
+    FROM competitors WHERE race_id=%s
+"""
+
+def get_race_version(conn, race_id):
+    """
+    Versão barata dos dados da corrida (1 query em competitors): muda quando chega volta ou atualização.
+    Checksum das colunas exibidas em vez de MAX(updated_at), que tem resolução de segundo: dois flushes no
+    mesmo segundo que só trocam posições dariam o mesmo ETag (304 com dado velho).
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(RACE_VERSION_SQL, (race_id,))
+        count, laps, checksum = cur.fetchone()
+        # A classificação ao vivo é gravada pelo ingest antes do commit em competitors: entra pela mtime
+        return f"{count}:{laps}:{checksum}:{standings_version(race_id)}"
+    finally:
+        cur.close()
+
+
+def get_racer_laps_version(conn, race_id, racer_id):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COUNT(*), COALESCE(MAX(lap_number), 0) FROM competitor_laps WHERE race_id=%s AND racer_id=%s", (race_id, racer_id))
+        count, max_lap = cur.fetchone()
+        return f"{count}:{max_lap}"
+    finally:
+        cur.close()
+
+
+def _json_default(o):
+    if isinstance(o, Decimal): return float(o)
+    if isinstance(o, datetime): return o.isoformat()
+    return str(o)
+
+
+def cached_json(version_parts, build_payload):
+    """
+    Responde JSON com ETag derivado da versão dos dados + parâmetros da requisição.
+    If-None-Match igual → 304 sem montar o corpo; corpo grande + Accept-Encoding gzip → comprimido.
+    """
+    etag = hashlib.sha1(repr((request.path, sorted(request.args.items()), version_parts)).encode('utf-8')).hexdigest()[:24]
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        body = json.dumps(build_payload(), default=_json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        resp = Response(body, mimetype='application/json')
+        if len(body) >= GZIP_MIN_BYTES and 'gzip' in (request.headers.get('Accept-Encoding') or '').lower():
+            resp.set_data(gzip.compress(body, compresslevel=6))
+            resp.headers['Content-Encoding'] = 'gzip'
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+def _api_conn_and_race():
+    if get_mysql_conn is None:
+        return None, None, (jsonify({'error': 'db_config não carregado'}), 503)
+    try:
+        conn = get_mysql_conn()
+    except Exception as e:
+        return None, None, (jsonify({'error': f'Falha ao conectar ao MySQL: {e}'}), 503)
+    race_id = request.args.get('race_id', type=int) or get_current_race_id(conn)
+    if not race_id:
+        conn.close()
+        return None, None, (jsonify({'error': 'Nenhum race_id encontrado'}), 404)
+    return conn, race_id, None
+
+
+@app.route('/api/standings')
+def api_standings():
+    conn, race_id, err = _api_conn_and_race()
+    if err: return err
+    try:
+        version = get_race_version(conn, race_id)
+
+        def payload():
+            basics = fetch_competitors_basic(conn, race_id)
+            stats = race_kart_stats(conn, race_id)
+            live = read_standings(race_id)
+            rows = []
+            for rid, b in basics.items():
+                m = stats.get(rid) or {}
+                rows.append({
+                    'racer_id': rid, 'number': b['number'], 'first_name': b['first_name'], 'last_name': b['last_name'],
+                    'position': b['position'], 'max_lap': m.get('max_lap'),
+                    'last_lap_ms': m.get('last_lap_ms', b['last_lap_ms']), 'last_laps_ms': m.get('last_laps', []),
+                    'avg5_ms': m.get('avg5_ms'), 'avg10_ms': m.get('avg10_ms'), 'stddev10_ms': m.get('stddev10_ms'),
+                    'best_lap_ms': m.get('best_lap_ms'), 'best_stint_ms': m.get('best_stint_ms'),
+                    'trend_ms_per_lap': m.get('trend_ms_per_lap'),
+                    'gap_ms': (live.get(rid) or {}).get('gap_ms'), 'interval_ms': (live.get(rid) or {}).get('interval_ms'),
+                    'laps_down': (live.get(rid) or {}).get('laps_down'),
+                    'gap_trend_ms_per_lap': (live.get(rid) or {}).get('gap_trend_ms_per_lap'),
+                })
+            rows.sort(key=lambda r: (r['position'] or 999999, r['racer_id']))
+            return {'race_id': race_id, 'version': version, 'global_avg_ms': stats.mean_last_lap(max_ms=120000), 'standings': rows}
+
+        return cached_json(version, payload)
+    finally:
+        conn.close()
+
+
+@app.route('/api/racers/<int:racer_id>/laps')
+def api_racer_laps(racer_id):
+    """Voltas do racer com lap_number > since (delta para quem já tem as anteriores)."""
+    conn, race_id, err = _api_conn_and_race()
+    if err: return err
+    since = request.args.get('since', 0, type=int)
+    try:
+        version = get_racer_laps_version(conn, race_id, racer_id)
+
+        def payload():
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT lap_number, position, lap_time, flag_status, total_time
+                    FROM competitor_laps
+                    WHERE race_id=%s AND racer_id=%s AND lap_number > %s
+                    ORDER BY lap_number ASC
+                """, (race_id, racer_id, since))
+                laps = [{'lap_number': n, 'position': pos, 'lap_time': lt, 'lap_ms': parse_ms(lt),
+                         'flag_status': fs, 'total_time': tt, 'total_ms': parse_ms(tt)}
+                        for n, pos, lt, fs, tt in cur.fetchall()]
+            finally:
+                cur.close()
+            return {'race_id': race_id, 'racer_id': racer_id, 'since': since, 'version': version,
+                    'last_lap_number': laps[-1]['lap_number'] if laps else since, 'laps': laps}
+
+        return cached_json(version, payload)
+    finally:
+        conn.close()
+
+
+@app.route('/api/box_eval')
+def api_box_eval():
+    """Resultados de sp_kart_box_ranking/summary. Parâmetros: choice=opt_230_250|opt_two_windows ou pit_min/pit_max[/pit_min2/pit_max2]."""
+    try:
+        intervals = intervals_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    conn, race_id, err = _api_conn_and_race()
+    if err: return err
+    try:
+        version = get_race_version(conn, race_id)
+    finally:
+        conn.close()
+
+    def payload():
+        results = run_both_procs_for_intervals(intervals, race_id)
+        return {
+            'race_id': race_id, 'version': version, 'intervals': intervals,
+            **{kind: [{'interval': label, 'columns': cols, 'rows': [list(r) for r in rows]} for cols, rows, label in sets]
+               for kind, sets in results.items()},
+        }
+
+    return cached_json(version, payload)
+
+@app.route('/api/box_eval/sweep')
+def api_box_sweep():
+    """Varredura de faixas de box (heatmap). Parâmetros: min_from, min_to, max_from, max_to, step, win_min."""
+    try:
+        params, grid = sweep_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    conn, race_id, err = _api_conn_and_race()
+    if err: return err
+    try:
+        version = get_race_version(conn, race_id)
+    finally:
+        conn.close()
+    return cached_json(version, lambda: {'race_id': race_id, 'version': version, **params,
+                                         **run_box_sweep(grid, race_id, params['win_min'])})
+
+@app.route('/export/laps.<fmt>')
+def export_laps(fmt):
+    """Voltas da corrida (ou de um racer) em CSV ou colunar .mkc, em streaming (memória constante)."""
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    racer_id = request.args.get('racer_id', type=int)
+    conn, race_id, err = _api_conn_and_race()
+    if err: return err
+    mimetype = EXPORT_FORMATS[fmt][0]
+    # Sem Content-Length: o werkzeug responde com Transfer-Encoding: chunked, um pedaço por bloco lido
+    resp = Response(stream_with_context(stream_export(conn, race_id, racer_id, fmt)), mimetype=mimetype)
+    # Fecha no fim da resposta mesmo se o corpo nunca for iterado (cliente abortou, HEAD)
+    resp.call_on_close(conn.close)
+    resp.headers['Content-Disposition'] = f'attachment; filename="{export_filename(race_id, racer_id, fmt)}"'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
 # ---------------------- Logs viewer ----------------------
 @app.route('/box_eval/logs')
 def box_eval_logs():
     lines = int(request.args.get('lines', 300))
-    log_path = os.path.join(LOGS_DIR, 'box_eval.log')
-    content = ''
+    content = read_log_tail(BOX_LOG_FILE, lines)
+    return render_template('box_eval_logs.html', app_title=APP_TITLE, log_content=content, log_path=BOX_LOG_FILE, lines=lines)
+
+# ---------------------- Slow queries ----------------------
+@app.route('/slow_queries')
+def slow_queries_view():
+    """Últimas queries lentas (slow_query.log) + resumo por nome de query."""
+    lines = request.args.get('lines', 500, type=int)
+    name_filter = request.args.get('name', '').strip()
+    entries = []
     try:
-        if os.path.exists(log_path):
-            with open(log_path, 'r', encoding='utf-8') as f:
-                content = ''.join(f.readlines()[-lines:])
-        else:
-            content = 'Arquivo de log não encontrado: ' + log_path
-    except Exception as e:
-        content = 'Erro ao ler log: ' + str(e)
-    return render_template('box_eval_logs.html', app_title=APP_TITLE, log_content=content, log_path=log_path, lines=lines)
+        for line in tail_lines(SLOW_QUERY_FILE, lines):
+            try: e = json.loads(line)
+            except ValueError: continue
+            if name_filter and e.get('name') != name_filter: continue
+            entries.append(e)
+    except FileNotFoundError:
+        pass
+    summary = {}
+    for e in entries:
+        s_ = summary.setdefault(e.get('name') or '?', {'name': e.get('name') or '?', 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        ms = float(e.get('elapsed_ms') or 0)
+        s_['count'] += 1; s_['total_ms'] += ms; s_['max_ms'] = max(s_['max_ms'], ms)
+    summary = sorted(summary.values(), key=lambda r: r['total_ms'], reverse=True)
+    entries.reverse()  # mais recentes primeiro
+    return render_template('slow_queries.html', app_title=APP_TITLE, entries=entries[:200], summary=summary,
+                           log_path=SLOW_QUERY_FILE, threshold_ms=SLOW_QUERY_MS, lines=lines, name_filter=name_filter)
+
+# ---------------------- Histórico de karts ----------------------
+@app.route('/karts')
+def karts_view():
+    """Agregados entre corridas (kart_race_stats): ranking por número/piloto e histórico de um deles."""
+    kind = request.args.get('kind', 'number')
+    if kind not in KART_KINDS: kind = 'number'
+    key = request.args.get('key', '').strip()
+    min_laps = request.args.get('min_laps', 50, type=int)
+    ranking, history = [], None
+    conn = _conn_or_flash()
+    if conn:
+        try:
+            ranking = kart_ranking(conn, kind, min_laps)
+            if key:
+                history = kart_history(conn, kind, key)
+                if history is None: flash(f'Sem agregados para {key}')
+        except Exception as e:
+            flash(f'Erro ao consultar agregados: {e}')
+            boot_logger.error('karts_view error: %s', e)
+        finally:
+            conn.close()
+    return render_template('karts.html', app_title=APP_TITLE, kind=kind, key=key, min_laps=min_laps,
+                           kinds=KART_KINDS, ranking=ranking, history=history)
+
+@app.route('/api/karts/<kind>/<path:key>')
+def api_kart_history(kind, key):
+    if kind not in KART_KINDS:
+        return jsonify({'error': f"kind inválido (use {', '.join(KART_KINDS)})"}), 400
+    conn = _conn_or_flash()
+    if conn is None:
+        return jsonify({'error': 'sem conexão com DB'}), 503
+    try:
+        history = kart_history(conn, kind, key)
+    finally:
+        conn.close()
+    if history is None:
+        return jsonify({'error': 'sem agregados'}), 404
+    return Response(json.dumps(history, default=_json_default), mimetype='application/json')
+
+# ---------------------- Perfis ----------------------
+@app.route('/profiles')
+def profiles_view():
+    profiles = list_profiles(limit=request.args.get('limit', 50, type=int))
+    return render_template('profiles.html', app_title=APP_TITLE, profiles=profiles,
+                           targets=sorted(PROFILE_TARGETS), profile_dir=PROFILE_DIR, selected=None, hotspots=[])
+
+@app.route('/profiles/<name>')
+def profile_detail(name):
+    path = profile_path(name)
+    if not path: abort(404)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'ncalls'): sort = 'cumulative'
+    return render_template('profiles.html', app_title=APP_TITLE, profiles=list_profiles(limit=50),
+                           targets=sorted(PROFILE_TARGETS), profile_dir=PROFILE_DIR, selected=name, sort=sort,
+                           hotspots=top_hotspots(path, n=request.args.get('top', 30, type=int), sort=sort))
 
 # ---------------------- Config ----------------------
 @app.route('/config')
 def config():
-    return render_template('config.html', app_title=APP_TITLE, scheduler_status=sched.status())
+    return render_template('config.html', app_title=APP_TITLE, scheduler_status=sched.status(),
+                           purge_status=purge_status())
 
 # Utils scripts
 
-def run_script(path, args=None):
+def run_script(path, args=None, timeout=120):
     cmd = ['/usr/bin/python3', path]
     if args: cmd.extend(args)
-    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
     return proc.returncode, proc.stdout, proc.stderr
 
+# PURGE pode levar minutos: roda numa thread do worker, fora da requisição. O status vai para PURGE_STATUS_FILE
+# (lido por qualquer worker em /actions/cleanup/status) e o flock de PURGE_LOCK_FILE impede dois purges ao mesmo
+# tempo. O fd do lock é herdado pelo cleanup_tables.py: se o worker morre, o lock continua até o script terminar.
+PURGE_LOCK_FILE = os.path.join(SCHED_DIR, 'purge.lock')
+PURGE_STATUS_FILE = os.path.join(SCHED_DIR, 'purge_status.json')
+PURGE_TIMEOUT_S = 3600
+PURGE_OUTPUT_CHARS = 4000  # fim do stdout/stderr guardado no status
+
+def _purge_lock():
+    """fd com o flock do purge, ou None se outro purge está rodando."""
+    fd = os.open(PURGE_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+def _purge_unlock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+def _run_purge(fd, args, state):
+    try:
+        try:
+            proc = subprocess.run(['/usr/bin/python3', CLEANUP_SCRIPT] + args, capture_output=True, text=True,
+                                  timeout=PURGE_TIMEOUT_S, pass_fds=(fd,))
+            code, out, err = proc.returncode, proc.stdout, proc.stderr
+        except Exception as e:
+            code, out, err = None, '', str(e)
+        state.update(running=False, finished_at=datetime.now().isoformat(), returncode=code,
+                     stdout=out[-PURGE_OUTPUT_CHARS:], stderr=err[-PURGE_OUTPUT_CHARS:])
+        _write_json(PURGE_STATUS_FILE, state)
+    except Exception as e:
+        boot_logger.error('purge error: %s', e)
+    finally:
+        _purge_unlock(fd)
+
+def start_purge(args):
+    """Dispara o cleanup_tables.py --method purge em background. False se já há um purge rodando."""
+    fd = _purge_lock()
+    if fd is None:
+        return False
+    try:
+        state = {'running': True, 'pid': os.getpid(), 'args': args, 'started_at': datetime.now().isoformat(),
+                 'finished_at': None, 'returncode': None, 'stdout': '', 'stderr': ''}
+        _write_json(PURGE_STATUS_FILE, state)
+        threading.Thread(target=_run_purge, args=(fd, args, state), daemon=True).start()
+    except Exception:
+        _purge_unlock(fd)
+        raise
+    return True
+
+def purge_status():
+    state = _read_json(PURGE_STATUS_FILE)
+    if state.get('running'):
+        fd = _purge_lock()
+        if fd is not None:  # ninguém segura o lock: o processo que rodava o purge morreu
+            _purge_unlock(fd)
+            state.update(running=False, interrupted=True)
+    return state
+
 @app.route('/actions/cleanup', methods=['POST'])
 def action_cleanup():
     method = request.form.get('method', 'truncate')
@@ -542,12 +1032,31 @@ def action_cleanup():
     if only_comp: args.append('--only-competitors')
     if only_laps: args.append('--only-laps')
     if dry_run: args.append('--dry-run')
+    if method == 'purge':
+        race_id = request.form.get('race_id', type=int)
+        older_than_days = request.form.get('older_than_days', type=int)
+        batch_size = request.form.get('batch_size', type=int)
+        if not race_id and older_than_days is None:
+            flash('PURGE exige race_id e/ou "mais antigas que N dias".')
+            return redirect(url_for('config'))
+        if race_id: args.extend(['--race-id', str(race_id)])
+        if older_than_days is not None: args.extend(['--older-than-days', str(older_than_days)])
+        if batch_size: args.extend(['--batch-size', str(batch_size)])
+        if start_purge(args):
+            flash('PURGE iniciado em background; acompanhe o status abaixo.')
+        else:
+            flash('Já existe um PURGE em andamento.')
+        return redirect(url_for('config'))
     code, out, err = run_script(CLEANUP_SCRIPT, args)
     flash(f"cleanup_tables.py retornou {code}")
     if out: flash(out)
     if err: flash(err)
     return redirect(url_for('config'))
 
+@app.route('/actions/cleanup/status')
+def action_cleanup_status():
+    return jsonify(purge_status())
+
 @app.route('/actions/populate', methods=['POST'])
 def action_populate():
     code, out, err = run_script(POPULATE_SCRIPT)
@@ -577,10 +1086,30 @@ def scheduler_status():
 
 # ---------------------- Grupos/Logs/app_config ----------------------
 
-def query_group(table_name):
+def fetch_active_races(conn):
+    """race_ids acompanhados (com chave em app_config), via cache."""
+    try:
+        return app_config_cache.active_race_ids(conn)
+    except Exception as e:
+        boot_logger.error('fetch_active_races error: %s', e)
+        return []
+
+
+def _group_race_id(conn=None):
+    """race_id do grupo: parâmetro da requisição ou corrida atual do app_config."""
+    race_id = request.values.get('race_id', type=int)
+    if race_id: return race_id
+    own = conn is None
+    conn = conn or _conn_or_flash()
+    if not conn: return None
+    try: return get_current_race_id(conn)
+    finally:
+        if own: conn.close()
+
+def query_group(table_name, race_id):
     conn = _conn_or_flash()
     if not conn: return []
-    cur = conn.cursor(); cur.execute(f"SELECT racer_id, COALESCE(last_update, 'NULL') FROM {table_name} ORDER BY racer_id ASC")
+    cur = conn.cursor(); cur.execute(f"SELECT racer_id, COALESCE(last_update, 'NULL') FROM {table_name} WHERE race_id = %s ORDER BY racer_id ASC", (race_id,))
     rows = cur.fetchall(); cur.close(); conn.close(); return rows
 
 @app.route('/groups/<group_name>')
@@ -588,85 +1117,162 @@ def groups_view(group_name):
     table_map = {'2min': 'update_group_2min', '4min': 'update_group_4min', 'rest': 'update_group_rest'}
     if group_name not in table_map:
         flash('Grupo inválido'); return redirect(url_for('config'))
-    rows = query_group(table_map[group_name])
-    return render_template('groups.html', app_title=APP_TITLE, group_name=group_name, rows=rows)
+    race_id = _group_race_id()
+    rows = query_group(table_map[group_name], race_id) if race_id else []
+    conn = _conn_or_flash(); active_races = fetch_active_races(conn) if conn else []
+    if conn: conn.close()
+    return render_template('groups.html', app_title=APP_TITLE, group_name=group_name, rows=rows,
+                           race_id=race_id, active_races=active_races)
 
 from db_config import get_mysql_conn as _get_conn
 
-def add_to_group(table_name, racer_id):
+def add_to_group(table_name, race_id, racer_id):
     conn = _get_conn(); cur = conn.cursor()
-    cur.execute(f"INSERT IGNORE INTO {table_name} (racer_id, last_update) VALUES (%s, NULL)", (int(racer_id),))
+    cur.execute(f"INSERT IGNORE INTO {table_name} (race_id, racer_id, last_update) VALUES (%s, %s, NULL)", (int(race_id), int(racer_id)))
     conn.commit(); cur.close(); conn.close()
 
 @app.route('/groups/<group_name>/add', methods=['POST'])
 def groups_add(group_name):
     table_map = {'2min': 'update_group_2min', '4min': 'update_group_4min', 'rest': 'update_group_rest'}
     racer_id = request.form.get('racer_id', type=int)
-    if group_name in table_map and racer_id:
-        add_to_group(table_map[group_name], racer_id)
-        flash(f"Adicionado {racer_id} ao grupo {group_name}")
+    race_id = _group_race_id()
+    if group_name in table_map and racer_id and race_id:
+        add_to_group(table_map[group_name], race_id, racer_id)
+        flash(f"Adicionado {racer_id} ao grupo {group_name} (race_id={race_id})")
     else:
         flash("Parâmetros inválidos")
-    return redirect(url_for('groups_view', group_name=group_name))
+    return redirect(url_for('groups_view', group_name=group_name, race_id=race_id))
 
 
-def remove_from_group(table_name, racer_id):
+def remove_from_group(table_name, race_id, racer_id):
     conn = _get_conn(); cur = conn.cursor()
-    cur.execute(f"DELETE FROM {table_name} WHERE racer_id = %s", (int(racer_id),))
+    cur.execute(f"DELETE FROM {table_name} WHERE race_id = %s AND racer_id = %s", (int(race_id), int(racer_id)))
     conn.commit(); cur.close(); conn.close()
 
 @app.route('/groups/<group_name>/remove', methods=['POST'])
 def groups_remove(group_name):
     table_map = {'2min': 'update_group_2min', '4min': 'update_group_4min', 'rest': 'update_group_rest'}
     racer_id = request.form.get('racer_id', type=int)
-    if group_name in table_map and racer_id:
-        remove_from_group(table_map[group_name], racer_id)
-        flash(f"Removido {racer_id} do grupo {group_name}")
+    race_id = _group_race_id()
+    if group_name in table_map and racer_id and race_id:
+        remove_from_group(table_map[group_name], race_id, racer_id)
+        flash(f"Removido {racer_id} do grupo {group_name} (race_id={race_id})")
     else:
         flash("Parâmetros inválidos")
-    return redirect(url_for('groups_view', group_name=group_name))
+    return redirect(url_for('groups_view', group_name=group_name, race_id=race_id))
 
 
-def set_group_time(table_name, racer_id, to_now=True):
+def set_group_time(table_name, race_id, racer_id, to_now=True):
     conn = _get_conn(); cur = conn.cursor()
-    if to_now: cur.execute(f"UPDATE {table_name} SET last_update = NOW() WHERE racer_id = %s", (int(racer_id),))
-    else: cur.execute(f"UPDATE {table_name} SET last_update = NULL WHERE racer_id = %s", (int(racer_id),))
+    if to_now: cur.execute(f"UPDATE {table_name} SET last_update = NOW() WHERE race_id = %s AND racer_id = %s", (int(race_id), int(racer_id)))
+    else: cur.execute(f"UPDATE {table_name} SET last_update = NULL WHERE race_id = %s AND racer_id = %s", (int(race_id), int(racer_id)))
     conn.commit(); cur.close(); conn.close()
 
 @app.route('/groups/<group_name>/touch', methods=['POST'])
 def groups_touch(group_name):
     table_map = {'2min': 'update_group_2min', '4min': 'update_group_4min', 'rest': 'update_group_rest'}
     racer_id = request.form.get('racer_id', type=int)
+    race_id = _group_race_id()
     action = request.form.get('action', 'now')
-    if group_name in table_map and racer_id:
-        set_group_time(table_map[group_name], racer_id, to_now=(action == 'now'))
-        flash(f"Atualizado last_update de {racer_id} ({action}) no grupo {group_name}")
+    if group_name in table_map and racer_id and race_id:
+        set_group_time(table_map[group_name], race_id, racer_id, to_now=(action == 'now'))
+        flash(f"Atualizado last_update de {racer_id} ({action}) no grupo {group_name} (race_id={race_id})")
     else:
         flash("Parâmetros inválidos")
-    return redirect(url_for('groups_view', group_name=group_name))
+    return redirect(url_for('groups_view', group_name=group_name, race_id=race_id))
+
+def read_log_tail(path, lines):
+    try:
+        if os.path.exists(path):
+            return ''.join(tail_lines(path, lines))
+        return f"Arquivo de log não encontrado: {path}"
+    except Exception as e:
+        return f"Erro ao ler log: {e}"
 
 @app.route('/logs')
 def logs_view():
     lines = int(request.args.get('lines', 200))
-    content = ""
+    content = read_log_tail(RACE_LOG_FILE, lines)
+    return render_template('logs.html', app_title=APP_TITLE, log_content=content, log_path=RACE_LOG_FILE, lines=lines)
+
+@app.route('/logs/<log_name>/follow')
+def logs_follow(log_name):
+    """Stream (text/event-stream) das novas linhas do log, para o modo 'Acompanhar'."""
+    path = LOG_FILES.get(log_name)
+    if not path:
+        return jsonify({'error': 'log inválido'}), 404
+
+    def gen():
+        for line in follow_lines(path, max_seconds=FOLLOW_MAX_SECONDS):
+            if line is None:
+                yield ': ping\n\n'
+            else:
+                yield f"data: {line.rstrip()}\n\n"
+
+    return Response(stream_with_context(gen()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/logs/<log_name>/search')
+def logs_search(log_name):
+    path = LOG_FILES.get(log_name)
+    if not path:
+        flash('Log inválido'); return redirect(url_for('logs_view'))
+    racer_id = request.args.get('racer_id', type=int)
+    start = (request.args.get('start') or '').strip()
+    end = (request.args.get('end') or '').strip()
+    limit = request.args.get('limit', 500, type=int)
     try:
-        if os.path.exists(RACE_LOG_FILE):
-            with open(RACE_LOG_FILE, 'r', encoding='utf-8') as f:
-                data = f.readlines()
-            content = ''.join(data[-lines:])
-        else:
-            content = f"Arquivo de log não encontrado: {RACE_LOG_FILE}"
+        matches = search_logs(path, racer_id=racer_id, start=start or None, end=end or None, limit=limit)
+        content = ''.join(f"[{fname}] {line}" for fname, line in matches) or 'Nenhuma linha encontrada.'
     except Exception as e:
-        content = f"Erro ao ler log: {e}"
-    return render_template('logs.html', app_title=APP_TITLE, log_content=content, log_path=RACE_LOG_FILE, lines=lines)
+        content = f"Erro na busca: {e}"
+    template = 'box_eval_logs.html' if log_name == 'box_eval' else 'logs.html'
+    return render_template(template, app_title=APP_TITLE, log_content=content, log_path=path,
+                           lines=request.args.get('lines', 200, type=int),
+                           racer_id=racer_id, start=start, end=end, searching=True)
 
 @app.route('/config/app_config')
 def app_config_list():
-    conn = _conn_or_flash(); rows = []
+    conn = _conn_or_flash(); rows = []; health = []
     if conn:
         cur = conn.cursor(); cur.execute("SELECT id, api_token, race_id FROM app_config ORDER BY id ASC")
-        rows = cur.fetchall(); cur.close(); conn.close()
-    return render_template('app_config.html', app_title=APP_TITLE, rows=rows)
+        rows = cur.fetchall(); cur.close()
+        try: health = key_metrics(conn)
+        except Exception as e: boot_logger.error('key_metrics error: %s', e)
+        conn.close()
+    return render_template('app_config.html', app_title=APP_TITLE, rows=rows, health=health)
+
+def _invalidate_app_config():
+    """Após editar app_config: este processo relê já; os demais percebem pelo updated_at."""
+    if app_config_cache is not None:
+        app_config_cache.invalidate()
+
+@app.route('/config/app_config/reset_breaker', methods=['POST'])
+def app_config_reset_breaker():
+    """Devolve a chave ao rodízio (fecha o circuit breaker manualmente)."""
+    id_ = request.form.get('id', type=int)
+    conn = _conn_or_flash()
+    if not conn or not id_:
+        return redirect(url_for('app_config_list'))
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE app_config SET fail_count = 0, breaker_open_until = NULL WHERE id = %s", (id_,))
+        conn.commit(); cur.close()
+        flash(f"Breaker da chave {id_} fechado")
+    finally:
+        conn.close()
+    return redirect(url_for('app_config_list'))
+
+@app.route('/api/keys/health')
+def api_keys_health():
+    """Métricas por chave (erros, breaker aberto) em JSON, para monitoração externa."""
+    conn = _conn_or_flash()
+    if conn is None:
+        return jsonify({'error': 'sem conexão com DB'}), 503
+    try:
+        return Response(json.dumps({'keys': key_metrics(conn)}, default=_json_default), mimetype='application/json')
+    finally:
+        conn.close()
 
 @app.route('/config/app_config/add', methods=['POST'])
 def app_config_add():
@@ -680,8 +1286,10 @@ def app_config_add():
         flash('Sem conexão com DB'); return redirect(url_for('app_config_list'))
     cur = conn.cursor()
     try:
+        # Partição antes do INSERT: o ALTER faz commit implícito e, se falhar, nada é gravado
+        ensure_race_partition(conn, race_id)
         cur.execute("INSERT INTO app_config (id, api_token, race_id, last_used, updated_at) VALUES (%s, %s, %s, NULL, NOW())", (id_, token, race_id))
-        conn.commit(); flash("Registro criado")
+        conn.commit(); _invalidate_app_config(); flash("Registro criado")
     except Exception as e:
         conn.rollback(); flash(f"Erro ao criar: {e}")
     finally:
@@ -700,8 +1308,9 @@ def app_config_update():
         flash('Sem conexão com DB'); return redirect(url_for('app_config_list'))
     cur = conn.cursor()
     try:
+        if race_id: ensure_race_partition(conn, race_id)
         cur.execute("UPDATE app_config SET api_token=%s, race_id=%s, updated_at=NOW() WHERE id=%s", (token, race_id, id_))
-        conn.commit(); flash("Registro atualizado")
+        conn.commit(); _invalidate_app_config(); flash("Registro atualizado")
     except Exception as e:
         conn.rollback(); flash(f"Erro ao atualizar: {e}")
     finally:
@@ -717,7 +1326,7 @@ def app_config_delete():
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM app_config WHERE id=%s", (id_,))
-        conn.commit(); flash("Registro removido")
+        conn.commit(); _invalidate_app_config(); flash("Registro removido")
     except Exception as e:
         conn.rollback(); flash(f"Erro ao remover: {e}")
     finally:
@@ -725,7 +1334,66 @@ def app_config_delete():
     return redirect(url_for('app_config_list'))
 
 # ---------------------- Run ----------------------
+def serve_prefork(host, port, workers):
+    """
+    Produção: N processos web no mesmo socket (pré-fork, o kernel distribui as conexões).
+    Cada filho é um servidor werkzeug com threads; o pai só supervisiona e recria filhos que morrem.
+    O scheduler continua único: os filhos disputam a liderança (SchedulerManager).
+    """
+    from werkzeug.serving import make_server
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            sched.ensure_candidate()
+            threading.Thread(target=warm_lap_store, daemon=True).start()
+            make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+            os._exit(0)
+        children.add(pid)
+
+    def terminate(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for _ in range(workers):
+        spawn()
+    boot_logger.info('Serving on %s:%s with %s worker processes (master pid %s)', host, port, workers, os.getpid())
+    while children:
+        try:
+            pid, code = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            boot_logger.warning('Worker %s saiu (status %s); recriando', pid, code)
+            spawn()
+
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    boot_logger.info('Running Flask on 0.0.0.0:%s', port)
-    app.run(host='0.0.0.0', port=port)
+    parser = argparse.ArgumentParser(description=APP_TITLE)
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 1)),
+                        help='Processos web (>1 = modo produção pré-fork; o scheduler roda só no líder).')
+    args = parser.parse_args()
+    if args.workers > 1:
+        serve_prefork('0.0.0.0', args.port, args.workers)
+    else:
+        sched.ensure_candidate()
+        threading.Thread(target=warm_lap_store, daemon=True).start()
+        boot_logger.info('Running Flask on 0.0.0.0:%s', args.port)
+        app.run(host='0.0.0.0', port=args.port)
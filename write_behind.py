@@ -0,0 +1,169 @@
+
+import os
+import time
+
+from kart_aggregates import refresh_touched
+from race_archive import prepare_race_partitions
+
+# ====================== CONFIG ======================
+# sync  = grava e faz commit a cada competidor (comportamento original, nada fica só em memória)
+# batch = acumula competidores/voltas de vários fetches e grava em upserts multi-linha,
+#         com commit quando atinge WRITE_MAX_ROWS linhas ou WRITE_MAX_AGE_S segundos (e no close)
+WRITE_DURABILITY = os.environ.get("MYKART_WRITE_DURABILITY", "batch")
+WRITE_MAX_ROWS = int(os.environ.get("MYKART_WRITE_MAX_ROWS", 2000))
+WRITE_MAX_AGE_S = float(os.environ.get("MYKART_WRITE_MAX_AGE_S", 5.0))
+DURABILITY_MODES = ("sync", "batch")
+
+COMPETITOR_COLUMNS = (
+    "racer_id", "race_id", "number", "transponder", "first_name", "last_name",
+    "nationality", "additional_data", "class_id", "position", "laps_completed",
+    "total_time", "best_position", "best_lap", "best_lap_time", "last_lap_time",
+)
+
+_ROW_PLACEHOLDERS = "(" + ", ".join(["%s"] * len(COMPETITOR_COLUMNS)) + ", NOW())"
+
+UPSERT_COMPETITORS_SQL = f"""
+    INSERT INTO competitors ({", ".join(COMPETITOR_COLUMNS)}, updated_at)
+    VALUES {{values}}
+    ON DUPLICATE KEY UPDATE
+        position=VALUES(position), laps_completed=VALUES(laps_completed),
+        total_time=VALUES(total_time), best_position=VALUES(best_position),
+        best_lap=VALUES(best_lap), best_lap_time=VALUES(best_lap_time),
+        last_lap_time=VALUES(last_lap_time), updated_at=NOW()
+"""
+
+INSERT_LAPS_SQL = """
+    INSERT IGNORE INTO competitor_laps
+    (race_id, racer_id, lap_number, position, lap_time, flag_status, total_time)
+    VALUES (%s,%s,%s,%s,%s,%s,%s)
+"""
+
+def upsert_competitors(cur, rows):
+    """
+    Upsert multi-linha explícito: o executemany do mysql.connector só reescreve para
+    multi-linha quando VALUES tem apenas placeholders (aqui há NOW()).
+    """
+    for i in range(0, len(rows), WRITE_MAX_ROWS):
+        chunk = rows[i:i + WRITE_MAX_ROWS]
+        sql = UPSERT_COMPETITORS_SQL.format(values=", ".join([_ROW_PLACEHOLDERS] * len(chunk)))
+        cur.execute(sql, [v for row in chunk for v in row])
+
+class WriteBehindBuffer:
+    """
+    Buffer de escrita para competitors/competitor_laps compartilhado entre vários fetches.
+
+    No modo 'batch', cada flush grava todos os competidores pendentes num único upsert
+    multi-linha, as voltas por corrida num executemany multi-linha (partições criadas antes da transação)
+    e faz UM commit.
+    Competidor repetido no mesmo flush: vale a última linha recebida.
+    Callbacks registrados com after_flush() rodam só depois do commit (ex.: liberar o lease).
+    """
+
+    def __init__(self, conn, durability=WRITE_DURABILITY, max_rows=WRITE_MAX_ROWS, max_age_s=WRITE_MAX_AGE_S):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Durabilidade inválida: {durability} (use {', '.join(DURABILITY_MODES)})")
+        self.conn = conn
+        self.durability = durability
+        self.max_rows = max_rows
+        self.max_age_s = max_age_s
+        self._competitors = {}  # (race_id, racer_id) -> valores na ordem de COMPETITOR_COLUMNS
+        self._laps = {}         # race_id -> [linhas de INSERT_LAPS_SQL]
+        self._callbacks = []
+        self._pending_rows = 0
+        self._first_pending = None
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.laps_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.rollback()
+        return False
+
+    def _touch(self, rows):
+        self._pending_rows += rows
+        if self._first_pending is None:
+            self._first_pending = time.monotonic()
+        return self.maybe_flush()
+
+    def add_competitor(self, values, lap_rows=()):
+        """
+        values: tupla na ordem de COMPETITOR_COLUMNS; lap_rows: voltas do mesmo competidor
+        (race_id, racer_id, lap_number, position, lap_time, flag_status, total_time).
+        Retorna as voltas novas gravadas se isto disparou um flush, senão None.
+        """
+        race_id = values[1]
+        self._competitors[(race_id, values[0])] = tuple(values)
+        if lap_rows:
+            self._laps.setdefault(race_id, []).extend(lap_rows)
+        return self._touch(1 + len(lap_rows))
+
+    def add_laps(self, race_id, rows):
+        """Voltas avulsas (ex.: lotes do modo streaming). Retorno igual a add_competitor."""
+        if not rows:
+            return None
+        self._laps.setdefault(race_id, []).extend(rows)
+        return self._touch(len(rows))
+
+    def after_flush(self, callback):
+        """Executa callback() depois do próximo commit (imediatamente se não há nada pendente)."""
+        if not self._pending_rows:
+            callback()
+            return
+        self._callbacks.append(callback)
+
+    def due(self):
+        if not self._pending_rows:
+            return False
+        if self.durability == "sync" or self._pending_rows >= self.max_rows:
+            return True
+        return time.monotonic() - self._first_pending >= self.max_age_s
+
+    def maybe_flush(self):
+        if self.due():
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Grava tudo que está pendente numa única transação. Retorna as voltas novas gravadas."""
+        if not self._pending_rows:
+            return 0
+        # ALTER TABLE ... ADD PARTITION faz commit implícito: cria as partições antes da transação
+        prepare_race_partitions(self.conn, self._laps)
+        cur = self.conn.cursor()
+        written = 0
+        touched = {}  # race_id -> linhas enviadas, com duplicadas (delta dos agregados entre corridas)
+        try:
+            if self._competitors:
+                upsert_competitors(cur, list(self._competitors.values()))
+            for race_id, rows in self._laps.items():
+                cur.executemany(INSERT_LAPS_SQL, rows)
+                if cur.rowcount > 0:
+                    written += cur.rowcount
+                    touched[race_id] = rows
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        self.flushes += 1
+        self.rows_flushed += self._pending_rows
+        self.laps_written += written
+        callbacks = self._callbacks
+        self._competitors, self._laps, self._callbacks = {}, {}, []
+        self._pending_rows = 0
+        self._first_pending = None
+        refresh_touched(self.conn, touched)
+        for callback in callbacks:
+            callback()
+        return written
+
+    def close(self):
+        self.flush()